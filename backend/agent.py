@@ -0,0 +1,177 @@
+import argparse
+import hmac
+import os
+import re
+import sys
+import traceback
+from typing import List
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+import uvicorn
+import artifacts
+import nodes
+import system_ops
+from database import AppModel
+
+AGENT_VERSION = "1"
+
+# Shared secret with the controller (stored with the node in the controller's DB)
+TOKEN = os.getenv("BMP_AGENT_TOKEN", "")
+
+# Advertised capacity overrides (--cpus / --memory); None = the real host
+capacity = {"cpus": None, "memory": None}
+
+# App names end up in useradd, rm -rf and unit names on this host
+NAME_PATTERN = re.compile(r"[a-z_][a-z0-9_-]{0,31}")
+
+
+def verify_token(request: Request):
+    expected = f"Bearer {TOKEN}"
+    if not TOKEN or not hmac.compare_digest(request.headers.get("authorization", ""), expected):
+        raise HTTPException(status_code=401, detail="Invalid agent token")
+
+
+def validate_name(name: str):
+    if not NAME_PATTERN.fullmatch(name):
+        raise HTTPException(status_code=400, detail=f"Invalid app name '{name}'")
+
+
+app = FastAPI(dependencies=[Depends(verify_token)])
+
+
+class DeployRequest(BaseModel):
+    app: AppModel
+    wipe: bool = False
+    # Resolved by the controller: this host has no settings table
+    settings: system_ops.DeploySettings = system_ops.DeploySettings()
+
+
+class StatusRequest(BaseModel):
+    names: List[str]
+
+
+class BulkActionRequest(BaseModel):
+    apps: List[str]
+    action: str
+
+
+@app.get("/agent/info")
+def get_info():
+    # Heartbeat: the controller schedules on these numbers
+    return {"version": AGENT_VERSION, **nodes.host_info(capacity["cpus"], capacity["memory"])}
+
+
+@app.post("/agent/statuses")
+async def get_statuses(req: StatusRequest):
+    return await system_ops.get_service_statuses_async(req.names)
+
+
+@app.post("/agent/apps/{name}/deploy")
+def deploy(name: str, req: DeployRequest):
+    validate_name(name)
+    if req.app.name != name:
+        raise HTTPException(status_code=400, detail="App name does not match the URL")
+
+    logs = ""
+    try:
+        if req.wipe:
+            logs += "Wiping directory for clean slate...\n"
+            system_ops.wipe_directory(name, system_ops.app_www(name))
+        # Same pipeline as a local redeploy: user, clone/pull, mise, install, build, unit + restart
+        logs += system_ops.redeploy_app(req.app, settings=req.settings)
+        return {"logs": logs, "commit": req.app.deployed_commit}
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"detail": str(e), "logs": logs})
+
+
+@app.delete("/agent/apps/{name}")
+def remove(name: str):
+    validate_name(name)
+    try:
+        system_ops.remove_systemd_service(name)
+        system_ops.remove_app_user(name)
+        return {"message": "App removed"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/agent/bulk")
+async def bulk_action(req: BulkActionRequest):
+    for name in req.apps:
+        validate_name(name)
+    try:
+        code, output = await system_ops.bulk_service_action_async(req.apps, req.action)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"code": code, "output": output}
+
+
+@app.get("/agent/apps/{name}/logs")
+async def get_logs(name: str, lines: int = 100, namespaced: bool = False):
+    validate_name(name)
+    namespace = f"bmp-{name}" if namespaced else None
+    return {"logs": await system_ops.get_app_logs_async(name, max(1, min(lines, 10000)), namespace)}
+
+
+@app.get("/agent/apps/{name}/resources")
+def get_resources(name: str):
+    validate_name(name)
+    try:
+        return system_ops.get_effective_resource_limits(name)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.put("/agent/apps/{name}/resources")
+def update_resources(name: str, app_model: AppModel):
+    validate_name(name)
+    try:
+        logs = system_ops.apply_resource_limits(app_model)
+        return {"logs": logs, "effective": system_ops.get_effective_resource_limits(name)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def main():
+    global TOKEN
+    parser = argparse.ArgumentParser(description="BMP host agent: runs apps on this host for a BMP controller")
+    parser.add_argument("--host", default=os.getenv("BMP_AGENT_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("BMP_AGENT_PORT", "7100")))
+    parser.add_argument("--token", default=TOKEN, help="Shared secret (default: $BMP_AGENT_TOKEN)")
+    parser.add_argument("--root", help="Keep homes, unit files, journald configs, build artifacts and locks under this directory (several agents on one machine)")
+    parser.add_argument("--fake", action="store_true", help="Emulate systemctl, git and mise (fakes.FakeBackend); requires --root")
+    parser.add_argument("--cpus", type=int, help="Advertise this many CPUs instead of the real count")
+    parser.add_argument("--memory", help="Advertise this much memory instead of the real amount, e.g. 4G")
+    args = parser.parse_args()
+
+    TOKEN = args.token or ""
+    if not TOKEN:
+        sys.exit("An agent token is required (--token or BMP_AGENT_TOKEN)")
+    if args.fake and not args.root:
+        sys.exit("--fake requires --root")
+
+    capacity["cpus"] = args.cpus
+    capacity["memory"] = nodes.parse_memory(args.memory, 0) or None
+
+    if args.fake:
+        import fakes
+        fakes.FakeBackend(os.path.abspath(args.root)).install()
+    elif args.root:
+        root = os.path.abspath(args.root)
+        system_ops.HOME_ROOT = os.path.join(root, "home")
+        system_ops.UNIT_DIR = os.path.join(root, "units")
+        system_ops.LOCK_DIR = os.path.join(root, "locks")
+        system_ops.JOURNALD_CONF_DIR = os.path.join(root, "journald")
+        artifacts.ARTIFACT_DIR = os.path.join(root, "artifacts")
+        for path in (system_ops.HOME_ROOT, system_ops.UNIT_DIR, system_ops.LOCK_DIR, system_ops.JOURNALD_CONF_DIR):
+            os.makedirs(path, exist_ok=True)
+    elif os.geteuid() != 0:
+        print("WARNING: Not running as root. System operations (useradd, systemd) will fail.")
+
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+import hashlib
+import os
+import tarfile
+import threading
+import time
+from typing import Iterable, List, Optional
+import orjson
+import zstandard
+import database
+import metrics
+
+# Finished build outputs, keyed by what produced them; shared by every app on this host
+ARTIFACT_DIR = os.getenv("BMP_ARTIFACT_DIR", os.path.join(os.path.dirname(database.DB_PATH), "artifacts"))
+
+# Store size, overridable via the settings table; least recently used artifacts are evicted beyond it, 0 = store disabled
+DEFAULT_STORE_MB = 2048
+
+KEY_VERSION = "1"  # bump when the archive layout changes, so old artifacts are never unpacked
+ZSTD_LEVEL = 3  # fast enough to pack on every cold build; multi-threaded
+SUFFIX = ".tar.zst"
+
+# Serializes eviction against itself; packing writes a temporary file and renames it into place
+_lock = threading.Lock()
+
+
+def get_budget() -> int:
+    """The store size from the settings table (controller only; agents are sent it with each deploy)."""
+    return database.get_int_setting("artifact_store_mb", DEFAULT_STORE_MB) * 1024 * 1024
+
+
+def build_key(parts: Iterable[str]) -> str:
+    """Content address of a build: the sha256 of everything that determines its output."""
+    return hashlib.sha256("\0".join([KEY_VERSION, *parts]).encode()).hexdigest()
+
+
+def artifact_path(key: str) -> str:
+    return os.path.join(ARTIFACT_DIR, key + SUFFIX)
+
+
+def meta_path(key: str) -> str:
+    return os.path.join(ARTIFACT_DIR, key + ".json")
+
+
+def pack(key: str, source: str, meta: dict, exclude: Iterable[str] = (), budget: Optional[int] = None) -> int:
+    """
+    Streams `source` into a zstd-compressed tarball stored under `key` and returns its size.
+    Top-level entries named in `exclude` are left out; ownership is dropped, the deploy
+    that unpacks the artifact hands the files to its own app user. The store is then
+    evicted down to `budget` (None = the configured one).
+    """
+    exclude = {f"./{name}" for name in exclude}
+
+    def strip(info: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+        if info.name in exclude:
+            return None
+        # Anything unpack's "data" filter refuses (absolute links, links out of the tree) fails the pack,
+        # rather than storing an artifact that can never be restored
+        tarfile.data_filter(info, source)
+        info.uid = info.gid = 0
+        info.uname = info.gname = ""
+        return info
+
+    os.makedirs(ARTIFACT_DIR, exist_ok=True)
+    tmp = f"{artifact_path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1)
+        with open(tmp, "wb") as raw, compressor.stream_writer(raw, closefd=False) as writer:
+            with tarfile.open(fileobj=writer, mode="w|") as tar:
+                tar.add(source, arcname=".", filter=strip)
+        size = os.path.getsize(tmp)
+        with open(meta_path(key), "wb") as f:
+            f.write(orjson.dumps({**meta, "key": key, "size": size, "created": time.time()}))
+        os.replace(tmp, artifact_path(key))
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    metrics.ARTIFACT_OPERATIONS.labels("pack").inc()
+    evict(budget)
+    return size
+
+
+def unpack(key: str, target: str) -> bool:
+    """
+    Extracts the artifact under `key` into `target` (an empty staging directory; the caller
+    moves it into place). Returns False when there is none.
+    The "data" filter refuses absolute paths, links out of the target and device files.
+    """
+    path = artifact_path(key)
+    try:
+        raw = open(path, "rb")
+    except FileNotFoundError:
+        metrics.ARTIFACT_OPERATIONS.labels("miss").inc()
+        return False
+    with raw, zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+        with tarfile.open(fileobj=reader, mode="r|") as tar:
+            tar.extractall(target, filter="data")
+    # The mtime is the LRU clock
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass  # evicted while it was being read
+    metrics.ARTIFACT_OPERATIONS.labels("hit").inc()
+    return True
+
+
+def list_artifacts() -> List[dict]:
+    """Stored artifacts, most recently used first."""
+    try:
+        names = [name for name in os.listdir(ARTIFACT_DIR) if name.endswith(SUFFIX)]
+    except FileNotFoundError:
+        return []
+    artifacts = []
+    for name in names:
+        key = name[:-len(SUFFIX)]
+        try:
+            st = os.stat(artifact_path(key))
+        except FileNotFoundError:
+            continue
+        try:
+            with open(meta_path(key), "rb") as f:
+                meta = orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            meta = {}
+        artifacts.append({**meta, "key": key, "size": st.st_size, "last_used": st.st_mtime})
+    return sorted(artifacts, key=lambda artifact: artifact["last_used"], reverse=True)
+
+
+def remove(key: str):
+    for path in (artifact_path(key), meta_path(key)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def evict(budget: Optional[int] = None) -> List[str]:
+    """Deletes least recently used artifacts until the store fits its budget. Returns the evicted keys."""
+    budget = get_budget() if budget is None else budget
+    evicted = []
+    with _lock:
+        artifacts = list_artifacts()
+        total = sum(artifact["size"] for artifact in artifacts)
+        for artifact in reversed(artifacts):
+            if total <= budget:
+                break
+            remove(artifact["key"])
+            total -= artifact["size"]
+            evicted.append(artifact["key"])
+    if evicted:
+        metrics.ARTIFACT_OPERATIONS.labels("evict").inc(len(evicted))
+    metrics.ARTIFACT_STORE_BYTES.set(total)
+    return evicted
+
+
+def get_report() -> dict:
+    artifacts = list_artifacts()
+    return {
+        "budget_bytes": get_budget(),
+        "total": sum(artifact["size"] for artifact in artifacts),
+        "artifacts": artifacts,
+    }
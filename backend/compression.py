@@ -0,0 +1,127 @@
+import zlib
+import zstandard
+
+# Content types worth compressing; everything else (images, archives) is passed through
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+# Encodings the middleware produces, preferred in this order when the client rates them equally
+SUPPORTED_ENCODINGS = ("zstd", "gzip")
+
+
+def choose_encoding(accept_encoding: str) -> str:
+    """
+    Picks the encoding the client rates highest among zstd and gzip (zstd on a tie), else "" (identity).
+    `*` rates every encoding the header doesn't name; q=0 refuses one.
+    """
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, *params = [token.strip() for token in part.split(";")]
+        if not name:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        offered[name] = q
+
+    best, best_q = "", 0.0
+    for encoding in SUPPORTED_ENCODINGS:
+        q = offered.get(encoding, offered.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    # A client may rate an uncompressed body above every encoding it lists
+    if offered.get("identity", 0.0) > best_q:
+        return ""
+    return best
+
+
+class StreamCompressor:
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=3).compressobj()
+            self._flush_args = (zstandard.COMPRESSOBJ_FLUSH_BLOCK,)
+        else:
+            # wbits 16+MAX_WBITS produces a gzip header/trailer
+            self._obj = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            self._flush_args = (zlib.Z_SYNC_FLUSH,)
+
+    def compress(self, data: bytes) -> bytes:
+        # Flush per chunk so streamed responses (NDJSON) reach the client incrementally
+        return self._obj.compress(data) + self._obj.flush(*self._flush_args)
+
+    def finish(self) -> bytes:
+        return self._obj.flush()
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing JSON/text responses with zstd or gzip.
+    Small responses are sent as-is; streamed responses are compressed chunk by chunk.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if not encoding:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        compressor = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, compressor, passthrough
+
+            if message["type"] == "http.response.start":
+                # Hold the headers back until the first body chunk tells us the size
+                start_message = message
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                response_headers = dict(start_message.get("headers") or [])
+                content_type = response_headers.get(b"content-type", b"").decode("latin-1")
+                eligible = (
+                    b"content-encoding" not in response_headers
+                    and content_type.startswith(COMPRESSIBLE_TYPES)
+                    and (more_body or len(body) >= self.minimum_size)
+                )
+                if not eligible:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                compressor = StreamCompressor(encoding)
+                new_headers = [
+                    (k, v) for k, v in start_message.get("headers") or [] if k.lower() != b"content-length"
+                ]
+                new_headers.append((b"content-encoding", encoding.encode()))
+                new_headers.append((b"vary", b"Accept-Encoding"))
+                await send({**start_message, "headers": new_headers})
+
+            data = compressor.compress(body) if body else b""
+            if not more_body:
+                data += compressor.finish()
+            await send({"type": "http.response.body", "body": data, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,148 @@
+import hashlib
+import json
+import os
+import time
+from typing import List, Optional
+import precompress
+
+# Vite output of the dashboard; Caddy serves it straight from here once a manifest exists
+DIST_PATH = os.path.abspath(
+    os.getenv("BMP_DASHBOARD_DIST", os.path.join(os.path.dirname(__file__), "../frontend/dist"))
+)
+MANIFEST_NAME = "bmp-manifest.json"
+MANIFEST_VERSION = 1
+
+# Vite emits every bundled asset as assets/[name]-[hash][extname] (default assetsDir), so the folder
+# is immutable as a whole, whatever shape the hashes take; public/ files are copied to the root unhashed
+VITE_ASSETS_DIR = "assets"
+
+# Only these reach uvicorn; everything else is a file (or the SPA fallback)
+BACKEND_PATHS = ("/api/*", "/metrics")
+BACKEND_UPSTREAM = "localhost:1323"
+
+# (mtime, manifest) of the last manifest read, so rendering the Caddyfile costs one stat
+_cache: dict = {}
+
+
+def manifest_path(dist: str = DIST_PATH) -> str:
+    return os.path.join(dist, MANIFEST_NAME)
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_immutable_paths(dist: str) -> List[str]:
+    """"/assets/*" for Vite's hashed output, plus any fingerprinted files elsewhere in the bundle."""
+    prefix = f"/{VITE_ASSETS_DIR}/"
+    paths = [prefix + "*"] if os.path.isdir(os.path.join(dist, VITE_ASSETS_DIR)) else []
+    return paths + [path for path in precompress.find_immutable_paths(dist) if not path.startswith(prefix)]
+
+
+def build_manifest(dist: str = DIST_PATH) -> dict:
+    """
+    Run after `npm run build` (manage.py update): writes .zst/.br/.gz siblings for the bundle,
+    finds the fingerprinted assets and records both, with every file's size and digest,
+    in dist/bmp-manifest.json.
+    """
+    if not os.path.isfile(os.path.join(dist, "index.html")):
+        raise Exception(f"No dashboard build found in {dist}")
+
+    stats = precompress.precompress_tree(dist)
+    files = {}
+    for dirpath, _, filenames in os.walk(dist):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if filename == MANIFEST_NAME or precompress.is_sibling(path):
+                continue
+            rel = "/" + os.path.relpath(path, dist).replace(os.sep, "/")
+            files[rel] = {"size": os.path.getsize(path), "sha256": file_digest(path)}
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "built_at": time.time(),
+        "files": dict(sorted(files.items())),
+        "immutable": find_immutable_paths(dist),
+        "encodings": stats["encodings"],
+        "compression": stats,
+    }
+    tmp = f"{manifest_path(dist)}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path(dist))
+    return manifest
+
+
+def load_manifest(dist: str = DIST_PATH) -> Optional[dict]:
+    """
+    Returns the current manifest, or None when the bundle was built without one
+    (e.g. a plain `npm run build`), in which case uvicorn keeps serving the dashboard.
+    """
+    path = manifest_path(dist)
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return None
+    cached = _cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable dashboard manifest {path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    _cache[path] = (mtime, manifest)
+    return manifest
+
+
+def render_site(
+    domain: str, admin_user: Optional[str], admin_pass_hash: Optional[str], dist: str = DIST_PATH
+) -> List[str]:
+    """
+    The dashboard's Caddy site block: API routes go to uvicorn, the bundle is served from disk
+    (precompressed, hashed assets cached for a year, index.html revalidated, SPA fallback).
+    """
+    lines = [f"{domain} {{"]
+
+    # Add Basic Auth if configured (webhooks authenticate with their token instead)
+    if admin_user and admin_pass_hash:
+        lines.append("    @secure {")
+        lines.append("        not path /api/hooks/*")
+        lines.append("    }")
+        lines.append("    basic_auth @secure {")
+        lines.append(f"        {admin_user} {admin_pass_hash}")
+        lines.append("    }")
+
+    manifest = load_manifest(dist)
+    if manifest is None:
+        lines.append(f"    reverse_proxy {BACKEND_UPSTREAM}")
+        lines.append("}")
+        return lines
+
+    lines.append(f"    @backend path {' '.join(BACKEND_PATHS)}")
+    lines.append("    handle @backend {")
+    lines.append(f"        reverse_proxy {BACKEND_UPSTREAM}")
+    lines.append("    }")
+    lines.append("    handle {")
+    lines.append(f"        root * {dist}")
+    lines.append(f'        header ?Cache-Control "{precompress.DEFAULT_CACHE_CONTROL}"')
+    if manifest.get("immutable"):
+        lines.append("        @immutable {")
+        lines.append(f"            path {' '.join(manifest['immutable'])}")
+        lines.append("            file")
+        lines.append("        }")
+        lines.append(f'        header @immutable Cache-Control "{precompress.IMMUTABLE_CACHE_CONTROL}"')
+    lines.append("        try_files {path} /index.html")
+    lines.append("        file_server {")
+    lines.append(f"            precompressed {' '.join(manifest.get('encodings') or ['gzip'])}")
+    lines.append("        }")
+    lines.append("    }")
+    lines.append("}")
+    return lines
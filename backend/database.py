@@ -1,10 +1,11 @@
 import sqlite3
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Iterator
 import uuid
+import metrics
 
 import os
-DB_PATH = os.path.join(os.path.dirname(__file__), "paas.db")
+DB_PATH = os.getenv("BMP_DB_PATH", os.path.join(os.path.dirname(__file__), "paas.db"))
 
 
 class AppModel(BaseModel):
@@ -18,6 +19,112 @@ class AppModel(BaseModel):
     language_version: str
     deploy_token: Optional[str] = None
     status: str = "stopped"
+    # Resource limits (rendered as systemd cgroup properties, None = unlimited)
+    memory_max: Optional[str] = None
+    memory_high: Optional[str] = None
+    cpu_quota: Optional[str] = None
+    cpu_weight: Optional[int] = None
+    io_weight: Optional[int] = None
+    tasks_max: Optional[str] = None
+    # CPU placement ("dedicated", "shared", "best-effort"; None = not pinned)
+    placement_class: Optional[str] = None
+    allowed_cpus: Optional[str] = None
+    allowed_memory_nodes: Optional[str] = None
+    # HTTP health check (None = only the systemd state is reported)
+    health_check_path: Optional[str] = None
+    health_auto_restart: bool = False
+    health: Optional[str] = None  # Runtime only, like status
+    # Multi-node: agent the app is scheduled on (None = the controller host itself)
+    node: Optional[str] = None
+    # Static apps: Cache-Control overrides ("<path> <value>" per line) and the fingerprinted
+    # paths found by the last build (space-separated Caddy patterns, written by the deploy only)
+    cache_rules: Optional[str] = None
+    immutable_paths: Optional[str] = None
+    # Static apps have no process: start/stop toggles the Caddy route, and the deploy records
+    # the build output it published (both written by the platform only, never by the deploy form)
+    static_enabled: bool = True
+    published_root: Optional[str] = None
+    # Reverse-proxy tuning preset (system_ops.PROXY_PROFILES; None = a plain reverse_proxy)
+    proxy_profile: Optional[str] = None
+    # Push webhooks: HMAC secret (GitHub) / token (GitLab), and path prefixes a push must touch
+    webhook_secret: Optional[str] = None
+    watch_paths: Optional[str] = None
+    # journald budget: messages per 30s before journald drops the rest (None = default, 0 = unlimited),
+    # and an own journal namespace (separate files, size cap and journald instance) for chatty apps
+    log_rate_limit_burst: Optional[int] = None
+    log_namespace: bool = False
+    # Commit the last successful deploy built (written by the platform; compared by the git poller)
+    deployed_commit: Optional[str] = None
+
+
+class NodeModel(BaseModel):
+    name: str
+    url: str  # Agent base URL, e.g. http://10.0.0.2:7100; its host is used as the Caddy upstream
+    token: str
+
+
+# Columns added after the initial schema: name -> SQL type
+APP_COLUMN_MIGRATIONS = {
+    "memory_max": "TEXT",
+    "memory_high": "TEXT",
+    "cpu_quota": "TEXT",
+    "cpu_weight": "INTEGER",
+    "io_weight": "INTEGER",
+    "tasks_max": "TEXT",
+    "placement_class": "TEXT",
+    "allowed_cpus": "TEXT",
+    "allowed_memory_nodes": "TEXT",
+    "health_check_path": "TEXT",
+    "health_auto_restart": "INTEGER NOT NULL DEFAULT 0",
+    "node": "TEXT",
+    "cache_rules": "TEXT",
+    "immutable_paths": "TEXT",
+    "static_enabled": "INTEGER NOT NULL DEFAULT 1",
+    "published_root": "TEXT",
+    "proxy_profile": "TEXT",
+    "deployed_commit": "TEXT",
+    "webhook_secret": "TEXT",
+    "watch_paths": "TEXT",
+    "log_rate_limit_burst": "INTEGER",
+    "log_namespace": "INTEGER NOT NULL DEFAULT 0",
+}
+
+# Columns that are copied verbatim between AppModel and the apps table on update
+APP_UPDATE_COLUMNS = [
+    "repo_url",
+    "domain",
+    "build_command",
+    "start_command",
+    "language_version",
+    "deploy_token",
+    "memory_max",
+    "memory_high",
+    "cpu_quota",
+    "cpu_weight",
+    "io_weight",
+    "tasks_max",
+    "placement_class",
+    "allowed_cpus",
+    "allowed_memory_nodes",
+    "health_check_path",
+    "health_auto_restart",
+    "node",
+    "cache_rules",
+    "proxy_profile",
+    "webhook_secret",
+    "watch_paths",
+    "log_rate_limit_burst",
+    "log_namespace",
+]
+
+# Columns a bulk upsert only fills in: None keeps the stored value. Imports never carry the
+# host-specific ones, and the running units still have the stored placement.
+APP_KEPT_COLUMNS = ("deploy_token", "node", "allowed_cpus", "allowed_memory_nodes")
+
+
+def row_to_app(row: sqlite3.Row) -> AppModel:
+    # Unknown columns are ignored by the model, missing ones fall back to defaults
+    return AppModel(**dict(row))
 
 
 def get_db_connection():
@@ -26,11 +133,15 @@ def get_db_connection():
     return conn
 
 
+@metrics.timed_query
 def init_db():
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Create table if not exists
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'apps'")
+    existing = cursor.fetchone() is not None
+
+    # Create table if not exists; columns added since come from APP_COLUMN_MIGRATIONS alone
     cursor.execute(
         """
         CREATE TABLE IF NOT EXISTS apps (
@@ -61,6 +172,12 @@ def init_db():
             token = uuid.uuid4().hex
             cursor.execute("UPDATE apps SET deploy_token = ? WHERE id = ?", (token, row["id"]))
 
+    for column, column_type in APP_COLUMN_MIGRATIONS.items():
+        if column not in columns:
+            if existing:
+                print(f"Migrating DB: Adding {column} column...")
+            cursor.execute(f"ALTER TABLE apps ADD COLUMN {column} {column_type}")
+
     # Create settings table
     cursor.execute(
         """
@@ -71,10 +188,22 @@ def init_db():
     """
     )
 
+    # Host agents (multi-node mode)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS nodes (
+            name TEXT PRIMARY KEY,
+            url TEXT NOT NULL,
+            token TEXT NOT NULL
+        );
+    """
+    )
+
     conn.commit()
     conn.close()
 
 
+@metrics.timed_query
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -84,6 +213,19 @@ def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
     return row["value"] if row else default
 
 
+def get_int_setting(key: str, default: int) -> int:
+    """Like get_setting for integer settings; a value that isn't one falls back to the default."""
+    value = get_setting(key)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        print(f"Warning: Setting {key}={value!r} is not an integer, using {default}")
+        return default
+
+
+@metrics.timed_query
 def set_setting(key: str, value: str):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -95,6 +237,7 @@ def set_setting(key: str, value: str):
     conn.close()
 
 
+@metrics.timed_query
 def get_apps() -> List[AppModel]:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -102,24 +245,10 @@ def get_apps() -> List[AppModel]:
     rows = cursor.fetchall()
     conn.close()
 
-    apps = []
-    for row in rows:
-        apps.append(
-            AppModel(
-                id=row["id"],
-                name=row["name"],
-                repo_url=row["repo_url"],
-                domain=row["domain"],
-                port=row["port"],
-                build_command=row["build_command"],
-                start_command=row["start_command"],
-                language_version=row["language_version"],
-                deploy_token=row["deploy_token"]
-            )
-        )
-    return apps
+    return [row_to_app(row) for row in rows]
 
 
+@metrics.timed_query
 def get_app_by_name(name: str) -> Optional[AppModel]:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -128,20 +257,11 @@ def get_app_by_name(name: str) -> Optional[AppModel]:
     conn.close()
 
     if row:
-        return AppModel(
-            id=row["id"],
-            name=row["name"],
-            repo_url=row["repo_url"],
-            domain=row["domain"],
-            port=row["port"],
-            build_command=row["build_command"],
-            start_command=row["start_command"],
-            language_version=row["language_version"],
-            deploy_token=row["deploy_token"]
-        )
+        return row_to_app(row)
     return None
 
 
+@metrics.timed_query
 def get_app_by_domain(domain: str) -> Optional[AppModel]:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -150,20 +270,11 @@ def get_app_by_domain(domain: str) -> Optional[AppModel]:
     conn.close()
 
     if row:
-        return AppModel(
-            id=row["id"],
-            name=row["name"],
-            repo_url=row["repo_url"],
-            domain=row["domain"],
-            port=row["port"],
-            build_command=row["build_command"],
-            start_command=row["start_command"],
-            language_version=row["language_version"],
-            deploy_token=row["deploy_token"]
-        )
+        return row_to_app(row)
     return None
 
 
+@metrics.timed_query
 def get_app_by_token(token: str) -> Optional[AppModel]:
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -172,20 +283,11 @@ def get_app_by_token(token: str) -> Optional[AppModel]:
     conn.close()
 
     if row:
-        return AppModel(
-            id=row["id"],
-            name=row["name"],
-            repo_url=row["repo_url"],
-            domain=row["domain"],
-            port=row["port"],
-            build_command=row["build_command"],
-            start_command=row["start_command"],
-            language_version=row["language_version"],
-            deploy_token=row["deploy_token"]
-        )
+        return row_to_app(row)
     return None
 
 
+@metrics.timed_query
 def upsert_app(app: AppModel):
     conn = get_db_connection()
     cursor = conn.cursor()
@@ -206,32 +308,184 @@ def upsert_app(app: AppModel):
         if app.deploy_token is None:
             app.deploy_token = current_token
 
-        cursor.execute(
-            """
-            UPDATE apps SET repo_url=?, domain=?, build_command=?, start_command=?, language_version=?, deploy_token=? WHERE name=?
-        """,
-            (app.repo_url, app.domain, app.build_command, app.start_command, app.language_version, app.deploy_token, app.name),
-        )
+        assignments = ", ".join(f"{column}=?" for column in APP_UPDATE_COLUMNS)
+        values = [getattr(app, column) for column in APP_UPDATE_COLUMNS]
+        cursor.execute(f"UPDATE apps SET {assignments} WHERE name=?", (*values, app.name))
     else:
         # Insert
         if not app.deploy_token:
             app.deploy_token = uuid.uuid4().hex
 
-        cursor.execute(
-            """
-            INSERT INTO apps (name, repo_url, domain, port, build_command, start_command, language_version, deploy_token) 
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-            (app.name, app.repo_url, app.domain, app.port, app.build_command, app.start_command, app.language_version, app.deploy_token),
-        )
+        columns = ["name", "port"] + APP_UPDATE_COLUMNS
+        placeholders = ", ".join("?" for _ in columns)
+        values = [getattr(app, column) for column in columns]
+        cursor.execute(f"INSERT INTO apps ({', '.join(columns)}) VALUES ({placeholders})", values)
 
     conn.commit()
     conn.close()
 
 
+@metrics.timed_query
 def delete_app(name: str):
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("DELETE FROM apps WHERE name = ?", (name,))
     conn.commit()
     conn.close()
+
+
+@metrics.timed_query
+def set_app_immutable_paths(name: str, paths: Optional[str]):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE apps SET immutable_paths = ? WHERE name = ?", (paths, name))
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed_query
+def set_app_published_root(name: str, root: Optional[str]):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE apps SET published_root = ?, static_enabled = 1 WHERE name = ?", (root, name))
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed_query
+def set_app_deployed_commit(name: str, commit: Optional[str]):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE apps SET deployed_commit = ? WHERE name = ?", (commit, name))
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed_query
+def set_apps_static_enabled(names: List[str], enabled: bool):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany("UPDATE apps SET static_enabled = ? WHERE name = ?", [(int(enabled), name) for name in names])
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed_query
+def set_app_placements(placements: dict):
+    """
+    Persists {app name: (allowed_cpus, allowed_memory_nodes)} in a single transaction.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "UPDATE apps SET allowed_cpus = ?, allowed_memory_nodes = ? WHERE name = ?",
+        [(cpus, nodes, name) for name, (cpus, nodes) in placements.items()],
+    )
+    conn.commit()
+    conn.close()
+
+
+def iter_apps(batch_size: int = 500) -> Iterator[AppModel]:
+    """
+    Yields apps in id order without loading the whole table, for streaming exports.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM apps ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row_to_app(row)
+    finally:
+        conn.close()
+
+
+@metrics.timed_query
+def get_app_ports() -> dict:
+    """
+    Returns {name: port} for every app in one query.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, port FROM apps")
+    rows = cursor.fetchall()
+    conn.close()
+    return {row["name"]: row["port"] for row in rows}
+
+
+@metrics.timed_query
+def bulk_upsert_apps(apps: List[AppModel], base_domain: Optional[str] = None):
+    """
+    Inserts or updates many apps (and optionally the base domain) in a single transaction.
+    Existing apps keep their port, node and CPU placement, and their token unless the import provides one.
+    Any failure (e.g. a duplicate deploy_token) rolls the whole import back.
+    """
+    columns = ["name", "port"] + APP_UPDATE_COLUMNS
+    placeholders = ", ".join("?" for _ in columns)
+    updates = ", ".join(
+        f"{column}=COALESCE(excluded.{column}, apps.{column})" if column in APP_KEPT_COLUMNS
+        else f"{column}=excluded.{column}"
+        for column in APP_UPDATE_COLUMNS
+    )
+    sql = (
+        f"INSERT INTO apps ({', '.join(columns)}) VALUES ({placeholders}) "
+        f"ON CONFLICT(name) DO UPDATE SET {updates}"
+    )
+
+    conn = get_db_connection()
+    try:
+        with conn:
+            if base_domain is not None:
+                conn.execute(
+                    "INSERT INTO settings (key, value) VALUES ('base_domain', ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                    (base_domain,),
+                )
+            conn.executemany(sql, [[getattr(app, column) for column in columns] for app in apps])
+    finally:
+        conn.close()
+
+
+@metrics.timed_query
+def get_nodes() -> List[NodeModel]:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM nodes ORDER BY name")
+    rows = cursor.fetchall()
+    conn.close()
+    return [NodeModel(**dict(row)) for row in rows]
+
+
+@metrics.timed_query
+def get_node(name: str) -> Optional[NodeModel]:
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM nodes WHERE name = ?", (name,))
+    row = cursor.fetchone()
+    conn.close()
+    return NodeModel(**dict(row)) if row else None
+
+
+@metrics.timed_query
+def upsert_node(node: NodeModel):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "INSERT INTO nodes (name, url, token) VALUES (?, ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET url = excluded.url, token = excluded.token",
+        (node.name, node.url, node.token),
+    )
+    conn.commit()
+    conn.close()
+
+
+@metrics.timed_query
+def delete_node(name: str):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM nodes WHERE name = ?", (name,))
+    conn.commit()
+    conn.close()
@@ -0,0 +1,115 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+import database
+import metrics
+import nodes
+import system_ops
+
+MAX_CONCURRENT_DEPLOYS = 2  # builds are CPU/IO heavy; the rest wait their turn
+RETRY_INTERVAL = 5  # seconds before apps held back by a manual deploy are looked at again
+HISTORY_SIZE = 100
+
+# App name -> request, in arrival order; an app is never pending twice
+PENDING: "OrderedDict[str, dict]" = OrderedDict()
+RUNNING: Dict[str, dict] = {}
+HISTORY: deque = deque(maxlen=HISTORY_SIZE)
+
+_wakeup: Optional[asyncio.Event] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def enqueue(name: str, reason: str) -> bool:
+    """
+    Queues a background redeploy of the app. Returns False when one is already pending,
+    in which case the request is folded into it. An app that is being deployed right now
+    gets one more run afterwards, so the newest commit is always built.
+    Safe to call from worker threads.
+    """
+    entry = PENDING.get(name)
+    if entry is not None:
+        entry["coalesced"] += 1
+        entry["reason"] = reason
+        return False
+    PENDING[name] = {"app": name, "reason": reason, "queued_at": time.time(), "coalesced": 0}
+    metrics.DEPLOY_QUEUE_PENDING.set(len(PENDING))
+    wake()
+    return True
+
+
+def wake():
+    if _loop is None or _wakeup is None:
+        return
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is _loop:
+        _wakeup.set()
+    else:
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def is_queued(name: str) -> bool:
+    return name in PENDING or name in RUNNING
+
+
+async def deploy(name: str, entry: dict):
+    entry["started"] = time.time()
+    try:
+        app = await asyncio.to_thread(database.get_app_by_name, name)
+        if app is None:
+            raise Exception("App no longer exists")
+        await asyncio.to_thread(nodes.redeploy, app)
+        if system_ops.is_static(app):
+            await nodes.update_caddy_config_async()
+        entry["ok"] = True
+        entry["commit"] = app.deployed_commit
+        metrics.QUEUED_DEPLOYS.labels("ok").inc()
+    except Exception as e:
+        entry["ok"] = False
+        entry["error"] = str(e)
+        metrics.QUEUED_DEPLOYS.labels("error").inc()
+        print(f"Warning: Queued redeploy of {name} ({entry['reason']}) failed: {e}")
+    finally:
+        entry["finished"] = time.time()
+        RUNNING.pop(name, None)
+        HISTORY.appendleft(entry)
+        wake()
+
+
+async def run_worker():
+    """
+    Background task: runs queued redeploys, at most MAX_CONCURRENT_DEPLOYS at a time and never
+    two for the same app. Apps locked by a deploy started elsewhere stay queued until it ends.
+    """
+    global _wakeup, _loop
+    _wakeup = asyncio.Event()
+    _loop = asyncio.get_running_loop()
+    tasks = set()
+    while True:
+        _wakeup.clear()
+        for name in list(PENDING):
+            if len(RUNNING) >= MAX_CONCURRENT_DEPLOYS:
+                break
+            if name in RUNNING or system_ops.LockManager(name).is_locked():
+                continue
+            entry = PENDING.pop(name)
+            RUNNING[name] = entry
+            task = asyncio.create_task(deploy(name, entry))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        metrics.DEPLOY_QUEUE_PENDING.set(len(PENDING))
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=RETRY_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def get_report() -> dict:
+    return {
+        "pending": list(PENDING.values()),
+        "running": list(RUNNING.values()),
+        "recent": list(HISTORY),
+    }
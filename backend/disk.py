@@ -0,0 +1,291 @@
+import asyncio
+import os
+import shlex
+import time
+from typing import Dict, List, Optional
+import database
+import metrics
+import system_ops
+
+# Defaults, overridable via the settings table
+DEFAULT_SCAN_INTERVAL = 600  # seconds before an app's cached usage is rescanned
+DEFAULT_APP_BUDGET_MB = 0  # per app; 0 = no budget
+DEFAULT_BUDGET_MB = 0  # all apps together; 0 = no budget
+
+TICK = 5  # seconds between loop iterations; apps marked dirty are rescanned within one tick
+MAX_CACHE_DIRS = 50  # largest cache directories remembered per app as GC candidates
+
+CATEGORIES = ("checkout", "deps", "cache", "runtimes", "trash", "other")
+
+# Regenerated on demand by package managers and build tools, so GC may delete them
+CACHE_DIRS = {".cache", ".npm", ".pnpm-store", ".parcel-cache", ".turbo", "__pycache__", ".pytest_cache"}
+# Installed dependencies: large, but the running app needs them
+DEP_DIRS = {"node_modules", ".venv", "venv", "vendor"}
+
+
+class DiskUsage:
+    __slots__ = ("total", "categories", "files", "caches", "scanned_at", "duration_ms")
+
+    def __init__(self):
+        self.total = 0
+        self.categories = {category: 0 for category in CATEGORIES}
+        self.files = 0
+        self.caches: List[tuple] = []  # (path, bytes), largest first
+        self.scanned_at: Optional[float] = None
+        self.duration_ms: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "total": self.total,
+            "categories": dict(self.categories),
+            "files": self.files,
+            "reclaimable": sum(size for _, size in self.caches) + self.categories["trash"],
+            "scanned_at": self.scanned_at,
+            "duration_ms": self.duration_ms,
+        }
+
+
+# Cached results, served by the API; only the background loop scans
+USAGE: Dict[str, DiskUsage] = {}
+_dirty: set = set()
+last_gc: Optional[dict] = None
+
+
+def mark_dirty(name: str):
+    """Queues the app for a rescan on the next tick (after a deploy, wipe or GC)."""
+    _dirty.add(name)
+
+
+def forget(name: str):
+    USAGE.pop(name, None)
+    _dirty.discard(name)
+
+
+def classify(name: str, parent: str, category: str, top: bool) -> str:
+    """Category of a subdirectory: caches win over everything except trash, the rest is inherited."""
+    if category in ("trash", "cache"):
+        return category
+    if name in CACHE_DIRS or (parent == ".next" and name == "cache"):
+        return "cache"
+    if top:
+        if name == "www":
+            return "checkout"
+        if name == system_ops.TRASH_DIR:
+            return "trash"
+    if name == "mise" and parent == "share":
+        return "runtimes"
+    if name in DEP_DIRS and category in ("checkout", "other"):
+        return "deps"
+    return category
+
+
+def walk(path: str, category: str, usage: DiskUsage, seen: set, top: bool = False) -> int:
+    """
+    Adds the allocated size (st_blocks, like du) of everything under path to usage and returns it.
+    Symlinks are not followed and hard-linked files are counted once.
+    """
+    total = 0
+    parent = os.path.basename(path)
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            st = entry.stat(follow_symlinks=False)
+        except OSError:
+            continue
+        size = st.st_blocks * 512
+        if entry.is_dir(follow_symlinks=False):
+            sub_category = classify(entry.name, parent, category, top)
+            # The (empty) trash directory itself stays behind after a purge, so it isn't reclaimable
+            usage.categories[category if sub_category == "trash" and top else sub_category] += size
+            size += walk(entry.path, sub_category, usage, seen)
+            if sub_category == "cache" and category != "cache":
+                usage.caches.append((entry.path, size))
+        else:
+            if st.st_nlink > 1:
+                if (st.st_dev, st.st_ino) in seen:
+                    continue
+                seen.add((st.st_dev, st.st_ino))
+            usage.categories[category] += size
+            usage.files += 1
+        total += size
+    return total
+
+
+def scan_app(name: str) -> DiskUsage:
+    start = time.perf_counter()
+    usage = DiskUsage()
+    usage.total = walk(system_ops.app_home(name), "other", usage, set(), top=True)
+    usage.caches = sorted(usage.caches, key=lambda item: item[1], reverse=True)[:MAX_CACHE_DIRS]
+    usage.scanned_at = time.time()
+    elapsed = time.perf_counter() - start
+    usage.duration_ms = round(elapsed * 1000, 1)
+    metrics.DISK_SCAN_DURATION.observe(elapsed)
+    return usage
+
+
+def due_apps(apps: List[database.AppModel], interval: float) -> List[str]:
+    """Dirty apps first, then the ones whose last scan is older than the interval."""
+    now = time.time()
+    names = [app.name for app in apps]
+    stale = [
+        name for name in names
+        if name not in _dirty and (name not in USAGE or now - USAGE[name].scanned_at >= interval)
+    ]
+    return [name for name in names if name in _dirty] + stale
+
+
+def scan_due(apps: List[database.AppModel], interval: float) -> int:
+    """Rescans every due app. Runs in a worker thread; one app at a time to keep the IO gentle."""
+    names = due_apps(apps, interval)
+    for name in names:
+        _dirty.discard(name)
+        USAGE[name] = scan_app(name)
+    if names:
+        publish_metrics()
+    return len(names)
+
+
+def publish_metrics():
+    metrics.APP_DISK_BYTES.clear()
+    for name, usage in list(USAGE.items()):
+        for category, size in usage.categories.items():
+            metrics.APP_DISK_BYTES.labels(name, category).set(size)
+
+
+def get_settings() -> tuple:
+    interval = float(database.get_setting("disk_scan_interval", str(DEFAULT_SCAN_INTERVAL)))
+    app_budget = int(database.get_setting("disk_app_budget_mb", str(DEFAULT_APP_BUDGET_MB))) * 1024 * 1024
+    budget = int(database.get_setting("disk_budget_mb", str(DEFAULT_BUDGET_MB))) * 1024 * 1024
+    return max(interval, 10.0), app_budget, budget
+
+
+def delete_cache(name: str, path: str, size: int) -> int:
+    try:
+        system_ops.run_command(f"rm -rf {shlex.quote(path)}")
+    except Exception as e:
+        print(f"Warning: GC failed to delete {path}: {e}")
+        return 0
+    usage = USAGE.get(name)
+    if usage is not None:
+        usage.caches = [item for item in usage.caches if item[0] != path]
+        usage.categories["cache"] = max(0, usage.categories["cache"] - size)
+        usage.total = max(0, usage.total - size)
+    metrics.DISK_GC_RECLAIMED.labels("cache").inc(size)
+    mark_dirty(name)
+    return size
+
+
+def collect(apps: List[database.AppModel], app_budget: int, budget: int) -> dict:
+    """
+    One GC pass over the cached usage:
+    1. the trash of every app (wiped checkouts) is emptied;
+    2. apps above the per-app budget lose their largest cache directories until they fit;
+    3. while all apps together exceed the global budget, the largest remaining caches go, across apps.
+    Checkouts, dependencies and runtimes are never touched, and apps being deployed are skipped.
+    """
+    start = time.perf_counter()
+    reclaimed = {"trash": 0, "cache": 0}
+    deleted = 0
+    busy = {app.name for app in apps if system_ops.LockManager(app.name).is_locked()}
+    names = [app.name for app in apps if app.name in USAGE and app.name not in busy]
+
+    # 1. Trash
+    for name in names:
+        trash = USAGE[name].categories["trash"]
+        if trash:
+            system_ops.purge_trash(name)
+            USAGE[name].categories["trash"] = 0
+            USAGE[name].total = max(0, USAGE[name].total - trash)
+            reclaimed["trash"] += trash
+            metrics.DISK_GC_RECLAIMED.labels("trash").inc(trash)
+            mark_dirty(name)
+
+    # 2. Per-app budget
+    if app_budget:
+        for name in names:
+            usage = USAGE[name]
+            for path, size in list(usage.caches):
+                if usage.total <= app_budget:
+                    break
+                freed = delete_cache(name, path, size)
+                reclaimed["cache"] += freed
+                deleted += 1 if freed else 0
+
+    # 3. Global budget
+    if budget:
+        candidates = sorted(
+            ((size, name, path) for name in names for path, size in USAGE[name].caches),
+            reverse=True,
+        )
+        total = sum(usage.total for usage in USAGE.values())
+        for size, name, path in candidates:
+            if total <= budget:
+                break
+            freed = delete_cache(name, path, size)
+            reclaimed["cache"] += freed
+            deleted += 1 if freed else 0
+            total -= freed
+
+    over_budget = sorted(name for name in names if app_budget and USAGE[name].total > app_budget)
+    metrics.DISK_OVER_BUDGET.set(len(over_budget))
+    total = sum(usage.total for usage in USAGE.values())
+    return {
+        "finished": time.time(),
+        "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        "reclaimed": reclaimed,
+        "deleted_caches": deleted,
+        "over_budget": over_budget,
+        "total": total,
+        "over_global_budget": bool(budget and total > budget),
+    }
+
+
+def run_gc() -> dict:
+    global last_gc
+    apps = local_apps()
+    _, app_budget, budget = get_settings()
+    last_gc = collect(apps, app_budget, budget)
+    for name in last_gc["over_budget"]:
+        print(f"Warning: {name} uses {USAGE[name].total // (1024 * 1024)} MB, above its disk budget, with no caches left to delete")
+    return last_gc
+
+
+def local_apps() -> List[database.AppModel]:
+    # Homes of apps on agent nodes live on those hosts
+    return [app for app in database.get_apps() if app.node is None]
+
+
+def get_report() -> dict:
+    interval, app_budget, budget = get_settings()
+    apps = {name: usage.to_dict() for name, usage in USAGE.items()}
+    for name in _dirty:
+        if name in apps:
+            apps[name]["stale"] = True
+    return {
+        "apps": apps,
+        "total": sum(usage.total for usage in USAGE.values()),
+        "settings": {"scan_interval": interval, "app_budget_bytes": app_budget, "budget_bytes": budget},
+        "last_gc": last_gc,
+    }
+
+
+async def run_collector():
+    """
+    Background task: keeps the per-app usage cache fresh (dirty apps within a tick, every app
+    every `disk_scan_interval` seconds) and runs a GC pass after every round that rescanned something.
+    """
+    while True:
+        try:
+            interval, _, _ = await asyncio.to_thread(get_settings)
+            apps = await asyncio.to_thread(local_apps)
+            known = {app.name for app in apps}
+            for name in [name for name in USAGE if name not in known]:
+                forget(name)
+            if await asyncio.to_thread(scan_due, apps, interval):
+                await asyncio.to_thread(run_gc)
+        except Exception as e:
+            print(f"Warning: Disk accounting failed: {e}")
+        await asyncio.sleep(TICK)
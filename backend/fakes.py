@@ -0,0 +1,308 @@
+import asyncio
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+import artifacts
+import system_ops
+
+# Simulated latency per operation, in seconds
+DEFAULT_DELAYS = {
+    "systemctl": 0.002,  # any systemctl call
+    "daemon-reload": 0.05,
+    "journalctl": 0.005,
+    "useradd": 0.01,
+    "git": 0.05,  # clone / pull
+    "mise": 0.05,  # mise install
+    "build": 0.1,  # mise exec <build command>
+}
+
+
+class FakeBackend(system_ops.CommandBackend):
+    """
+    In-memory stand-in for systemctl, journalctl, useradd/userdel, git and mise.
+    Home directories, clones and unit files are real files under `root`, so the
+    surrounding system_ops code (path checks, unit diffing) runs unchanged.
+
+        backend = fakes.FakeBackend(root)
+        backend.install()
+    """
+
+    def __init__(self, root: str, delays: Optional[dict] = None):
+        self.root = root
+        self.delays = {**DEFAULT_DELAYS, **(delays or {})}
+        self.users = set()
+        self.active = set()  # unit names
+        self.enabled = set()
+        self.calls = {}  # command -> count
+        self.history = []  # argv of every command run, in order
+        self.heads = {}  # repo URL -> commit its HEAD points to (default: derived from the URL)
+        self.changes = {}  # (base, head) -> paths `git diff --name-only` reports (default: none)
+        self.lock = threading.Lock()
+
+    def install(self):
+        """Points system_ops at this backend and at scratch directories under root."""
+        system_ops.HOME_ROOT = os.path.join(self.root, "home")
+        system_ops.UNIT_DIR = os.path.join(self.root, "units")
+        system_ops.LOCK_DIR = os.path.join(self.root, "locks")
+        system_ops.JOURNALD_CONF_DIR = os.path.join(self.root, "journald")
+        artifacts.ARTIFACT_DIR = os.path.join(self.root, "artifacts")
+        for path in (system_ops.HOME_ROOT, system_ops.UNIT_DIR, system_ops.LOCK_DIR, system_ops.JOURNALD_CONF_DIR):
+            os.makedirs(path, exist_ok=True)
+        system_ops.set_backend(self)
+
+    def seed(self, names: List[str], running: bool = True):
+        """Registers existing apps (users, and active units if `running`) without paying any delays."""
+        with self.lock:
+            self.users.update(names)
+            if running:
+                self.active.update(f"{name}.service" for name in names)
+                self.enabled.update(f"{name}.service" for name in names)
+
+    # -- CommandBackend interface --
+
+    def run(self, command: str, cwd=None, env=None) -> tuple:
+        self.history.append(shlex.split(command))
+        returncode, output, delay = self.dispatch(shlex.split(command), cwd)
+        time.sleep(delay)
+        return returncode, output
+
+    def run_exec(self, args: List[str]) -> tuple:
+        self.history.append(list(args))
+        returncode, output, delay = self.dispatch(list(args), None)
+        time.sleep(delay)
+        return returncode, output, ""
+
+    async def run_exec_async(self, args: List[str]) -> tuple:
+        self.history.append(list(args))
+        returncode, output, delay = self.dispatch(list(args), None)
+        await asyncio.sleep(delay)
+        return returncode, output
+
+    def user_exists(self, name: str) -> bool:
+        return name in self.users
+
+    def group_exists(self, name: str) -> bool:
+        return name in self.users
+
+    def remote_head(self, url: str) -> str:
+        return self.heads.get(url) or hashlib.sha1(url.encode()).hexdigest()
+
+    # -- Command emulation --
+
+    def dispatch(self, args: List[str], cwd: Optional[str]) -> tuple:
+        """Returns (returncode, output, delay)."""
+        if not args:
+            return 0, "", 0.0
+        name = os.path.basename(args[0])
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+        if name == "timeout":
+            inner = args[1:]
+            while inner and (inner[0].startswith("-") or inner[0][:1].isdigit()):
+                inner = inner[1:]
+            return self.dispatch(inner, cwd)
+        if name == "git" and "ls-remote" in args:
+            url = args[args.index("ls-remote") + 1]
+            return 0, f"{self.remote_head(url)}\tHEAD\n", self.delays["git"]
+        if name == "git" and "fetch" in args:
+            return 0, "", self.delays["git"]
+        if name == "git" and "diff" in args:
+            return 0, "".join(f"{path}\n" for path in self.changes.get(tuple(args[-2:]), [])), 0.0
+        if name == "runuser" and "--" in args:
+            inner = args[args.index("--") + 1:]
+            if len(inner) >= 3 and os.path.basename(inner[0]) in ("bash", "sh") and inner[1] == "-c":
+                return self.shell(inner[2], cwd)
+            return self.dispatch(inner, cwd)
+        if name == "systemctl":
+            return self.systemctl(args[1:])
+        if name == "journalctl":
+            return self.journalctl(args[1:])
+        if name == "useradd":
+            user, home = args[-1], args[args.index("-d") + 1]
+            with self.lock:
+                self.users.add(user)
+            os.makedirs(home, exist_ok=True)
+            return 0, "", self.delays["useradd"]
+        if name == "userdel":
+            user = args[-1]
+            with self.lock:
+                self.users.discard(user)
+            shutil.rmtree(system_ops.app_home(user), ignore_errors=True)
+            return 0, "", self.delays["useradd"]
+        if name == "rm":
+            for path in args[1:]:
+                if not path.startswith("-") and os.path.abspath(path).startswith(self.root + os.sep):
+                    shutil.rmtree(path, ignore_errors=True)
+            return 0, "", 0.0
+        if name in ("chmod", "chown", "setfacl"):
+            return 0, "", 0.0
+        return 127, f"fake: unsupported command {name}\n", 0.0
+
+    def shell(self, command: str, cwd: Optional[str]) -> tuple:
+        """Commands run as the app user through `bash -c`."""
+        cwd = cwd or self.root
+        if command.startswith("git clone "):
+            _, _, url, dest = shlex.split(command)[:4]
+            os.makedirs(os.path.join(cwd, dest, ".git"), exist_ok=True)
+            with open(os.path.join(cwd, dest, ".git", "remote"), "w") as f:
+                f.write(url)
+            with open(os.path.join(cwd, dest, ".git", "HEAD"), "w") as f:
+                f.write(self.remote_head(url))
+            return 0, f"Cloning into '{dest}'...\n", self.delays["git"]
+        if command == "git remote get-url origin":
+            try:
+                with open(os.path.join(cwd, ".git", "remote")) as f:
+                    return 0, f.read() + "\n", 0.0
+            except FileNotFoundError:
+                return 128, "fatal: not a git repository\n", 0.0
+        if command == "git pull":
+            with open(os.path.join(cwd, ".git", "remote")) as f:
+                head = self.remote_head(f.read())
+            with open(os.path.join(cwd, ".git", "HEAD"), "w") as f:
+                f.write(head)
+            return 0, "Already up to date.\n", self.delays["git"]
+        if command == "git rev-parse HEAD":
+            try:
+                with open(os.path.join(cwd, ".git", "HEAD")) as f:
+                    return 0, f.read() + "\n", 0.0
+            except FileNotFoundError:
+                return 128, "fatal: not a git repository\n", 0.0
+        if command.startswith("echo ") and command.endswith("> .tool-versions"):
+            version = shlex.split(command.rsplit(">", 1)[0])[1]
+            with open(os.path.join(cwd, ".tool-versions"), "w") as f:
+                f.write(version + "\n")
+            return 0, "", 0.0
+        if "mise install" in command:
+            return 0, "mise all runtimes are installed\n", self.delays["mise"]
+        if command.endswith(" ls"):
+            return 0, "node  24.0.0  ~/.tool-versions  24\n", 0.0
+        if " exec " in command:
+            return 0, "build ok\n", self.delays["build"]
+        return 0, "", 0.0
+
+    def systemctl(self, args: List[str]) -> tuple:
+        delay = self.delays["systemctl"]
+        if not args:
+            return 1, "", delay
+        action, units = args[0], [a for a in args[1:] if not a.startswith("-")]
+
+        with self.lock:
+            if action == "is-active":
+                states = ["active" if unit in self.active else "inactive" for unit in units]
+                returncode = 0 if all(state == "active" for state in states) else 3
+                return returncode, "\n".join(states) + "\n", delay
+            if action == "is-enabled":
+                states = ["enabled" if unit in self.enabled else "disabled" for unit in units]
+                returncode = 0 if all(state == "enabled" for state in states) else 1
+                return returncode, "\n".join(states) + "\n", delay
+            if action == "daemon-reload":
+                return 0, "", self.delays["daemon-reload"]
+            if action in ("start", "restart"):
+                missing = [u for u in units if not os.path.exists(os.path.join(system_ops.UNIT_DIR, u))]
+                if missing:
+                    return 5, f"Failed to {action} {missing[0]}: Unit {missing[0]} not found.\n", delay
+                self.active.update(units)
+                return 0, "", delay
+            if action == "stop":
+                self.active.difference_update(units)
+                return 0, "", delay
+            if action == "enable":
+                self.enabled.update(units)
+                if "--now" in args:
+                    self.active.update(units)
+                return 0, "", delay
+            if action == "disable":
+                self.enabled.difference_update(units)
+                if "--now" in args:
+                    self.active.difference_update(units)
+                return 0, "", delay
+            if action in ("set-property", "try-restart"):
+                return 0, "", delay
+            if action == "show":
+                props = []
+                for i, arg in enumerate(args):
+                    if arg == "-p" and i + 1 < len(args):
+                        props += args[i + 1].split(",")
+                # Accounting values are reported as unset, like a unit without CPU accounting
+                return 0, "".join(f"{prop}=[not set]\n" for prop in props), delay
+        return 1, f"fake: unsupported systemctl action {action}\n", delay
+
+    def journalctl(self, args: List[str]) -> tuple:
+        unit = args[args.index("-u") + 1] if "-u" in args else "unknown"
+        lines = int(args[args.index("-n") + 1]) if "-n" in args else 10
+        stamp = time.strftime("%b %d %H:%M:%S")
+        output = "".join(f"{stamp} bench {unit}[1000]: fake log line {i}\n" for i in range(lines))
+        return 0, output, self.delays["journalctl"]
+
+
+class FakeCaddy:
+    """
+    Minimal in-process Caddy admin API: POST /load, POST /adapt and GET /config/.
+    The "adapted" JSON config simply wraps the Caddyfile text.
+
+        caddy = fakes.FakeCaddy(delay=0.01)
+        system_ops.CADDY_ADMIN_URL = caddy.start()
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.loads = 0
+        self.last_config = ""
+        self.server = None
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, like the real admin API
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path == "/adapt":
+                    self.reply(200, json.dumps({"result": fake.adapt(body)}).encode())
+                    return
+                if self.path != "/load":
+                    self.reply(404, b'{"error":"not found"}')
+                    return
+                time.sleep(fake.delay)
+                fake.loads += 1
+                fake.last_config = body.decode(errors="replace")
+                self.reply(200, b"")
+
+            def do_GET(self):
+                if self.path.startswith("/config"):
+                    config = fake.adapt(fake.last_config.encode()) if fake.last_config else None
+                    self.reply(200, json.dumps(config).encode())
+                    return
+                self.reply(404, b'{"error":"not found"}')
+
+            def reply(self, status: int, body: bytes):
+                self.send_response(status)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    @staticmethod
+    def adapt(caddyfile: bytes) -> dict:
+        return {"caddyfile": caddyfile.decode(errors="replace")}
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,247 @@
+import asyncio
+import random
+import re
+import time
+from typing import Dict, List, Optional
+import database
+import deploy_queue
+import metrics
+import system_ops
+import webhooks
+
+# Seconds between checks of each repo, overridable via the settings table; 0 = polling disabled
+DEFAULT_INTERVAL = 0
+MIN_INTERVAL = 15
+
+MAX_CONCURRENT_CHECKS = 8  # git ls-remote processes alive at once, whatever the number of repos
+LS_REMOTE_TIMEOUT = 30  # seconds before a hanging remote is killed
+MAX_BACKOFF = 3600  # seconds; failing repos are retried at interval * 2^failures, capped here
+TICK = 1.0  # seconds between looks at which repos are due
+SYNC_INTERVAL = 10  # seconds between reads of the app list when no repo is due (to pick up new repos)
+# Non-interactive: a remote asking for a password or host key fails instead of hanging
+SSH_COMMAND = "ssh -o BatchMode=yes -o ConnectTimeout=10"
+COMMIT_PATTERN = re.compile(r"[0-9a-f]{40,64}")
+
+
+class RepoState:
+    __slots__ = ("url", "head", "last_checked", "next_check", "failures", "last_error", "checking")
+
+    def __init__(self, url: str, next_check: float):
+        self.url = url
+        self.head: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        self.next_check = next_check
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.checking = False
+
+    def to_dict(self) -> dict:
+        return {
+            "url": self.url,
+            "head": self.head,
+            "last_checked": self.last_checked,
+            "next_check": self.next_check,
+            "failures": self.failures,
+            "last_error": self.last_error,
+        }
+
+
+# One entry per distinct repo URL, however many apps deploy it
+REPOS: Dict[str, RepoState] = {}
+# App name -> (deployed, head) whose changes touch none of the app's watch paths, so they aren't diffed again
+UNWATCHED: Dict[str, tuple] = {}
+_tasks: set = set()
+_next_sync = 0.0
+
+
+def get_interval() -> float:
+    interval = float(database.get_setting("git_poll_interval", str(DEFAULT_INTERVAL)))
+    return max(interval, MIN_INTERVAL) if interval > 0 else 0.0
+
+
+def group_by_repo(apps: List[database.AppModel]) -> Dict[str, List[database.AppModel]]:
+    groups = {}
+    for app in apps:
+        if app.repo_url:
+            groups.setdefault(app.repo_url, []).append(app)
+    return groups
+
+
+def check_user(apps: List[database.AppModel]) -> Optional[str]:
+    """A local app user to run ls-remote as, so its SSH keys and git config apply (None = this process)."""
+    backend = system_ops.get_backend()
+    for app in apps:
+        if app.node is None and backend.user_exists(app.name):
+            return app.name
+    return None
+
+
+async def ls_remote(url: str, user: Optional[str]) -> str:
+    """Returns the commit the remote's HEAD (default branch) points to. One fork, no checkout."""
+    args = ["timeout", "-k", "5", str(LS_REMOTE_TIMEOUT)]
+    if user:
+        args += ["runuser", "-u", user, "--"]
+    args += ["git", "-c", f"core.sshCommand={SSH_COMMAND}", "ls-remote", url, "HEAD"]
+    code, out = await system_ops.run_exec_async(*args)
+    if code != 0:
+        lines = out.strip().splitlines()
+        raise Exception(lines[-1] if lines else f"git ls-remote exited with {code}")
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1] == "HEAD":
+            return parts[0]
+    raise Exception("Remote has no HEAD")
+
+
+async def changed_paths(app: database.AppModel, base: str, head: str) -> Optional[List[str]]:
+    """
+    Files changed between two commits, from the app's checkout: the remote is fetched first
+    (refs only, the working tree is left to the deploy). None when they can't be determined.
+    """
+    if not COMMIT_PATTERN.fullmatch(base) or not COMMIT_PATTERN.fullmatch(head):
+        return None
+    git = ["timeout", "-k", "5", str(LS_REMOTE_TIMEOUT), "runuser", "-u", app.name, "--",
+           "git", "-C", system_ops.app_www(app.name)]
+    code, _ = await system_ops.run_exec_async(*git, "-c", f"core.sshCommand={SSH_COMMAND}", "fetch", "--quiet", "origin")
+    if code != 0:
+        return None
+    code, out = await system_ops.run_exec_async(*git, "diff", "--name-only", base, head)
+    if code != 0:
+        return None
+    return [line for line in out.splitlines() if line]
+
+
+async def outside_watch_paths(app: database.AppModel, deployed: str, head: str) -> bool:
+    """
+    True if nothing between the deployed commit and the head is under the app's watch paths,
+    the same filter push webhooks apply. Apps on agent nodes have no checkout here and always redeploy.
+    """
+    prefixes = webhooks.parse_watch_paths(app.watch_paths)
+    if not prefixes or app.node is not None:
+        return False
+    if UNWATCHED.get(app.name) == (deployed, head):
+        return True
+    paths = await changed_paths(app, deployed, head)
+    if paths is None or webhooks.touches_watch_paths(prefixes, paths):
+        return False
+    UNWATCHED[app.name] = (deployed, head)
+    return True
+
+
+async def compare(head: str, apps: List[database.AppModel]) -> List[str]:
+    """
+    Queues a redeploy of every app whose deployed commit differs from the remote head
+    (for apps with watch paths: by changes under them).
+    """
+    queued = []
+    for app in apps:
+        if deploy_queue.is_queued(app.name) or system_ops.LockManager(app.name).is_locked():
+            continue
+        deployed = app.deployed_commit
+        if deployed is None:
+            # Deployed before commits were recorded: adopt the local checkout's commit once
+            if app.node is not None:
+                continue
+            deployed = await asyncio.to_thread(system_ops.head_commit, app.name)
+            if deployed is None:
+                continue  # never deployed here (e.g. imported without redeploy)
+            await asyncio.to_thread(database.set_app_deployed_commit, app.name, deployed)
+        if deployed != head:
+            # The list was read before this check waited for a slot; a deploy may have finished since
+            fresh = await asyncio.to_thread(database.get_app_by_name, app.name)
+            if fresh is None or fresh.deployed_commit == head:
+                continue
+            # Like push webhooks, only changes under the watch paths redeploy
+            if await outside_watch_paths(fresh, fresh.deployed_commit or deployed, head):
+                continue
+            deploy_queue.enqueue(app.name, f"git poll: {deployed[:12]} -> {head[:12]}")
+            queued.append(app.name)
+    return queued
+
+
+async def check(state: RepoState, apps: List[database.AppModel], interval: float, semaphore: asyncio.Semaphore):
+    try:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                head = await ls_remote(state.url, check_user(apps))
+            except Exception as e:
+                state.failures += 1
+                state.last_error = str(e)
+                backoff = min(interval * 2 ** state.failures, MAX_BACKOFF)
+                state.next_check = time.time() + backoff * random.uniform(0.9, 1.1)
+                metrics.GIT_POLL_CHECKS.labels("error").inc()
+                return
+            finally:
+                state.last_checked = time.time()
+                metrics.GIT_POLL_DURATION.observe(time.perf_counter() - start)
+
+        state.head = head
+        state.failures = 0
+        state.last_error = None
+        state.next_check = time.time() + interval
+        queued = await compare(head, apps)
+        metrics.GIT_POLL_CHECKS.labels("changed" if queued else "unchanged").inc()
+        if queued:
+            print(f"Git poll: {state.url} moved to {head[:12]}, queued {', '.join(queued)}")
+    except Exception as e:
+        print(f"Warning: Git poll of {state.url} failed: {e}")
+    finally:
+        state.checking = False
+
+
+async def start_due(interval: float, semaphore: asyncio.Semaphore) -> int:
+    """Starts a check for every repo whose next check is due. Returns how many were started."""
+    global _next_sync
+    now = time.time()
+    if now < _next_sync and not any(not state.checking and state.next_check <= now for state in REPOS.values()):
+        return 0
+    # Apps are read fresh for each round of checks, so deployed commits are never stale
+    _next_sync = now + SYNC_INTERVAL
+    groups = group_by_repo(await asyncio.to_thread(database.get_apps))
+    for url in [url for url in REPOS if url not in groups]:
+        del REPOS[url]
+    known = {app.name for apps in groups.values() for app in apps}
+    for name in [name for name in UNWATCHED if name not in known]:
+        del UNWATCHED[name]
+
+    started = 0
+    for url, apps in groups.items():
+        state = REPOS.get(url)
+        if state is None:
+            # First checks are spread over one interval so hundreds of repos don't fire together
+            state = REPOS[url] = RepoState(url, now + random.uniform(0, interval))
+        if state.checking or state.next_check > now:
+            continue
+        state.checking = True
+        task = asyncio.create_task(check(state, apps, interval, semaphore))
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+        started += 1
+    return started
+
+
+async def run_poller():
+    """
+    Background task (opt-in via `git_poll_interval`): checks every tracked repo's remote head
+    each interval with a bounded pool of `git ls-remote` processes, and queues a redeploy
+    of the apps whose deployed commit is behind.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+    while True:
+        try:
+            interval = await asyncio.to_thread(get_interval)
+            if interval:
+                await start_due(interval, semaphore)
+            else:
+                REPOS.clear()
+        except Exception as e:
+            print(f"Warning: Git polling failed: {e}")
+        await asyncio.sleep(TICK)
+
+
+def get_report() -> dict:
+    return {
+        "interval": get_interval(),
+        "repos": [state.to_dict() for state in sorted(REPOS.values(), key=lambda state: state.url)],
+    }
@@ -0,0 +1,164 @@
+import asyncio
+import time
+from typing import Dict, List, Optional
+import httpx
+import database
+import metrics
+import nodes
+
+# Defaults, overridable via the settings table
+DEFAULT_INTERVAL = 10  # seconds between probe rounds
+DEFAULT_TIMEOUT = 2.0  # seconds per probe
+
+MAX_CONCURRENT_PROBES = 100
+UNHEALTHY_AFTER = 3  # consecutive failures before an app is unhealthy
+SLOW_FRACTION = 0.5  # answers slower than this share of the timeout count as degraded
+RESTART_COOLDOWN = 120  # minimum seconds between automatic restarts of one app
+
+
+class HealthState:
+    __slots__ = ("status", "response_ms", "consecutive_failures", "last_checked", "last_error", "last_restart")
+
+    def __init__(self):
+        self.status = "healthy"
+        self.response_ms: Optional[float] = None
+        self.consecutive_failures = 0
+        self.last_checked: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_restart: Optional[float] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "response_ms": self.response_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "last_checked": self.last_checked,
+            "last_error": self.last_error,
+            "last_restart": self.last_restart,
+        }
+
+
+STATES: Dict[str, HealthState] = {}
+
+
+def is_probed(app: database.AppModel) -> bool:
+    return bool(app.health_check_path and app.port and ":static" not in (app.language_version or ""))
+
+
+def get_settings() -> tuple:
+    interval = float(database.get_setting("health_interval", str(DEFAULT_INTERVAL)))
+    timeout = float(database.get_setting("health_timeout", str(DEFAULT_TIMEOUT)))
+    return max(interval, 1.0), max(timeout, 0.1)
+
+
+async def probe(client: httpx.AsyncClient, app: database.AppModel, timeout: float, host: str = "127.0.0.1") -> tuple:
+    """
+    Returns (ok, response_ms, error). 2xx and 3xx answers count as healthy.
+    """
+    url = f"http://{host}:{app.port}{app.health_check_path}"
+    start = time.perf_counter()
+    try:
+        response = await client.get(url, timeout=timeout)
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code >= 400:
+            return False, elapsed, f"HTTP {response.status_code}"
+        return True, elapsed, None
+    except httpx.TimeoutException:
+        return False, None, f"Timed out after {timeout}s"
+    except httpx.HTTPError as e:
+        return False, None, str(e) or e.__class__.__name__
+    finally:
+        metrics.HEALTH_PROBE_DURATION.observe(time.perf_counter() - start)
+
+
+def record(state: HealthState, ok: bool, response_ms: Optional[float], error: Optional[str], timeout: float):
+    state.last_checked = time.time()
+    state.response_ms = round(response_ms, 2) if response_ms is not None else None
+    state.last_error = error
+    if ok:
+        state.consecutive_failures = 0
+        slow = response_ms is not None and response_ms > timeout * 1000 * SLOW_FRACTION
+        state.status = "degraded" if slow else "healthy"
+    else:
+        state.consecutive_failures += 1
+        state.status = "unhealthy" if state.consecutive_failures >= UNHEALTHY_AFTER else "degraded"
+
+
+async def check_all(client: httpx.AsyncClient, timeout: float) -> List[str]:
+    """
+    Probes every running app with a health check path concurrently.
+    Returns the apps that were restarted.
+    """
+    apps = [app for app in await asyncio.to_thread(database.get_apps) if is_probed(app)]
+    statuses = await nodes.get_statuses_async(apps)
+    running = [app for app in apps if statuses.get(app.name) == "running"]
+    # Apps on agent nodes are probed over the network, at the same address Caddy proxies to
+    hosts = await asyncio.to_thread(nodes.node_hosts) if any(app.node for app in running) else {}
+
+    # Stopped/deploying apps and removed checks have no health to report
+    for name in set(STATES) - {app.name for app in running}:
+        del STATES[name]
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_PROBES)
+
+    async def limited(app):
+        async with semaphore:
+            return await probe(client, app, timeout, hosts.get(app.node, "127.0.0.1"))
+
+    results = await asyncio.gather(*(limited(app) for app in running))
+
+    now = time.time()
+    restart = []
+    for app, (ok, response_ms, error) in zip(running, results):
+        state = STATES.setdefault(app.name, HealthState())
+        record(state, ok, response_ms, error, timeout)
+        if (
+            state.status == "unhealthy"
+            and app.health_auto_restart
+            and (state.last_restart is None or now - state.last_restart >= RESTART_COOLDOWN)
+        ):
+            restart.append(app)
+            state.last_restart = now
+            # Give the restarted unit a fresh run of probes before judging it again
+            state.consecutive_failures = 0
+
+    if restart:
+        print(f"Health: restarting unhealthy apps: {', '.join(app.name for app in restart)}")
+        rc, out = await nodes.bulk_action_async(restart, "restart")
+        if rc != 0:
+            print(f"Warning: Failed to restart unhealthy apps: {out.strip()}")
+        metrics.HEALTH_RESTARTS.inc(len(restart))
+    return [app.name for app in restart]
+
+
+def get_health(name: str) -> Optional[str]:
+    state = STATES.get(name)
+    return state.status if state else None
+
+
+def get_details(name: str) -> Optional[dict]:
+    state = STATES.get(name)
+    return state.to_dict() if state else None
+
+
+async def run_prober():
+    """
+    Background task: probes all apps every interval, each probe bounded by the timeout.
+    """
+    # One pooled client: keep-alive connections to each app are reused between rounds
+    client = httpx.AsyncClient(
+        follow_redirects=False,
+        limits=httpx.Limits(max_connections=MAX_CONCURRENT_PROBES, max_keepalive_connections=MAX_CONCURRENT_PROBES),
+    )
+    try:
+        while True:
+            start = time.monotonic()
+            interval = DEFAULT_INTERVAL
+            try:
+                interval, timeout = await asyncio.to_thread(get_settings)
+                await check_all(client, timeout)
+            except Exception as e:
+                print(f"Warning: Health probing failed: {e}")
+            await asyncio.sleep(max(0.0, interval - (time.monotonic() - start)))
+    finally:
+        await client.aclose()
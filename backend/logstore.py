@@ -0,0 +1,417 @@
+import asyncio
+import glob
+import os
+import re
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import orjson
+import database
+import metrics
+
+LOG_DIR = os.path.join(os.path.dirname(database.DB_PATH), "logs")
+
+# Defaults, overridable via the settings table
+DEFAULT_RETENTION_DAYS = 14
+DEFAULT_RETENTION_MB = 1024
+
+FLUSH_INTERVAL = 1.0  # seconds between batch commits
+FLUSH_SIZE = 2000  # lines per batch commit
+RETENTION_INTERVAL = 600  # seconds between retention passes
+APPS_CHECK_INTERVAL = 30  # seconds between checks for added/removed apps
+INITIAL_BACKFILL = 5000  # journal lines imported on the very first run
+DROPPED_INTERVAL = 60  # seconds between reads of journald's "Suppressed N messages" notices
+
+# SD_MESSAGE_JOURNAL_DROPPED: logged by journald when a unit exceeds LogRateLimitBurst
+DROPPED_MESSAGE_ID = "a596d6fe7bfa4994828e72309e95d61e"
+SUPPRESSED_RE = re.compile(r"Suppressed (\d+) messages from (?:\S*/)?(\S+)\.service")
+
+# syslog priorities as used by journald's PRIORITY field
+LEVELS = {
+    "emerg": 0, "alert": 1, "crit": 2, "err": 3, "error": 3,
+    "warning": 4, "warn": 4, "notice": 5, "info": 6, "debug": 7,
+}
+LEVEL_NAMES = ["emerg", "alert", "crit", "err", "warning", "notice", "info", "debug"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    id INTEGER PRIMARY KEY,
+    ts INTEGER NOT NULL,
+    app TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    message TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lines_app_ts ON lines (app, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS lines_fts USING fts5(
+    message, content='lines', content_rowid='id', detail=none
+);
+CREATE TRIGGER IF NOT EXISTS lines_ai AFTER INSERT ON lines BEGIN
+    INSERT INTO lines_fts (rowid, message) VALUES (new.id, new.message);
+END;
+"""
+
+
+def partition_name(ts_us: int) -> str:
+    return datetime.fromtimestamp(ts_us / 1_000_000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def partition_path(day: str) -> str:
+    return os.path.join(LOG_DIR, f"{day}.db")
+
+
+def list_partitions() -> List[str]:
+    """Returns partition days, oldest first."""
+    return sorted(os.path.basename(p)[:-3] for p in glob.glob(os.path.join(LOG_DIR, "*.db")))
+
+
+def open_partition(day: str, readonly: bool = False) -> sqlite3.Connection:
+    if readonly:
+        return sqlite3.connect(f"file:{partition_path(day)}?mode=ro", uri=True)
+    os.makedirs(LOG_DIR, exist_ok=True)
+    # The writer flushes from worker threads (one at a time), never concurrently
+    conn = sqlite3.connect(partition_path(day), check_same_thread=False)
+    # WAL lets searches read while the ingester writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_level(level: Optional[str]) -> Optional[int]:
+    if level is None or level == "":
+        return None
+    if level.isdigit():
+        return min(int(level), 7)
+    if level.lower() not in LEVELS:
+        raise ValueError(f"Unknown level '{level}'")
+    return LEVELS[level.lower()]
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """
+    Accepts epoch seconds, ISO 8601, or a relative offset like "15m", "2h", "7d".
+    Returns microseconds since the epoch (journald's resolution).
+    """
+    if value is None or value == "":
+        return None
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if value[-1] in units and value[:-1].isdigit():
+        return int((time.time() - int(value[:-1]) * units[value[-1]]) * 1_000_000)
+    try:
+        return int(float(value) * 1_000_000)
+    except ValueError:
+        pass
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp() * 1_000_000)
+
+
+def fts_query(q: str) -> str:
+    # Every token must match. Tokens are split like FTS5's tokenizer does and quoted one by one,
+    # so FTS5 operators in user input are not interpreted and no phrase query (unsupported
+    # with detail=none) is ever produced.
+    return " ".join(f'"{token}"' for token in re.findall(r"\w+", q))
+
+
+@metrics.timed_query
+def search(app: str, q: Optional[str] = None, since: Optional[int] = None, until: Optional[int] = None,
+           level: Optional[int] = None, limit: int = 200) -> List[dict]:
+    """
+    Returns matching lines for one app, newest first, scanning only partitions in the time range.
+    """
+    results = []
+    since_day = partition_name(since) if since is not None else None
+    until_day = partition_name(until) if until is not None else None
+
+    for day in reversed(list_partitions()):
+        if until_day and day > until_day:
+            continue
+        if since_day and day < since_day:
+            break
+
+        where = ["l.app = ?"]
+        params: list = [app]
+        if since is not None:
+            where.append("l.ts >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("l.ts <= ?")
+            params.append(until)
+        if level is not None:
+            where.append("l.level <= ?")
+            params.append(level)
+
+        match = fts_query(q) if q else ""
+        if match:
+            # Rows are inserted in journal order, so walking the index by descending rowid
+            # yields newest first and lets LIMIT stop the scan early
+            sql = (
+                "SELECT l.ts, l.level, l.message FROM lines_fts JOIN lines l ON l.id = lines_fts.rowid "
+                f"WHERE lines_fts MATCH ? AND {' AND '.join(where)} ORDER BY lines_fts.rowid DESC LIMIT ?"
+            )
+            params = [match] + params
+        else:
+            sql = f"SELECT l.ts, l.level, l.message FROM lines l WHERE {' AND '.join(where)} ORDER BY l.ts DESC LIMIT ?"
+        params.append(limit - len(results))
+
+        try:
+            conn = open_partition(day, readonly=True)
+        except sqlite3.OperationalError:
+            continue  # Removed by retention in the meantime
+        try:
+            for ts, lvl, message in conn.execute(sql, params):
+                results.append({
+                    "ts": datetime.fromtimestamp(ts / 1_000_000, tz=timezone.utc).isoformat(),
+                    "level": LEVEL_NAMES[lvl] if 0 <= lvl < len(LEVEL_NAMES) else str(lvl),
+                    "message": message,
+                })
+        finally:
+            conn.close()
+
+        if len(results) >= limit:
+            break
+    return results
+
+
+def enforce_retention():
+    """
+    Drops whole partitions older than the age limit, then the oldest ones until under the size limit.
+    """
+    days = int(database.get_setting("log_retention_days", str(DEFAULT_RETENTION_DAYS)))
+    max_bytes = int(database.get_setting("log_retention_mb", str(DEFAULT_RETENTION_MB))) * 1024 * 1024
+    cutoff = partition_name(int((time.time() - days * 86400) * 1_000_000))
+
+    def remove(day):
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(partition_path(day) + suffix)
+            except FileNotFoundError:
+                pass
+
+    partitions = list_partitions()
+    for day in [d for d in partitions if d < cutoff]:
+        remove(day)
+        partitions.remove(day)
+
+    def size(day):
+        return sum(os.path.getsize(partition_path(day) + s) for s in ("", "-wal") if os.path.exists(partition_path(day) + s))
+
+    total = sum(size(d) for d in partitions)
+    # Never drop the newest partition: it is the one being written
+    while total > max_bytes and len(partitions) > 1:
+        day = partitions.pop(0)
+        total -= size(day)
+        remove(day)
+
+
+_last_retention: Optional[float] = None
+_last_dropped: Optional[float] = None
+# App name -> messages journald dropped since BMP started (rate limit exceeded)
+DROPPED: Dict[str, int] = {}
+
+
+async def maybe_enforce_retention():
+    global _last_retention
+    if _last_retention is not None and time.monotonic() - _last_retention < RETENTION_INTERVAL:
+        return
+    _last_retention = time.monotonic()
+    try:
+        await asyncio.to_thread(enforce_retention)
+    except Exception as e:
+        print(f"Warning: Log retention failed: {e}")
+
+
+def journal_namespaces(apps: List[database.AppModel]) -> bool:
+    """Whether any local app logs to its own namespace, so journalctl must read all of them."""
+    return any(app.log_namespace and app.node is None for app in apps)
+
+
+def parse_dropped(output: str, apps: set) -> tuple:
+    """Returns ({app: dropped messages}, last cursor) from `journalctl -o json` notices."""
+    dropped: Dict[str, int] = {}
+    cursor = None
+    for line in output.splitlines():
+        try:
+            entry = orjson.loads(line)
+        except orjson.JSONDecodeError:
+            continue
+        cursor = entry.get("__CURSOR", cursor)
+        match = SUPPRESSED_RE.search(entry.get("MESSAGE") or "")
+        if match and match.group(2) in apps:
+            dropped[match.group(2)] = dropped.get(match.group(2), 0) + int(match.group(1))
+    return dropped, cursor
+
+
+async def maybe_count_dropped(apps: set, namespaced: bool):
+    """
+    Adds up the messages journald dropped per app since the last check (one journalctl fork
+    per DROPPED_INTERVAL for all apps; the cursor survives restarts, so nothing is counted twice).
+    """
+    global _last_dropped
+    if _last_dropped is not None and time.monotonic() - _last_dropped < DROPPED_INTERVAL:
+        return
+    _last_dropped = time.monotonic()
+    args = ["journalctl", "-o", "json", "--no-pager", f"MESSAGE_ID={DROPPED_MESSAGE_ID}"]
+    if namespaced:
+        args.append("--namespace=*")
+    cursor = await asyncio.to_thread(database.get_setting, "log_dropped_cursor")
+    args += ["--after-cursor", cursor] if cursor else ["--since", "-1h"]
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL
+        )
+        stdout, _ = await proc.communicate()
+    except OSError as e:
+        print(f"Warning: Counting dropped log messages failed: {e}")
+        return
+    dropped, cursor = parse_dropped(stdout.decode(errors="replace"), apps)
+    for app, count in dropped.items():
+        DROPPED[app] = DROPPED.get(app, 0) + count
+        metrics.LOG_DROPPED.labels(app).inc(count)
+    if cursor:
+        await asyncio.to_thread(database.set_setting, "log_dropped_cursor", cursor)
+
+
+def get_stats() -> dict:
+    partitions = list_partitions()
+    return {
+        "partitions": partitions,
+        "bytes": sum(os.path.getsize(p) for p in glob.glob(os.path.join(LOG_DIR, "*.db*"))),
+        "dropped": dict(DROPPED),
+    }
+
+
+class LogWriter:
+    """Buffers journal entries and commits them per day partition in batches."""
+
+    def __init__(self):
+        self.connections = {}
+        self.pending = []
+        self.cursor = None
+
+    def add(self, entry: dict, apps: set):
+        unit = entry.get("_SYSTEMD_UNIT", "")
+        app = unit[:-len(".service")] if unit.endswith(".service") else unit
+        if app not in apps:
+            return
+        message = entry.get("MESSAGE", "")
+        if isinstance(message, list):
+            # Non-UTF-8 messages are exported as byte arrays
+            message = bytes(message).decode("utf-8", errors="replace")
+        elif message is None:
+            message = ""
+        try:
+            ts = int(entry.get("__REALTIME_TIMESTAMP", 0))
+            level = int(entry.get("PRIORITY", 6))
+        except (TypeError, ValueError):
+            return
+        self.pending.append((ts, app, level, message))
+        self.cursor = entry.get("__CURSOR", self.cursor)
+
+    def flush(self):
+        if not self.pending:
+            return
+        by_day = {}
+        for row in self.pending:
+            by_day.setdefault(partition_name(row[0]), []).append(row)
+
+        for day, rows in by_day.items():
+            conn = self.connections.get(day)
+            if conn is None or not os.path.exists(partition_path(day)):
+                conn = self.connections[day] = open_partition(day)
+            with conn:
+                conn.executemany("INSERT INTO lines (ts, app, level, message) VALUES (?, ?, ?, ?)", rows)
+
+        # Cursor is only advanced once the lines are durable
+        if self.cursor:
+            database.set_setting("log_cursor", self.cursor)
+        self.pending = []
+
+        # Keep only today's/yesterday's writers open
+        for day in sorted(self.connections)[:-2]:
+            self.connections.pop(day).close()
+
+    def close(self):
+        for conn in self.connections.values():
+            conn.close()
+        self.connections = {}
+
+
+async def follow(apps: set, writer: LogWriter, namespaced: bool = False):
+    """
+    Runs one `journalctl -f -o json` for all app units (a single process instead of one per app)
+    until the set of apps changes. With `namespaced`, it reads every journal namespace as well.
+    """
+    args = ["journalctl", "-f", "-o", "json", "--no-pager"]
+    if namespaced:
+        args.append("--namespace=*")
+    for name in sorted(apps):
+        args += ["-u", f"{name}.service"]
+    # Registry reads are sqlite calls, kept off the event loop
+    cursor = await asyncio.to_thread(database.get_setting, "log_cursor")
+    if cursor:
+        args += ["--after-cursor", cursor]
+    else:
+        args += ["-n", str(INITIAL_BACKFILL)]
+
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL, limit=1024 * 1024
+    )
+    last_flush = time.monotonic()
+    last_apps_check = time.monotonic()
+    try:
+        while True:
+            try:
+                line = await asyncio.wait_for(proc.stdout.readline(), timeout=FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                line = None
+            if line == b"":
+                break  # journalctl exited
+            if line:
+                try:
+                    writer.add(orjson.loads(line), apps)
+                except orjson.JSONDecodeError:
+                    pass
+
+            now = time.monotonic()
+            if len(writer.pending) >= FLUSH_SIZE or (writer.pending and now - last_flush >= FLUSH_INTERVAL):
+                await asyncio.to_thread(writer.flush)
+                last_flush = now
+            if now - last_apps_check >= APPS_CHECK_INTERVAL:
+                last_apps_check = now
+                await maybe_enforce_retention()
+                await maybe_count_dropped(apps, namespaced)
+                current = await asyncio.to_thread(database.get_apps)
+                if {app.name for app in current} != apps or journal_namespaces(current) != namespaced:
+                    break
+    finally:
+        await asyncio.to_thread(writer.flush)
+        if proc.returncode is None:
+            proc.terminate()
+            await proc.wait()
+
+
+async def run_ingester():
+    """
+    Background task: tails the journal of every BMP app into the log store and enforces retention.
+    """
+    writer = LogWriter()
+    try:
+        while True:
+            await maybe_enforce_retention()
+
+            current = await asyncio.to_thread(database.get_apps)
+            apps = {app.name for app in current}
+            if not apps:
+                await asyncio.sleep(APPS_CHECK_INTERVAL)
+                continue
+            try:
+                await follow(apps, writer, journal_namespaces(current))
+            except Exception as e:
+                print(f"Warning: Log ingestion failed: {e}")
+            # journalctl exited or apps changed: brief pause avoids a tight respawn loop
+            await asyncio.sleep(1)
+    finally:
+        writer.close()
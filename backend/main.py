@@ -1,38 +1,88 @@
-from fastapi import FastAPI, HTTPException, status, BackgroundTasks
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, HTTPException, status, BackgroundTasks, Request
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
+from typing import List, Optional
 import uvicorn
 import database
 import system_ops
+import placement
+import metrics
+import logstore
+import traffic
+import health
+import profiling
+import reconcile
+import nodes
+import dashboard
+import disk
+import artifacts
+import deploy_queue
+import gitpoll
+import webhooks
+from compression import CompressionMiddleware
 import traceback
 import os
+import hashlib
+import asyncio
+import time
+import uuid
+import orjson
 import psutil
-import subprocess
 import shutil
 from contextlib import asynccontextmanager
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import CONTENT_TYPE_LATEST
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
     database.init_db()
+    load_profiling_settings()
     if os.geteuid() != 0:
         print("WARNING: Not running as root. System operations (useradd, systemd) will fail.")
     if not shutil.which("mise") and not os.path.exists("/usr/local/bin/mise"):
         print("WARNING: Mise not found in PATH or at /usr/local/bin/mise. Deployments will fail.")
-    
-    # Sync Caddy Config on Startup
-    try:
-        system_ops.update_caddy_config()
-        print("Caddy configuration synced successfully.")
-    except Exception as e:
-        print(f"WARNING: Failed to sync Caddy on startup (is Caddy running?): {e}")
+
+    # Caddy, unit files and enablement are brought in line by the reconciler's first pass,
+    # in the background, so the API accepts requests immediately
+    reconciler = asyncio.create_task(reconcile.run_reconciler())
+    # Tail app journals into the searchable log store
+    log_ingester = asyncio.create_task(logstore.run_ingester())
+    # Follow Caddy access logs for per-app traffic analytics
+    traffic_tailer = asyncio.create_task(traffic.run_tailer())
+    # HTTP health checks for apps with a health check path
+    health_prober = asyncio.create_task(health.run_prober())
+    # Heartbeats to host agents (multi-node mode; idle without registered nodes)
+    node_monitor = asyncio.create_task(nodes.run_monitor())
+    # Per-app disk accounting and cache/trash garbage collection
+    disk_collector = asyncio.create_task(disk.run_collector())
+    # Background redeploys (push webhooks, git poller), one at a time per app
+    deploy_worker = asyncio.create_task(deploy_queue.run_worker())
+    # Remote head checks for repos that can't reach the webhook (opt-in via git_poll_interval)
+    git_poller = asyncio.create_task(gitpoll.run_poller())
         
     yield
 
+    tasks = (
+        reconciler, log_ingester, traffic_tailer, health_prober, node_monitor,
+        disk_collector, deploy_worker, git_poller,
+    )
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await system_ops.close_caddy_client()
+    await nodes.close_clients()
+
 
 app = FastAPI(lifespan=lifespan)
+app.add_middleware(CompressionMiddleware, minimum_size=1024)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
 
 # Config - Initialized from env, but can be overridden by DB
 DEFAULT_BASE_DOMAIN = os.getenv("BASE_DOMAIN", "paas.local")
@@ -43,6 +93,11 @@ def get_base_domain():
     return database.get_setting("base_domain", DEFAULT_BASE_DOMAIN)
 
 
+def load_profiling_settings():
+    profiling.settings["enabled"] = database.get_setting("profiling_enabled", "0") == "1"
+    profiling.settings["slow_ms"] = float(database.get_setting("profiling_slow_ms", str(profiling.DEFAULT_SLOW_MS)))
+
+
 class DeployRequest(BaseModel):
     name: str
     repo_url: str
@@ -50,45 +105,159 @@ class DeployRequest(BaseModel):
     build_command: str
     start_command: str
     language_version: str
+    memory_max: Optional[str] = None
+    memory_high: Optional[str] = None
+    cpu_quota: Optional[str] = None
+    cpu_weight: Optional[int] = None
+    io_weight: Optional[int] = None
+    tasks_max: Optional[str] = None
+    placement_class: Optional[str] = None
+    health_check_path: Optional[str] = None
+    health_auto_restart: Optional[bool] = None
+    cache_rules: Optional[str] = None
+    proxy_profile: Optional[str] = None
+    webhook_secret: Optional[str] = None
+    watch_paths: Optional[str] = None
+    log_rate_limit_burst: Optional[int] = None
+    log_namespace: Optional[bool] = None
+
+
+class ResourceLimits(BaseModel):
+    memory_max: Optional[str] = None
+    memory_high: Optional[str] = None
+    cpu_quota: Optional[str] = None
+    cpu_weight: Optional[int] = None
+    io_weight: Optional[int] = None
+    tasks_max: Optional[str] = None
+
+
+class BulkActionRequest(BaseModel):
+    apps: List[str]
+    action: str
+
+
+class NodeRequest(BaseModel):
+    name: str
+    url: str
+    token: str
+
+
+def validate_resource_limits(limits: BaseModel):
+    try:
+        for field in system_ops.RESOURCE_PROPERTIES:
+            system_ops.validate_resource_value(field, getattr(limits, field))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def validate_health_check_path(path: Optional[str]):
+    if path and not path.startswith("/"):
+        raise ValueError(f"Health check path must start with '/', got '{path}'")
+
+
+def json_response(request: Request, payload) -> Response:
+    """
+    Serializes with orjson and tags the body with an ETag, so pollers that send
+    If-None-Match get an empty 304 while nothing (registry or statuses) changed.
+    """
+    body = orjson.dumps(payload)
+    etag = f'W/"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 
 @app.get("/api/apps")
-def get_apps():
+async def get_apps(request: Request):
     try:
-        apps = database.get_apps()
+        apps = await run_in_threadpool(database.get_apps)
+        # One systemctl fork (plus one request per agent node) for the whole list, awaited on the event loop
+        statuses = await nodes.get_statuses_async(apps)
         for app in apps:
-            app.status = system_ops.get_service_status(app.name)
-        return apps
+            app.status = statuses[app.name]
+            app.health = health.get_health(app.name)
+        return json_response(request, [app.dict() for app in apps])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/config")
-def get_config():
-    return {"base_domain": get_base_domain()}
+async def get_config():
+    return {"base_domain": await run_in_threadpool(get_base_domain)}
 
 
 @app.post("/api/config")
-def post_config(config: dict):
+async def post_config(config: dict):
+    integer_keys = (
+        "log_retention_days", "log_retention_mb", "log_namespace_max_mb", "disk_app_budget_mb", "disk_budget_mb",
+        "artifact_store_mb",
+    )
+    for key in integer_keys:
+        if key in config:
+            try:
+                await run_in_threadpool(database.set_setting, key, str(int(config[key])))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"{key} must be an integer")
+    for key in ("health_interval", "health_timeout", "reconcile_interval", "node_interval", "disk_scan_interval", "git_poll_interval"):
+        if key in config:
+            try:
+                await run_in_threadpool(database.set_setting, key, str(float(config[key])))
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail=f"{key} must be a number")
+    if "schedule_on_controller" in config:
+        await run_in_threadpool(database.set_setting, "schedule_on_controller", "1" if config["schedule_on_controller"] else "0")
+
     if "base_domain" in config:
-        database.set_setting("base_domain", config["base_domain"])
+        await run_in_threadpool(database.set_setting, "base_domain", config["base_domain"])
         # Update Caddy because base domain changed
         try:
-            system_ops.update_caddy_config()
+            await nodes.update_caddy_config_async()
         except Exception as e:
             print(f"Warning: Failed to update Caddy after domain change: {e}")
     return {"message": "Config updated"}
 
 
+EXPORT_VERSION = "1.0"
+
+# Host-specific fields that are never carried over by an import
+HOST_SPECIFIC_FIELDS = (
+    "id", "port", "status", "health", "allowed_cpus", "allowed_memory_nodes", "node", "immutable_paths",
+    "static_enabled", "published_root", "deployed_commit",
+)
+
+
+def iter_export_ndjson(chunk_size: int = 500):
+    # Header line first, then one app per line, read from the DB in batches.
+    # Lines are sent in chunks so the compressor sees more than one record per flush.
+    yield orjson.dumps({"kind": "header", "version": EXPORT_VERSION, "base_domain": get_base_domain()}) + b"\n"
+    chunk = []
+    for app in database.iter_apps(chunk_size):
+        chunk.append(orjson.dumps({"kind": "app", **app.dict()}))
+        if len(chunk) >= chunk_size:
+            yield b"\n".join(chunk) + b"\n"
+            chunk = []
+    if chunk:
+        yield b"\n".join(chunk) + b"\n"
+
+
 @app.get("/api/export")
-def export_config():
+def export_config(request: Request, format: str = "json"):
     try:
+        if format == "ndjson":
+            return StreamingResponse(
+                iter_export_ndjson(),
+                media_type="application/x-ndjson",
+                headers={"Content-Disposition": 'attachment; filename="bmp-export.ndjson"'},
+            )
         apps = database.get_apps()
-        return {
-            "version": "1.0",
+        return json_response(request, {
+            "version": EXPORT_VERSION,
             "base_domain": get_base_domain(),
             "apps": [app.dict() for app in apps]
-        }
+        })
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -106,6 +275,8 @@ def validate_config(config: dict):
 
 def redeploy_all_apps(apps_data: list):
     print(f"Starting background redeploy for {len(apps_data)} apps...")
+    # One daemon-reload and one restart call for the whole import instead of one per app
+    batch = system_ops.SystemdBatch()
     for app_data in apps_data:
         try:
             # We need to fetch the full object again to be safe or construct it
@@ -116,73 +287,206 @@ def redeploy_all_apps(apps_data: list):
             app_model = database.get_app_by_name(app_name)
             
             if app_model:
-                system_ops.redeploy_app(app_model)
-                print(f"Successfully redeployed {app_name}")
+                # Apps on agent nodes are rebuilt there; local units share the batch
+                nodes.redeploy(app_model, batch)
+                print(f"Successfully built {app_name}")
             else:
                 print(f"Skipping {app_name}, not found in DB")
                 
         except Exception as e:
             print(f"Failed to redeploy {app_data.get('name')}: {e}")
             traceback.print_exc()
+
+    try:
+        print(batch.flush())
+    except Exception as e:
+        print(f"Failed to restart redeployed services: {e}")
+        traceback.print_exc()
+
+    # Routes follow the new statuses (static sites are only served once published)
+    try:
+        nodes.update_caddy_config()
+    except Exception as e:
+        print(f"Warning: Failed to update Caddy after import: {e}")
     print("Background redeployment complete.")
 
 
+def prepare_import(apps_data: list) -> List[database.AppModel]:
+    """
+    Validates every imported app up front and allocates ports for new apps in one pass.
+    Raises a 400 listing every problem, so nothing is written unless the whole import is valid.
+    """
+    errors = []
+    apps = []
+    seen_names, seen_domains, seen_tokens = set(), {}, {}
+
+    for i, app_data in enumerate(apps_data, start=1):
+        if not isinstance(app_data, dict):
+            errors.append(f"App #{i}: expected an object")
+            continue
+        # IDs and ports would collide on this system; placement is per host
+        app_data = {k: v for k, v in app_data.items() if k not in HOST_SPECIFIC_FIELDS and k != "kind"}
+        try:
+            app_model = database.AppModel(**app_data)
+            for field in system_ops.RESOURCE_PROPERTIES:
+                system_ops.validate_resource_value(field, getattr(app_model, field))
+            validate_health_check_path(app_model.health_check_path)
+            system_ops.parse_cache_rules(app_model.cache_rules)
+        except ValidationError as e:
+            problems = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            errors.append(f"App #{i} ({app_data.get('name', '?')}): {problems}")
+            continue
+        except ValueError as e:
+            errors.append(f"App #{i} ({app_data.get('name', '?')}): {e}")
+            continue
+
+        if app_model.placement_class and app_model.placement_class not in placement.PLACEMENT_CLASSES:
+            errors.append(f"App '{app_model.name}': unknown placement class '{app_model.placement_class}'")
+        if app_model.proxy_profile and app_model.proxy_profile not in system_ops.PROXY_PROFILES:
+            errors.append(f"App '{app_model.name}': unknown proxy profile '{app_model.proxy_profile}'")
+        if app_model.name in seen_names:
+            errors.append(f"App '{app_model.name}' appears more than once")
+        if app_model.domain and seen_domains.setdefault(app_model.domain, app_model.name) != app_model.name:
+            errors.append(f"Domain '{app_model.domain}' is used by both '{seen_domains[app_model.domain]}' and '{app_model.name}'")
+        if app_model.deploy_token and seen_tokens.setdefault(app_model.deploy_token, app_model.name) != app_model.name:
+            errors.append(f"App '{app_model.name}' reuses the deploy token of '{seen_tokens[app_model.deploy_token]}'")
+        seen_names.add(app_model.name)
+        apps.append(app_model)
+
+    # Conflicts with apps already on this system that the import does not replace
+    for existing in database.get_apps():
+        if existing.name in seen_names:
+            continue
+        if existing.domain and existing.domain in seen_domains:
+            errors.append(f"Domain '{existing.domain}' is already in use by application '{existing.name}'")
+        if existing.deploy_token and existing.deploy_token in seen_tokens:
+            errors.append(f"Deploy token of '{seen_tokens[existing.deploy_token]}' is already used by '{existing.name}'")
+
+    if errors:
+        raise HTTPException(status_code=400, detail={"message": "Import rejected, nothing was changed", "errors": errors[:100]})
+
+    # Existing apps keep their port (None is preserved by the upsert); new ones get fresh ports
+    existing_ports = database.get_app_ports()
+    new_apps = [a for a in apps if a.name not in existing_ports]
+    try:
+        ports = system_ops.find_available_ports(len(new_apps), {p for p in existing_ports.values() if p})
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    for app_model, port in zip(new_apps, ports):
+        app_model.port = port
+        app_model.deploy_token = app_model.deploy_token or uuid.uuid4().hex
+
+    # New apps are spread over the nodes; each placement counts against the next one
+    placed = database.get_apps()
+    try:
+        for app_model in new_apps:
+            app_model.node = nodes.schedule(app_model, placed)
+            placed.append(app_model)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return apps
+
+
+def apply_import(apps: List[database.AppModel], base_domain: Optional[str], background_tasks: BackgroundTasks, redeploy: bool) -> dict:
+    # Token: the imported token overwrites (or sets) the DB value so linked webhooks keep working
+    database.bulk_upsert_apps(apps, base_domain)
+
+    try:
+        nodes.update_caddy_config()
+    except Exception as e:
+        print(f"Warning: Failed to update Caddy after import: {e}")
+
+    msg = f"Successfully imported {len(apps)} apps."
+
+    if redeploy and len(apps) > 0:
+        background_tasks.add_task(redeploy_all_apps, [{"name": a.name} for a in apps])
+        msg += " Redeployment started in background."
+    else:
+        msg += " Please redeploy them to ensure they are fully set up."
+
+    return {"message": msg}
+
+
 @app.post("/api/import")
 def import_config(config: dict, background_tasks: BackgroundTasks, redeploy: bool = False):
     try:
-        if config.get("version") != "1.0":
+        if config.get("version") != EXPORT_VERSION:
             raise HTTPException(status_code=400, detail="Unsupported configuration version")
-        
-        if "base_domain" in config:
-            database.set_setting("base_domain", config["base_domain"])
-        
-        apps = config.get("apps", [])
-        for app_data in apps:
-            # 1. ID: Ignore imported ID to avoid primary key conflicts
-            app_data.pop("id", None)
-            
-            # 2. Port: Ignore imported port to avoid collisions on this system
-            app_data.pop("port", None)
-            
-            # Check if app exists to decide on port strategy
-            existing_app = database.get_app_by_name(app_data["name"])
-            
-            if not existing_app:
-                # New App: Must assign a fresh, available port on THIS system
-                app_data["port"] = system_ops.find_available_port()
-                # Note: If existing_app is True, we leave port as None. 
-                # database.upsert_app handles None by preserving the existing DB value.
-
-            # 3. Token: We allow the imported token to overwrite (or set) the DB value.
-            # This ensures GitHub webhooks linked to this config continue working.
-            
-            app = database.AppModel(**app_data)
-            database.upsert_app(app)
-        
+        if not isinstance(config.get("apps", []), list):
+            raise HTTPException(status_code=400, detail="Invalid apps list")
+
+        apps = prepare_import(config.get("apps", []))
+        return apply_import(apps, config.get("base_domain"), background_tasks, redeploy)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+async def read_ndjson(request: Request):
+    """
+    Parses a streamed NDJSON body into (header, [app dicts]), reporting the line of any bad record.
+    """
+    header = None
+    apps_data = []
+    buffer = b""
+    line_no = 0
+
+    def parse(line: bytes):
+        nonlocal header
+        if not line.strip():
+            return
         try:
-            system_ops.update_caddy_config()
-        except Exception as e:
-            print(f"Warning: Failed to update Caddy after import: {e}")
-        
-        msg = f"Successfully imported {len(apps)} apps."
-        
-        if redeploy and len(apps) > 0:
-            background_tasks.add_task(redeploy_all_apps, apps)
-            msg += " Redeployment started in background."
+            record = orjson.loads(line)
+        except orjson.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: invalid JSON ({e})")
+        kind = record.get("kind") if isinstance(record, dict) else None
+        if header is None:
+            if kind != "header":
+                raise HTTPException(status_code=400, detail="Line 1: expected a header record")
+            header = record
+        elif kind == "app":
+            apps_data.append(record)
         else:
-            msg += " Please redeploy them to ensure they are fully set up."
-            
-        return {"message": msg}
+            raise HTTPException(status_code=400, detail=f"Line {line_no}: unexpected record kind '{kind}'")
+
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            parse(line)
+    line_no += 1
+    parse(buffer)
+
+    if header is None:
+        raise HTTPException(status_code=400, detail="Empty import")
+    return header, apps_data
+
+
+@app.post("/api/import/ndjson")
+async def import_ndjson(request: Request, background_tasks: BackgroundTasks, redeploy: bool = False):
+    header, apps_data = await read_ndjson(request)
+    if header.get("version") != EXPORT_VERSION:
+        raise HTTPException(status_code=400, detail="Unsupported configuration version")
+
+    try:
+        # Validation, port scan and the transaction are blocking: keep them off the event loop
+        apps = await run_in_threadpool(prepare_import, apps_data)
+        return await run_in_threadpool(apply_import, apps, header.get("base_domain"), background_tasks, redeploy)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/system-stats")
-def get_system_stats():
+async def get_system_stats():
     try:
         cpu_percent = psutil.cpu_percent(interval=None)
         mem = psutil.virtual_memory()
-        disk = psutil.disk_usage('/')
+        root_disk = psutil.disk_usage('/')
         
         return {
             "cpu_percent": cpu_percent,
@@ -192,64 +496,356 @@ def get_system_stats():
                 "percent": mem.percent
             },
             "disk": {
-                "total": disk.total,
-                "free": disk.free,
-                "percent": disk.percent
+                "total": root_disk.total,
+                "free": root_disk.free,
+                "percent": root_disk.percent,
+                # Sum of the last scan of each local app's home (see /api/disk)
+                "apps": (await run_in_threadpool(disk.get_report))["total"]
             }
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/disk")
+async def get_disk_usage(request: Request):
+    return json_response(request, await run_in_threadpool(disk.get_report))
+
+
+@app.get("/api/apps/{name}/disk")
+async def get_app_disk_usage(name: str):
+    if not await run_in_threadpool(database.get_app_by_name, name):
+        raise HTTPException(status_code=404, detail="App not found")
+    usage = disk.USAGE.get(name)
+    if usage is None:
+        raise HTTPException(status_code=404, detail="App has not been scanned yet")
+    result = usage.to_dict()
+    result["caches"] = [{"path": path, "bytes": size} for path, size in usage.caches]
+    return result
+
+
+@app.post("/api/disk/gc")
+async def run_disk_gc():
+    try:
+        return await run_in_threadpool(disk.run_gc)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/artifacts")
+async def get_artifacts(request: Request):
+    return json_response(request, await run_in_threadpool(artifacts.get_report))
+
+
+@app.delete("/api/artifacts")
+async def clear_artifacts():
+    evicted = await run_in_threadpool(artifacts.evict, 0)
+    return {"message": f"Deleted {len(evicted)} build artifacts"}
+
+
+@app.get("/api/git-poll")
+async def get_git_poll(request: Request):
+    return json_response(request, {**await run_in_threadpool(gitpoll.get_report), "queue": deploy_queue.get_report()})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    # Per-app status gauges are refreshed at scrape time with a single systemctl fork
+    metrics.set_app_statuses(await nodes.get_statuses_async(await run_in_threadpool(database.get_apps)))
+    return Response(content=metrics.render(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/api/apps/{name}")
-def get_app(name: str):
-    app = database.get_app_by_name(name)
+async def get_app(name: str, request: Request):
+    app = await run_in_threadpool(database.get_app_by_name, name)
     if not app:
         raise HTTPException(status_code=404, detail="App not found")
     
-    app.status = system_ops.get_service_status(app.name)
-    return app
+    app.status = await nodes.get_status_async(app)
+    app.health = health.get_health(app.name)
+    return json_response(request, app.dict())
 
 
 @app.get("/api/apps/{name}/logs")
-def get_app_logs(name: str):
+async def get_app_logs(name: str):
     # Security check: ensure app exists to prevent arbitrary service queries
-    if not database.get_app_by_name(name):
+    app_model = await run_in_threadpool(database.get_app_by_name, name)
+    if not app_model:
         raise HTTPException(status_code=404, detail="App not found")
 
     try:
-        # Fetch last 100 lines of logs from journalctl
-        # -u: unit name
-        # -n: number of lines
-        # --no-pager: raw output
-        cmd = ["journalctl", "-u", f"{name}.service", "-n", "100", "--no-pager"]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        return {"logs": result.stdout + result.stderr}
+        # Fetch last 100 lines of logs from journalctl (on the app's node and in its namespace)
+        return {
+            "logs": await nodes.get_logs_async(app_model, 100),
+            # Messages journald dropped since BMP started (local apps only)
+            "dropped": logstore.DROPPED.get(name, 0),
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.delete("/api/apps/{name}")
-def delete_app(name: str):
+@app.get("/api/apps/{name}/resources")
+def get_app_resources(name: str):
+    app_model = database.get_app_by_name(name)
+    if not app_model:
+        raise HTTPException(status_code=404, detail="App not found")
+
+    configured = {field: getattr(app_model, field) for field in system_ops.RESOURCE_PROPERTIES}
+    try:
+        effective = nodes.get_effective_resource_limits(app_model)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"configured": configured, "effective": effective}
+
+
+@app.put("/api/apps/{name}/resources")
+def update_app_resources(name: str, limits: ResourceLimits):
+    app_model = database.get_app_by_name(name)
+    if not app_model:
+        raise HTTPException(status_code=404, detail="App not found")
+    validate_resource_limits(limits)
+
+    previous = app_model.copy()
+    for field in system_ops.RESOURCE_PROPERTIES:
+        setattr(app_model, field, getattr(limits, field))
+
+    # Applied first and persisted only once systemd accepted them, so the DB never holds
+    # limits the unit doesn't have
     try:
-        # 1. Remove Systemd Service
+        # set-property changes the live cgroup, no restart required
+        nodes.apply_resource_limits(app_model)
+    except Exception as e:
         try:
-            system_ops.remove_systemd_service(name)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to remove service: {e}")
+            # The unit file may already carry the new limits; put the recorded ones back
+            nodes.apply_resource_limits(previous)
+        except Exception as restore_error:
+            print(f"Warning: Failed to restore the resource limits of {name}: {restore_error}")
+        raise HTTPException(status_code=500, detail=str(e))
+    database.upsert_app(app_model)
+
+    try:
+        return {"message": "Resource limits updated", "effective": nodes.get_effective_resource_limits(app_model)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/proxy-profiles")
+def get_proxy_profiles():
+    return {
+        "profiles": {
+            name: {
+                "description": profile["description"],
+                "encode": profile["encode"],
+                "proxy": dict(profile["proxy"]),
+                "transport": dict(profile["transport"]),
+            }
+            for name, profile in system_ops.PROXY_PROFILES.items()
+        }
+    }
+
+
+@app.get("/api/placement")
+def get_placement():
+    try:
+        return {
+            "topology": placement.get_topology(),
+            "apps": {
+                app.name: {
+                    "class": app.placement_class,
+                    "allowed_cpus": app.allowed_cpus,
+                    "allowed_memory_nodes": app.allowed_memory_nodes,
+                }
+                for app in database.get_apps()
+                if app.node is None
+            },
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/placement/rebalance")
+def rebalance_placement():
+    try:
+        return placement.rebalance()
+    except Exception as e:
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/nodes")
+def get_nodes():
+    try:
+        return {"nodes": nodes.get_report()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # 2. Remove User
+
+@app.post("/api/nodes")
+async def add_node(req: NodeRequest):
+    """
+    Registers (or updates) a host agent. It is only stored if it answers with the given token;
+    from then on new apps may be scheduled onto it.
+    """
+    if req.name == nodes.LOCAL or not req.name or not all(c.isalnum() or c in "-_." for c in req.name):
+        raise HTTPException(status_code=400, detail=f"Invalid node name '{req.name}'")
+    if not req.url.startswith(("http://", "https://")):
+        raise HTTPException(status_code=400, detail="Node URL must start with http:// or https://")
+
+    node = database.NodeModel(**req.dict())
+    await nodes.forget_node(node.name)
+    await nodes.heartbeat(node)
+    state = nodes.STATES[node.name]
+    if state.status != "online":
+        await nodes.forget_node(node.name)
+        raise HTTPException(status_code=400, detail=f"Agent check failed: {state.last_error}")
+
+    await run_in_threadpool(database.upsert_node, node)
+    return {"message": f"Node {node.name} registered", "info": state.info}
+
+
+@app.delete("/api/nodes/{name}")
+async def remove_node(name: str):
+    if not await run_in_threadpool(database.get_node, name):
+        raise HTTPException(status_code=404, detail="Node not found")
+    placed = [app.name for app in await run_in_threadpool(database.get_apps) if app.node == name]
+    if placed:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Node {name} still runs {len(placed)} app(s): {', '.join(placed[:10])}. Delete them first.",
+        )
+    await run_in_threadpool(database.delete_node, name)
+    await nodes.forget_node(name)
+    return {"message": f"Node {name} removed"}
+
+
+@app.get("/api/apps/{name}/logs/search")
+async def search_app_logs(
+    name: str,
+    q: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    level: Optional[str] = None,
+    limit: int = 200,
+):
+    if not await run_in_threadpool(database.get_app_by_name, name):
+        raise HTTPException(status_code=404, detail="App not found")
+
+    try:
+        since_us = logstore.parse_time(since)
+        until_us = logstore.parse_time(until)
+        max_level = logstore.parse_level(level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    start = time.perf_counter()
+    results = await run_in_threadpool(
+        logstore.search, name, q, since_us, until_us, max_level, max(1, min(limit, 5000))
+    )
+    return {"results": results, "took_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+
+@app.get("/api/logs/stats")
+async def get_log_store_stats():
+    return await run_in_threadpool(logstore.get_stats)
+
+
+@app.get("/api/reconcile")
+async def get_reconcile_report():
+    # None until the first pass after startup has finished
+    return {"last": reconcile.last_report}
+
+
+@app.post("/api/reconcile")
+async def run_reconcile():
+    return await reconcile.reconcile_once()
+
+
+@app.get("/api/profiling")
+async def get_profiling():
+    return {**profiling.settings, "profiles": profiling.list_profiles()}
+
+
+@app.post("/api/profiling")
+async def set_profiling(config: dict):
+    """
+    Admin toggle: {"enabled": true} samples every API request; "slow_ms" sets the slow log threshold.
+    Single requests can be profiled with the `X-BMP-Profile: 1` header instead.
+    """
+    if "enabled" in config:
+        await run_in_threadpool(database.set_setting, "profiling_enabled", "1" if config["enabled"] else "0")
+    if "slow_ms" in config:
         try:
-            system_ops.remove_app_user(name)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to remove user: {e}")
+            await run_in_threadpool(database.set_setting, "profiling_slow_ms", str(float(config["slow_ms"])))
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="slow_ms must be a number")
+    await run_in_threadpool(load_profiling_settings)
+    return profiling.settings
+
+
+@app.get("/api/profiling/slow")
+async def get_slow_requests(limit: int = 50):
+    return {"threshold_ms": profiling.settings["slow_ms"], "requests": profiling.get_slow_log(max(1, limit))}
+
+
+@app.get("/api/profiling/{profile_id}")
+async def get_request_profile(profile_id: str):
+    profile = profiling.get_profile(profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found (only the most recent profiles are kept)")
+    return profile
+
+
+@app.get("/api/apps/{name}/health")
+async def get_app_health(name: str):
+    app = await run_in_threadpool(database.get_app_by_name, name)
+    if not app:
+        raise HTTPException(status_code=404, detail="App not found")
+    return {
+        "status": await nodes.get_status_async(app),
+        "health_check_path": app.health_check_path,
+        "auto_restart": app.health_auto_restart,
+        # None until the first probe, or when the app is not running / has no check
+        "health": health.get_details(name),
+    }
+
+
+@app.get("/api/apps/{name}/traffic")
+async def get_app_traffic(name: str, request: Request):
+    if not await run_in_threadpool(database.get_app_by_name, name):
+        raise HTTPException(status_code=404, detail="App not found")
+    return json_response(request, traffic.get_summary(name))
+
+
+@app.delete("/api/apps/{name}")
+def delete_app(name: str):
+    try:
+        app_model = database.get_app_by_name(name)
+        if app_model and app_model.node:
+            # 1-2. Service and user live on the app's agent
+            try:
+                nodes.remove_remote(app_model)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to remove app from node: {e}")
+        else:
+            # 1. Remove Systemd Service
+            try:
+                system_ops.remove_systemd_service(name)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to remove service: {e}")
+
+            # 2. Remove User
+            try:
+                system_ops.remove_app_user(name)
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Failed to remove user: {e}")
 
         # 3. Remove from DB
         database.delete_app(name)
+        disk.forget(name)
 
         # 4. Update Caddy
         try:
-            system_ops.update_caddy_config()
+            nodes.update_caddy_config()
         except Exception as e:
             print(f"Warning: Failed to update Caddy after delete: {e}")
 
@@ -270,9 +866,38 @@ def deploy(req: DeployRequest):
             status_code=409, 
             detail=f"Domain '{req.domain}' is already in use by application '{existing_domain_owner.name}'"
         )
+    validate_resource_limits(req)
+    # "" clears the placement class, None keeps the current one
+    if req.placement_class and req.placement_class not in placement.PLACEMENT_CLASSES:
+        raise HTTPException(status_code=400, detail=f"Unknown placement class '{req.placement_class}'")
+    if req.proxy_profile and req.proxy_profile not in system_ops.PROXY_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown proxy profile '{req.proxy_profile}'")
+    if req.log_rate_limit_burst is not None and req.log_rate_limit_burst < 0:
+        raise HTTPException(status_code=400, detail="log_rate_limit_burst must be 0 (unlimited) or more")
+    try:
+        validate_health_check_path(req.health_check_path)
+        system_ops.parse_cache_rules(req.cache_rules)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Held for the whole deploy, like redeploy_app: the app reads as 'deploying', and the
+    # reconciler and background redeploys leave it alone until it is done
+    lock = system_ops.LockManager(req.name)
+    try:
+        lock.acquire()
+    except Exception as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    try:
+        return run_deploy(req)
+    finally:
+        lock.release()
 
+
+def run_deploy(req: DeployRequest):
     logs = ""
     is_new_app = False
+    wipe = False
+    app_model = None
     try:
         # 1. DB: Save or Update app
         existing_app = database.get_app_by_name(req.name)
@@ -283,17 +908,42 @@ def deploy(req: DeployRequest):
             # Check if language version changed
             if app_model.language_version != req.language_version:
                 logs += f"Language version changed from {app_model.language_version} to {req.language_version}. Wiping directory for clean slate...\n"
-                try:
-                    system_ops.run_command(f"rm -rf /home/{app_model.name}/www")
-                except Exception as e:
-                    logs += f"Warning: Failed to wipe directory: {e}\n"
+                if app_model.node:
+                    # The checkout lives on the agent, which wipes it before building
+                    wipe = True
+                else:
+                    try:
+                        system_ops.wipe_directory(app_model.name, system_ops.app_www(app_model.name))
+                    except Exception as e:
+                        logs += f"Warning: Failed to wipe directory: {e}\n"
 
             app_model.repo_url = req.repo_url
             app_model.domain = req.domain
             app_model.build_command = req.build_command
             app_model.start_command = req.start_command
             app_model.language_version = req.language_version
-            # Port remains same
+            if req.placement_class is not None:
+                app_model.placement_class = req.placement_class or None
+            if req.health_check_path is not None:
+                app_model.health_check_path = req.health_check_path or None
+            if req.health_auto_restart is not None:
+                app_model.health_auto_restart = req.health_auto_restart
+            if req.cache_rules is not None:
+                app_model.cache_rules = req.cache_rules.strip() or None
+            if req.proxy_profile is not None:
+                app_model.proxy_profile = req.proxy_profile or None
+            if req.webhook_secret is not None:
+                app_model.webhook_secret = req.webhook_secret or None
+            if req.watch_paths is not None:
+                app_model.watch_paths = req.watch_paths.strip() or None
+            if req.log_rate_limit_burst is not None:
+                app_model.log_rate_limit_burst = req.log_rate_limit_burst
+            if req.log_namespace is not None:
+                app_model.log_namespace = req.log_namespace
+            # Port remains same; limits left out of the request keep their current values
+            for field in system_ops.RESOURCE_PROPERTIES:
+                if getattr(req, field) is not None:
+                    setattr(app_model, field, getattr(req, field))
         else:
             is_new_app = True
             port = system_ops.find_available_port()
@@ -305,68 +955,64 @@ def deploy(req: DeployRequest):
                 build_command=req.build_command,
                 start_command=req.start_command,
                 language_version=req.language_version,
+                placement_class=req.placement_class or None,
+                health_check_path=req.health_check_path or None,
+                health_auto_restart=bool(req.health_auto_restart),
+                cache_rules=(req.cache_rules or "").strip() or None,
+                proxy_profile=req.proxy_profile or None,
+                webhook_secret=req.webhook_secret or None,
+                watch_paths=(req.watch_paths or "").strip() or None,
+                log_rate_limit_burst=req.log_rate_limit_burst,
+                log_namespace=bool(req.log_namespace),
+                **{field: getattr(req, field) for field in system_ops.RESOURCE_PROPERTIES},
             )
+            # Multi-node: pick the node with the most free CPU/memory (None = this host)
+            try:
+                app_model.node = nodes.schedule(app_model, database.get_apps())
+            except Exception as e:
+                raise Exception(f"Scheduling failed: {e}")
+            if app_model.node:
+                logs += f"Scheduled on node {app_model.node}.\n"
 
-        database.upsert_app(app_model)
-
-        # 2. User
-        try:
-            is_static = ":static" in (app_model.language_version or "")
-            system_ops.create_app_user(app_model.name, is_static)
-            logs += f"User {app_model.name} ensured.\n"
-        except Exception as e:
-            raise Exception(f"Failed to create user: {e}")
-
-        # 3. Clone/Pull
-        try:
-            out = system_ops.clone_or_pull(app_model)
-            logs += out
-        except Exception as e:
-            raise Exception(str(e))
-
-        # 4. Mise Config
-        try:
-            out = system_ops.configure_mise(app_model)
-            logs += out
-        except Exception as e:
-            raise Exception(str(e))
-
-        # 4.5 Install Dependencies
+        # 1.5 CPU placement (other apps keep their cores until the next rebalance).
+        # Pinning is computed from this host's topology, so apps on agents are not pinned.
         try:
-            out = system_ops.install_dependencies(app_model)
-            logs += out
+            if app_model.node:
+                app_model.allowed_cpus = None
+                app_model.allowed_memory_nodes = None
+            else:
+                placement.place_app(app_model)
         except Exception as e:
-            raise Exception(str(e))
+            logs += f"Warning: CPU placement failed, app will not be pinned: {e}\n"
+            app_model.allowed_cpus = None
+            app_model.allowed_memory_nodes = None
 
-        # 5. Build
-        try:
-            out = system_ops.build_app(app_model)
-            logs += out
-        except Exception as e:
-            raise Exception(str(e))
+        database.upsert_app(app_model)
 
-        # 5.5 Ensure permissions for static files
-        if is_static:
-            logs += "Setting permissions for static files...\n"
+        if app_model.node:
+            # 2-6. User, clone, mise, install, build and unit all run on the app's agent
             try:
-                system_ops.run_command(f"setfacl -R -m u:caddy:rx /home/{app_model.name}/www")
+                with metrics.deploy_step("remote"):
+                    logs += nodes.deploy_remote(app_model, wipe)
             except Exception as e:
-                logs += f"Warning: Failed to set ACLs for caddy: {e}\n"
-
-        # 6. Service (Systemd)
-        try:
-            out = system_ops.create_systemd_service(app_model)
-            logs += out
-        except Exception as e:
-            raise Exception(str(e))
+                raise Exception(str(e))
+        else:
+            # 2-6. User, clone, mise, install/build (or the stored artifact), ACLs and unit: the same
+            # pipeline as every redeploy, run under the lock this request already holds
+            logs += system_ops.deploy_pipeline(app_model)
 
         # 7. Caddy
         try:
-            system_ops.update_caddy_config()
+            with metrics.deploy_step("caddy"):
+                nodes.update_caddy_config()
             logs += "Caddy config updated.\n"
         except Exception as e:
             raise Exception(str(e))
 
+        database.set_app_deployed_commit(app_model.name, app_model.deployed_commit)
+        if app_model.node is None:
+            disk.mark_dirty(app_model.name)
+
         return {"message": "Deployed successfully", "app_url": f"http://{app_model.domain}", "logs": logs}
 
     except Exception as e:
@@ -374,10 +1020,13 @@ def deploy(req: DeployRequest):
         if is_new_app:
             logs += f"\nDeployment failed. Rolling back new app {req.name}...\n"
             try:
-                system_ops.remove_systemd_service(req.name)
-                system_ops.remove_app_user(req.name)
+                if app_model and app_model.node:
+                    nodes.remove_remote(app_model)
+                else:
+                    system_ops.remove_systemd_service(req.name)
+                    system_ops.remove_app_user(req.name)
                 database.delete_app(req.name)
-                system_ops.update_caddy_config()
+                nodes.update_caddy_config()
                 logs += "Rollback successful: User, Service, and DB entry removed.\n"
             except Exception as rollback_e:
                 logs += f"Rollback CRITICAL FAILURE: {rollback_e}\n"
@@ -392,7 +1041,10 @@ def redeploy_app_endpoint(name: str):
         raise HTTPException(status_code=404, detail="App not found")
 
     try:
-        logs = system_ops.redeploy_app(app_model)
+        logs = nodes.redeploy(app_model)
+        if system_ops.is_static(app_model):
+            # Publishing may have changed the root or re-enabled a stopped site
+            nodes.update_caddy_config()
         return {"message": "Redeployed successfully", "logs": logs}
     except Exception as e:
         traceback.print_exc()
@@ -400,48 +1052,113 @@ def redeploy_app_endpoint(name: str):
 
 
 @app.post("/api/apps/{name}/start")
-def start_app_endpoint(name: str):
-    if not database.get_app_by_name(name):
+async def start_app_endpoint(name: str):
+    app_model = await run_in_threadpool(database.get_app_by_name, name)
+    if not app_model:
         raise HTTPException(status_code=404, detail="App not found")
     
     try:
-        system_ops.start_service(name)
-        system_ops.update_caddy_config()
+        await nodes.service_action_async(app_model, "start")
+        await nodes.update_caddy_config_async()
         return {"message": "Service started"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.post("/api/apps/{name}/stop")
-def stop_app_endpoint(name: str):
-    if not database.get_app_by_name(name):
+async def stop_app_endpoint(name: str):
+    app_model = await run_in_threadpool(database.get_app_by_name, name)
+    if not app_model:
         raise HTTPException(status_code=404, detail="App not found")
     
     try:
-        system_ops.stop_service(name)
-        system_ops.update_caddy_config()
+        await nodes.service_action_async(app_model, "stop")
+        await nodes.update_caddy_config_async()
         return {"message": "Service stopped"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/apps/bulk")
+async def bulk_action_endpoint(req: BulkActionRequest):
+    if req.action not in ("start", "stop", "restart"):
+        raise HTTPException(status_code=400, detail=f"Unsupported action '{req.action}'")
+
+    known = {app.name: app for app in await run_in_threadpool(database.get_apps)}
+    results = {}
+    targets = []
+    for name in dict.fromkeys(req.apps):
+        if name not in known:
+            results[name] = {"ok": False, "detail": "App not found"}
+        elif known[name].node is None and system_ops.LockManager(name).is_locked():
+            results[name] = {"ok": False, "detail": "Deployment in progress"}
+        else:
+            targets.append(known[name])
+
+    if targets:
+        # One systemctl invocation per node for the whole batch, one status read to attribute the outcome
+        code, output = await nodes.bulk_action_async(targets, req.action)
+        statuses = await nodes.get_statuses_async(targets)
+        expected = "stopped" if req.action == "stop" else "running"
+        for app_model in targets:
+            name = app_model.name
+            ok = statuses[name] == expected
+            results[name] = {"ok": ok, "status": statuses[name]}
+            if not ok:
+                results[name]["detail"] = output.strip() or f"systemctl {req.action} exited with {code}"
+
+        # A single Caddy reload for the whole batch
+        try:
+            await nodes.update_caddy_config_async()
+        except Exception as e:
+            print(f"Warning: Failed to update Caddy after bulk {req.action}: {e}")
+
+    return {"action": req.action, "results": {name: results[name] for name in dict.fromkeys(req.apps)}}
+
+
 @app.post("/api/hooks/{token}")
-def webhook_deploy(token: str):
-    app_model = database.get_app_by_token(token)
+async def webhook_deploy(token: str, request: Request):
+    """
+    Push webhook (GitHub, GitLab, or a plain POST from a script). The redeploy runs in the
+    background deploy queue, so the hook answers with 202 at once; a burst of pushes collapses
+    into at most one pending redeploy per app, which builds the newest commit.
+    """
+    app_model = await run_in_threadpool(database.get_app_by_token, token)
     if not app_model:
         raise HTTPException(status_code=404, detail="Invalid token")
 
-    try:
-        logs = system_ops.redeploy_app(app_model)
-        return {"message": "Redeployed successfully", "app": app_model.name, "logs": logs}
+    body = await request.body()
+    if not webhooks.verify_signature(app_model, request.headers, body):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
 
-    except Exception as e:
-        traceback.print_exc()
-        return JSONResponse(status_code=500, content={"detail": str(e)})
+    if request.headers.get("x-github-event") == "ping":
+        return {"message": "pong", "app": app_model.name}
+    try:
+        push = webhooks.parse_push(request.headers, body)
+    except ValueError as e:
+        return {"message": "Ignored", "app": app_model.name, "reason": str(e)}
+
+    reason = "webhook"
+    if push is not None:
+        ignored = webhooks.ignore_reason(app_model, push)
+        if ignored:
+            return {"message": "Ignored", "app": app_model.name, "reason": ignored}
+        reason = f"{push.provider} push: {push.after[:12]}"
+
+    queued = deploy_queue.enqueue(app_model.name, reason)
+    return JSONResponse(
+        status_code=202,
+        content={
+            "message": "Redeploy queued" if queued else "Redeploy already pending",
+            "app": app_model.name,
+            "queued": queued,
+        },
+    )
 
 
 # --- Frontend Serving (Must be last) ---
-frontend_path = os.path.join(os.path.dirname(__file__), "../frontend/dist")
+# Fallback for setups without Caddy in front (or a bundle built without `manage.py update`)
+frontend_path = dashboard.DIST_PATH
 
 if os.path.exists(frontend_path):
     # Mount assets (JS/CSS)
@@ -10,7 +10,8 @@ import time
 # Ensure we can import backend modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from backend import system_ops
+import system_ops  # flat name: the same module main.py and the fakes patch
+from backend import dashboard
 
 # ANSI Colors
 BLUE = '\033[0;34m'
@@ -37,6 +38,13 @@ def run_as_owner(cmd_list, cwd=None):
     else:
         subprocess.check_call(cmd_list, cwd=cwd)
 
+def chown_tree(path, uid, gid):
+    for root, dirs, files in os.walk(path):
+        for d in dirs:
+            os.chown(os.path.join(root, d), uid, gid)
+        for f in files:
+            os.chown(os.path.join(root, f), uid, gid)
+
 def check_root():
     if os.geteuid() != 0:
         log("This command requires root privileges. Please run with sudo.", RED)
@@ -132,11 +140,7 @@ def update():
         uid = int(subprocess.check_output(['id', '-u', sudo_user]).strip())
         gid = int(subprocess.check_output(['id', '-g', sudo_user]).strip())
         
-        for root, dirs, files in os.walk('.'):
-             for d in dirs:
-                 os.chown(os.path.join(root, d), uid, gid)
-             for f in files:
-                 os.chown(os.path.join(root, f), uid, gid)
+        chown_tree('.', uid, gid)
 
     # 1. Dependencies
     log("Updating Python dependencies...")
@@ -159,6 +163,19 @@ def update():
     else:
         log("Mise not found, manual node install required.", RED)
 
+    # 2.5 Dashboard manifest: precompressed bundle + fingerprinted assets, served by Caddy from disk
+    log("Precompressing dashboard bundle...")
+    try:
+        manifest = dashboard.build_manifest()
+        stats = manifest["compression"]
+        log(f"Manifest written: {len(manifest['files'])} files, {stats['files']} precompressed "
+            f"({', '.join(stats['encodings'])}) in {stats['duration_ms']} ms, "
+            f"immutable: {' '.join(manifest['immutable']) or 'none'}", GREEN)
+        if sudo_user:
+            chown_tree(dashboard.DIST_PATH, uid, gid)
+    except Exception as e:
+        log(f"Dashboard manifest failed, uvicorn will keep serving the dashboard: {e}", RED)
+
     # 3. Service
     log("Restarting Service...")
     service_file = "/etc/systemd/system/bare-metal-paas.service"
@@ -202,19 +219,13 @@ def update():
         pw_hash = get_env('ADMIN_PASSWORD_HASH')
         
         if domain and user and pw_hash:
+            # Same dashboard block BMP renders itself (it replaces this file's config on startup)
+            site = "\n".join(dashboard.render_site(domain, user, pw_hash))
             caddyfile = f"""{{
     debug
 }}
 
-{domain} {{
-    @secure {{
-        not path /api/hooks/*
-    }}
-    basic_auth @secure {{
-        {user} {pw_hash}
-    }}
-    reverse_proxy localhost:1323
-}}
+{site}
 """
             with open('/etc/caddy/Caddyfile', 'w') as f:
                 f.write(caddyfile)
@@ -227,6 +238,190 @@ def dev():
     python_bin = "./backend/venv/bin/python"
     subprocess.call([python_bin, "backend/main.py"])
 
+def loadtest(url, paths, concurrency, total):
+    """Fire `total` GETs at the running API with `concurrency` in flight and report throughput."""
+    import asyncio
+    import httpx
+
+    async def worker(client, queue, latencies, errors):
+        while True:
+            try:
+                path = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                resp = await client.get(path)
+                if resp.status_code >= 400:
+                    errors.append(resp.status_code)
+            except httpx.HTTPError as e:
+                errors.append(type(e).__name__)
+            latencies.append(time.perf_counter() - start)
+
+    async def run():
+        queue = asyncio.Queue()
+        for i in range(total):
+            queue.put_nowait(paths[i % len(paths)])
+        latencies, errors = [], []
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(client, queue, latencies, errors) for _ in range(concurrency)])
+            elapsed = time.perf_counter() - start
+        return latencies, errors, elapsed
+
+    log(f"Load testing {url} {', '.join(paths)} ({total} requests, concurrency {concurrency})...")
+    latencies, errors, elapsed = asyncio.run(run())
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    log(f"Throughput: {total / elapsed:.1f} req/s over {elapsed:.2f}s", GREEN)
+    log(f"Latency: p50 {pct(0.50):.1f}ms  p95 {pct(0.95):.1f}ms  p99 {pct(0.99):.1f}ms")
+    if errors:
+        log(f"Errors: {len(errors)} (e.g. {errors[0]})", RED)
+
+BENCH_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+def bench(sizes, record, baseline_path=BENCH_BASELINE):
+    """
+    Measure BMP's own scaling (API, deploys, imports, Caddy sync) at several app counts.
+    Runs in-process against fake systemd/git/mise/Caddy backends in a scratch directory,
+    so it needs neither root nor a real server.
+    """
+    import asyncio
+    import json
+    import platform
+    import statistics
+    import tempfile
+
+    root = tempfile.mkdtemp(prefix="bmp-bench-")
+    os.environ["BMP_DB_PATH"] = os.path.join(root, "paas.db")
+    os.environ["BMP_ACCESS_LOG_DIR"] = os.path.join(root, "access")
+    # The backend modules are imported by their flat names, as main.py does
+    import database
+    import traffic
+    database.DB_PATH = os.environ["BMP_DB_PATH"]
+    traffic.ACCESS_LOG_DIR = os.environ["BMP_ACCESS_LOG_DIR"]
+    import fakes
+    import httpx
+    import main as api
+
+    caddy = fakes.FakeCaddy(delay=0.005)
+    system_ops.CADDY_ADMIN_URL = caddy.start()
+
+    def ms(samples):
+        samples = sorted(samples)
+        return {
+            "p50": round(statistics.median(samples) * 1000, 2),
+            "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 2),
+        }
+
+    async def timed(fn, repeat):
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            await fn()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    async def run_size(client, size):
+        # Fresh registry and fake host per size
+        if os.path.exists(database.DB_PATH):
+            os.remove(database.DB_PATH)
+        database.init_db()
+        backend = fakes.FakeBackend(os.path.join(root, f"host-{size}"))
+        backend.install()
+        names = [f"bench-{i}" for i in range(size)]
+        # Seeded ports sit outside the allocation range so deploys still find free ones
+        database.bulk_upsert_apps([
+            database.AppModel(
+                name=name, repo_url=f"https://git.example.com/{name}.git", domain=f"{name}.bench.local",
+                port=20000 + i, build_command="npm run build", start_command="npm start", language_version="node@24",
+            )
+            for i, name in enumerate(names)
+        ])
+        backend.seed(names)
+        repeat = 50 if size <= 100 else 20
+        results = {}
+
+        async def list_apps():
+            resp = await client.get("/api/apps")
+            resp.raise_for_status()
+        await list_apps()
+        results["api_apps_ms"] = ms(await timed(list_apps, repeat))
+
+        async def sync_caddy():
+            await system_ops.update_caddy_config_async()
+        results["caddy_sync_ms"] = ms(await timed(sync_caddy, repeat))
+
+        deploy_count = 0
+
+        async def deploy():
+            nonlocal deploy_count
+            deploy_count += 1
+            name = f"new-{deploy_count}"
+            resp = await client.post("/api/deploy", json={
+                "name": name, "repo_url": f"https://git.example.com/{name}.git", "domain": f"{name}.bench.local",
+                "build_command": "npm run build", "start_command": "npm start", "language_version": "node@24",
+            })
+            resp.raise_for_status()
+        results["deploy_ms"] = ms(await timed(deploy, 5))
+
+        export = (await client.get("/api/export")).json()
+
+        async def reimport():
+            resp = await client.post("/api/import", json=export)
+            resp.raise_for_status()
+        results["import_ms"] = ms(await timed(reimport, 3))
+
+        results["commands"] = dict(sorted(backend.calls.items()))
+        return results
+
+    async def run():
+        transport = httpx.ASGITransport(app=api.app)
+        results = {}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            for size in sizes:
+                log(f"Benchmarking with {size} apps...")
+                results[str(size)] = await run_size(client, size)
+        await system_ops.close_caddy_client()
+        return results
+
+    try:
+        results = asyncio.run(run())
+    finally:
+        caddy.stop()
+        shutil.rmtree(root, ignore_errors=True)
+
+    baseline = None
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f).get("results", {})
+
+    metrics_order = ["api_apps_ms", "caddy_sync_ms", "deploy_ms", "import_ms"]
+    log(f"\n{'apps':>6}  {'metric':<14} {'p50 ms':>10} {'p95 ms':>10}  {'vs baseline':>11}")
+    for size, result in results.items():
+        for metric in metrics_order:
+            p50, p95 = result[metric]["p50"], result[metric]["p95"]
+            delta = ""
+            base = (baseline or {}).get(size, {}).get(metric)
+            if base and base["p50"]:
+                delta = f"{(p50 - base['p50']) / base['p50'] * 100:+.0f}%"
+            print(f"{size:>6}  {metric:<14} {p50:>10.2f} {p95:>10.2f}  {delta:>11}")
+
+    if record:
+        with open(baseline_path, "w") as f:
+            json.dump({
+                "recorded": time.strftime("%Y-%m-%d"),
+                "host": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+                "delays": fakes.DEFAULT_DELAYS,
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        log(f"Baseline written to {baseline_path}", GREEN)
+
 def main():
     parser = argparse.ArgumentParser(description="BareMetal PaaS Management CLI")
     subparsers = parser.add_subparsers(dest='command', required=True)
@@ -234,6 +429,17 @@ def main():
     subparsers.add_parser('install', help="Install the PaaS")
     subparsers.add_parser('update', help="Update the PaaS")
     subparsers.add_parser('dev', help="Run in dev mode")
+
+    loadtest_parser = subparsers.add_parser('loadtest', help="Measure API throughput under concurrent load")
+    loadtest_parser.add_argument('--url', default="http://127.0.0.1:1323")
+    loadtest_parser.add_argument('--path', action='append', dest='paths',
+                                 help="Path to request (repeatable, default: /api/apps)")
+    loadtest_parser.add_argument('--concurrency', type=int, default=200)
+    loadtest_parser.add_argument('--requests', type=int, default=5000)
+
+    bench_parser = subparsers.add_parser('bench', help="Benchmark BMP against fake system backends")
+    bench_parser.add_argument('--sizes', default="10,100,1000", help="Comma-separated app counts")
+    bench_parser.add_argument('--record', action='store_true', help="Save the results as the new baseline")
     
     args = parser.parse_args()
     
@@ -243,6 +449,10 @@ def main():
         update()
     elif args.command == 'dev':
         dev()
+    elif args.command == 'loadtest':
+        loadtest(args.url, args.paths or ["/api/apps"], args.concurrency, args.requests)
+    elif args.command == 'bench':
+        bench([int(size) for size in args.sizes.split(",")], args.record)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,313 @@
+import functools
+import os
+import shlex
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+import profiling
+
+# Own registry so only BMP's metrics (not the default process collectors) are exposed
+REGISTRY = CollectorRegistry()
+
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "bmp_http_request_duration_seconds",
+    "API request latency by route",
+    ["method", "route", "status"],
+    buckets=FAST_BUCKETS + (10.0, 30.0),
+    registry=REGISTRY,
+)
+SUBPROCESS_DURATION = Histogram(
+    "bmp_subprocess_duration_seconds",
+    "Duration of forked commands",
+    ["command"],
+    buckets=FAST_BUCKETS + SLOW_BUCKETS[4:],
+    registry=REGISTRY,
+)
+SUBPROCESS_TOTAL = Counter(
+    "bmp_subprocess_total",
+    "Forked commands by outcome",
+    ["command", "result"],
+    registry=REGISTRY,
+)
+CADDY_APPLY_DURATION = Histogram(
+    "bmp_caddy_apply_duration_seconds",
+    "Time to push a config to the Caddy admin API, including retries",
+    buckets=FAST_BUCKETS + (10.0,),
+    registry=REGISTRY,
+)
+CADDY_APPLY_RETRIES = Counter(
+    "bmp_caddy_apply_retries_total",
+    "Failed Caddy config pushes that were retried",
+    registry=REGISTRY,
+)
+CADDY_APPLY_FAILURES = Counter(
+    "bmp_caddy_apply_failures_total",
+    "Caddy config pushes that failed after all retries",
+    registry=REGISTRY,
+)
+DB_QUERY_DURATION = Histogram(
+    "bmp_db_query_duration_seconds",
+    "SQLite helper duration",
+    ["operation"],
+    buckets=(0.0001, 0.00025, 0.0005) + FAST_BUCKETS,
+    registry=REGISTRY,
+)
+DEPLOY_STEP_DURATION = Histogram(
+    "bmp_deploy_step_duration_seconds",
+    "Duration of each deploy step",
+    ["step"],
+    buckets=SLOW_BUCKETS,
+    registry=REGISTRY,
+)
+ACL_SECONDS_SAVED = Counter(
+    "bmp_static_acl_seconds_saved_total",
+    "setfacl time skipped by static deploys that found their ACLs in place (vs. the app's last full apply)",
+    registry=REGISTRY,
+)
+HEALTH_PROBE_DURATION = Histogram(
+    "bmp_health_probe_duration_seconds",
+    "Duration of HTTP health probes, including failures and timeouts",
+    buckets=FAST_BUCKETS + (10.0,),
+    registry=REGISTRY,
+)
+HEALTH_RESTARTS = Counter(
+    "bmp_health_restarts_total",
+    "Units restarted because they stayed unhealthy",
+    registry=REGISTRY,
+)
+RECONCILE_DURATION = Histogram(
+    "bmp_reconcile_duration_seconds",
+    "Duration of a reconciliation pass",
+    buckets=FAST_BUCKETS + (10.0, 30.0),
+    registry=REGISTRY,
+)
+RECONCILE_DRIFT = Counter(
+    "bmp_reconcile_drift_total",
+    "Differences between desired and actual state found (and corrected) by the reconciler",
+    ["kind"],
+    registry=REGISTRY,
+)
+RECONCILE_LAST_DRIFT = Gauge(
+    "bmp_reconcile_last_drift",
+    "Differences found by the most recent reconciliation pass",
+    ["kind"],
+    registry=REGISTRY,
+)
+RECONCILE_ERRORS = Counter(
+    "bmp_reconcile_errors_total",
+    "Checks or repairs that failed during reconciliation",
+    registry=REGISTRY,
+)
+NODE_UP = Gauge(
+    "bmp_node_up",
+    "1 if the node's agent answered its recent heartbeats",
+    ["node"],
+    registry=REGISTRY,
+)
+AGENT_REQUEST_DURATION = Histogram(
+    "bmp_agent_request_duration_seconds",
+    "Controller calls to host agents, including deploys",
+    ["node"],
+    buckets=FAST_BUCKETS + SLOW_BUCKETS[4:],
+    registry=REGISTRY,
+)
+APP_STATUS = Gauge(
+    "bmp_app_status",
+    "1 for the current status of each app",
+    ["app", "status"],
+    registry=REGISTRY,
+)
+LOG_DROPPED = Counter(
+    "bmp_app_log_dropped_total",
+    "Log messages journald dropped because the app exceeded its rate limit",
+    ["app"],
+    registry=REGISTRY,
+)
+APP_DISK_BYTES = Gauge(
+    "bmp_app_disk_bytes",
+    "Disk usage of each app's home by category, as of its last scan",
+    ["app", "category"],
+    registry=REGISTRY,
+)
+DISK_SCAN_DURATION = Histogram(
+    "bmp_disk_scan_duration_seconds",
+    "Time to scan one app's home directory",
+    buckets=FAST_BUCKETS + (10.0, 30.0, 60.0),
+    registry=REGISTRY,
+)
+DISK_GC_RECLAIMED = Counter(
+    "bmp_disk_gc_reclaimed_bytes_total",
+    "Bytes freed by disk garbage collection",
+    ["kind"],
+    registry=REGISTRY,
+)
+DISK_OVER_BUDGET = Gauge(
+    "bmp_disk_over_budget_apps",
+    "Apps still above the per-app disk budget after the last collection",
+    registry=REGISTRY,
+)
+GIT_POLL_CHECKS = Counter(
+    "bmp_git_poll_checks_total",
+    "Remote head lookups (git ls-remote) by the git poller, by outcome",
+    ["result"],
+    registry=REGISTRY,
+)
+GIT_POLL_DURATION = Histogram(
+    "bmp_git_poll_duration_seconds",
+    "Duration of one git ls-remote, including timeouts",
+    buckets=FAST_BUCKETS + (10.0, 30.0),
+    registry=REGISTRY,
+)
+DEPLOY_QUEUE_PENDING = Gauge(
+    "bmp_deploy_queue_pending",
+    "Redeploys waiting in the background deploy queue",
+    registry=REGISTRY,
+)
+QUEUED_DEPLOYS = Counter(
+    "bmp_queued_deploys_total",
+    "Redeploys run by the background deploy queue, by outcome",
+    ["result"],
+    registry=REGISTRY,
+)
+ARTIFACT_OPERATIONS = Counter(
+    "bmp_build_artifact_operations_total",
+    "Build artifact store lookups (hit/miss), packs and evictions",
+    ["op"],
+    registry=REGISTRY,
+)
+ARTIFACT_STORE_BYTES = Gauge(
+    "bmp_build_artifact_store_bytes",
+    "Size of the build artifact store after the last pack or eviction",
+    registry=REGISTRY,
+)
+
+# Commands reported under their own label; anything else is "other"
+KNOWN_COMMANDS = {
+    "systemctl", "journalctl", "git", "mise", "useradd", "userdel",
+    "setfacl", "chmod", "chown", "rm", "caddy",
+}
+
+
+def command_label(command) -> str:
+    """
+    Maps a command (shell string or argv list) to a low-cardinality label,
+    looking through `runuser -u app -- bash -c '...'`, `timeout` and `mise exec` wrappers.
+    """
+    if isinstance(command, str):
+        try:
+            tokens = shlex.split(command)
+        except ValueError:
+            tokens = command.split()
+    else:
+        tokens = list(command)
+
+    while tokens:
+        name = os.path.basename(tokens[0])
+        if name == "timeout":
+            # `timeout [-k 5] 30 cmd ...`
+            tokens = tokens[1:]
+            while tokens and (tokens[0].startswith("-") or tokens[0][:1].isdigit()):
+                tokens = tokens[1:]
+            continue
+        if name == "runuser" and "--" in tokens:
+            tokens = tokens[tokens.index("--") + 1:]
+            continue
+        if name in ("bash", "sh") and "-c" in tokens:
+            inner = tokens[tokens.index("-c") + 1:]
+            return command_label(inner[0]) if inner else name
+        if name == "eval":
+            # `eval "$(mise activate bash)" && mise install`
+            return "mise"
+        return name if name in KNOWN_COMMANDS else "other"
+    return "other"
+
+
+@contextmanager
+def track_subprocess(command):
+    label = command_label(command)
+    start = time.perf_counter()
+    result = "error"
+    try:
+        yield
+        result = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        SUBPROCESS_DURATION.labels(label).observe(elapsed)
+        SUBPROCESS_TOTAL.labels(label, result).inc()
+        profiling.record_span("subprocess", label, start, elapsed)
+
+
+def timed_query(func):
+    """Decorator recording the duration of a database helper under its function name."""
+    histogram = DB_QUERY_DURATION.labels(func.__name__)
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed)
+            profiling.record_span("db", name, start, elapsed)
+
+    return wrapper
+
+
+@contextmanager
+def deploy_step(step: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        DEPLOY_STEP_DURATION.labels(step).observe(elapsed)
+        profiling.record_span("deploy", step, start, elapsed)
+
+
+def set_app_statuses(statuses: dict):
+    # Rebuilt on every scrape so deleted apps disappear
+    APP_STATUS.clear()
+    for name, status in statuses.items():
+        APP_STATUS.labels(name, status).set(1)
+
+
+def render() -> bytes:
+    return generate_latest(REGISTRY)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency labelled by the matched route template
+    (e.g. /api/apps/{name}) rather than the raw path, to keep cardinality bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_DURATION.labels(scope["method"], path, str(status_code)).observe(
+                time.perf_counter() - start
+            )
@@ -0,0 +1,502 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+import httpx
+import psutil
+import database
+import disk
+import metrics
+import profiling
+import system_ops
+from database import AppModel, NodeModel
+
+# Defaults, overridable via the settings table
+DEFAULT_INTERVAL = 10  # seconds between heartbeats
+
+OFFLINE_AFTER = 3  # missed heartbeats before a node is offline
+AGENT_TIMEOUT = 10.0  # seconds, for status/control calls
+DEPLOY_TIMEOUT = 1800.0  # seconds; the whole clone/install/build runs inside one agent request
+LOCAL = "local"  # how the controller host is listed next to the agents
+
+MEMORY_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+# What an app without limits is assumed to need when scheduling, so unlimited apps still spread out
+DEFAULT_CPU_REQUEST = 0.1  # cores
+DEFAULT_MEMORY_REQUEST = 256 * 1024 ** 2  # bytes
+
+
+class NodeState:
+    __slots__ = ("status", "info", "last_seen", "consecutive_failures", "last_error")
+
+    def __init__(self):
+        self.status = "unknown"  # until the first heartbeat answers
+        self.info: Optional[dict] = None
+        self.last_seen: Optional[float] = None
+        self.consecutive_failures = 0
+        self.last_error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "info": self.info,
+            "last_seen": self.last_seen,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+STATES: Dict[str, NodeState] = {}
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+# -- Capacity --
+
+def parse_memory(value: Optional[str], total: int) -> int:
+    """
+    Bytes for a systemd memory value ("512M", "2G", "25%" of total); 0 for unset, infinity or garbage.
+    """
+    if not value or value == "infinity":
+        return 0
+    text = value.strip().upper()
+    try:
+        if text.endswith("%"):
+            return int(total * float(text[:-1]) / 100)
+        if text[-1] in MEMORY_UNITS:
+            return int(float(text[:-1]) * MEMORY_UNITS[text[-1]])
+        return int(text)
+    except ValueError:
+        return 0
+
+
+def parse_cpu_quota(value: Optional[str]) -> float:
+    """Cores for a CPUQuota value ("150%" = 1.5 cores); 0 for unset."""
+    if not value:
+        return 0.0
+    try:
+        return float(value.strip().rstrip("%")) / 100
+    except ValueError:
+        return 0.0
+
+
+def host_info(cpus: Optional[int] = None, memory: Optional[int] = None) -> dict:
+    """
+    Capacity and usage of this host, as sent in agent heartbeats.
+    `cpus`/`memory` override the advertised capacity (several agents sharing one test machine);
+    measured usage is scaled to it.
+    """
+    mem = psutil.virtual_memory()
+    total_cpus = cpus or psutil.cpu_count() or 1
+    total_memory = memory or mem.total
+    return {
+        "cpus": total_cpus,
+        "cpu_used": round(psutil.cpu_percent(interval=None) / 100 * total_cpus, 2),
+        "memory_total": total_memory,
+        "memory_used": int(total_memory * (1 - mem.available / mem.total)),
+    }
+
+
+def cpu_request(app: AppModel) -> float:
+    return parse_cpu_quota(app.cpu_quota) or DEFAULT_CPU_REQUEST
+
+
+def memory_request(app: AppModel, total: int) -> int:
+    return parse_memory(app.memory_max, total) or DEFAULT_MEMORY_REQUEST
+
+
+def free_capacity(info: dict, placed: List[AppModel]) -> tuple:
+    """
+    Returns (free cores, free bytes): capacity minus the larger of measured usage and
+    the requests of the apps already placed there (which may not be using them yet).
+    """
+    reserved_cpu = sum(cpu_request(app) for app in placed)
+    reserved_memory = sum(memory_request(app, info["memory_total"]) for app in placed)
+    return (
+        info["cpus"] - max(info["cpu_used"], reserved_cpu),
+        info["memory_total"] - max(info["memory_used"], reserved_memory),
+    )
+
+
+def get_candidates() -> List[tuple]:
+    """(node name or None for the controller, info) for every node that can take new apps."""
+    candidates = []
+    if database.get_setting("schedule_on_controller", "1") == "1":
+        candidates.append((None, host_info()))
+    for node in database.get_nodes():
+        state = STATES.get(node.name)
+        if state and state.status == "online" and state.info:
+            candidates.append((node.name, state.info))
+    return candidates
+
+
+def schedule(app: AppModel, apps: List[AppModel]) -> Optional[str]:
+    """
+    Picks the node for a new app: the one with the most free CPU and memory left once the app's
+    own request is subtracted, each relative to the roomiest candidate, judged by the scarcer of
+    the two. Nodes without room for the app's MemoryMax are skipped. Returns None for the controller host.
+    Without registered agents this is always None, i.e. the single-host behaviour.
+    """
+    if not database.get_nodes():
+        return None
+    # Caddy serves static sites straight from disk, so they live where Caddy runs
+    if system_ops.is_static(app):
+        return None
+
+    candidates = get_candidates()
+    if not candidates:
+        raise Exception("No online nodes to schedule the app on")
+
+    fitting = []
+    for name, info in candidates:
+        placed = [a for a in apps if a.node == name and a.name != app.name]
+        free_cpu, free_memory = free_capacity(info, placed)
+        free_cpu -= cpu_request(app)
+        free_memory -= memory_request(app, info["memory_total"])
+        # Only an explicit MemoryMax is a hard requirement; CPU is shared, and default requests are estimates
+        if app.memory_max and free_memory < 0:
+            continue
+        fitting.append((name, free_cpu, free_memory, len(placed)))
+    if not fitting:
+        raise Exception(f"No node has {app.memory_max} of memory free for {app.name}")
+
+    most_cpu = max(max(free_cpu for _, free_cpu, _, _ in fitting), 1e-9)
+    most_memory = max(max(free_memory for _, _, free_memory, _ in fitting), 1)
+    best, best_key = None, None
+    for name, free_cpu, free_memory, count in fitting:
+        score = min(free_cpu / most_cpu, free_memory / most_memory)
+        # Ties (e.g. identical idle nodes) go to the node with fewer apps
+        key = (round(score, 3), -count)
+        if best_key is None or key > best_key:
+            best, best_key = name, key
+    return best
+
+
+# -- Agent calls --
+
+@contextmanager
+def track(node_name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.AGENT_REQUEST_DURATION.labels(node_name).observe(elapsed)
+        profiling.record_span("agent", node_name, start, elapsed)
+
+
+def parse_response(node: NodeModel, response: httpx.Response):
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail")
+        except ValueError:
+            detail = None
+        raise Exception(f"Node {node.name}: {detail or f'HTTP {response.status_code}'}")
+    return response.json()
+
+
+def call_agent(node: NodeModel, method: str, path: str, json=None, timeout: float = AGENT_TIMEOUT):
+    """Blocking call, for the deploy paths that already run in a worker thread."""
+    with track(node.name):
+        try:
+            response = httpx.request(
+                method, node.url.rstrip("/") + path, json=json, timeout=timeout,
+                headers={"Authorization": f"Bearer {node.token}"},
+            )
+        except httpx.HTTPError as e:
+            raise Exception(f"Node {node.name} is unreachable: {e}")
+    return parse_response(node, response)
+
+
+def get_client(node: NodeModel) -> httpx.AsyncClient:
+    client = _clients.get(node.name)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=node.url.rstrip("/"),
+            headers={"Authorization": f"Bearer {node.token}"},
+            timeout=AGENT_TIMEOUT,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=4),
+        )
+        _clients[node.name] = client
+    return client
+
+
+async def call_agent_async(node: NodeModel, method: str, path: str, json=None, timeout: float = AGENT_TIMEOUT):
+    with track(node.name):
+        try:
+            response = await get_client(node).request(method, path, json=json, timeout=timeout)
+        except httpx.HTTPError as e:
+            raise Exception(f"Node {node.name} is unreachable: {e}")
+    return parse_response(node, response)
+
+
+async def forget_node(name: str):
+    """Drops the cached client and state after a node was changed or removed."""
+    client = _clients.pop(name, None)
+    if client is not None:
+        await client.aclose()
+    STATES.pop(name, None)
+    try:
+        metrics.NODE_UP.remove(name)
+    except KeyError:
+        pass
+
+
+async def close_clients():
+    for name in list(_clients):
+        await _clients.pop(name).aclose()
+
+
+def get_app_node(app: AppModel) -> NodeModel:
+    node = database.get_node(app.node)
+    if node is None:
+        raise Exception(f"App {app.name} is assigned to unknown node '{app.node}'")
+    return node
+
+
+def require_node(name: str) -> NodeModel:
+    node = database.get_node(name)
+    if node is None:
+        raise Exception(f"Unknown node '{name}'")
+    return node
+
+
+def group_by_node(apps: List[AppModel]) -> Dict[Optional[str], List[AppModel]]:
+    groups = {}
+    for app in apps:
+        groups.setdefault(app.node, []).append(app)
+    return groups
+
+
+def is_offline(node_name: str) -> bool:
+    state = STATES.get(node_name)
+    return state is not None and state.status == "offline"
+
+
+# -- App operations (local apps go straight to system_ops) --
+
+async def get_statuses_async(apps: List[AppModel]) -> dict:
+    """
+    Returns {name: status} across nodes: one systemctl fork here and one request per agent,
+    concurrently. Apps on an offline or unreachable node are 'unknown' (Caddy keeps their route).
+    """
+    groups = group_by_node(apps)
+    if set(groups) <= {None}:
+        return await system_ops.get_app_statuses_async(apps)
+    known = {node.name: node for node in await asyncio.to_thread(database.get_nodes)}
+
+    async def fetch(node_name: Optional[str], group: List[AppModel]) -> dict:
+        if node_name is None:
+            return await system_ops.get_app_statuses_async(group)
+        names = [app.name for app in group]
+        node = known.get(node_name)
+        if node is None or is_offline(node_name):
+            return {name: "unknown" for name in names}
+        try:
+            return await call_agent_async(node, "POST", "/agent/statuses", {"names": names})
+        except Exception:
+            return {name: "unknown" for name in names}
+
+    statuses = {}
+    results = await asyncio.gather(*(fetch(node, group) for node, group in groups.items()))
+    for result in results:
+        statuses.update(result)
+    return statuses
+
+
+def get_statuses(apps: List[AppModel]) -> dict:
+    groups = group_by_node(apps)
+    statuses = system_ops.get_app_statuses(groups.pop(None, []))
+    known = {node.name: node for node in database.get_nodes()} if groups else {}
+    for node_name, group in groups.items():
+        names = [app.name for app in group]
+        node = known.get(node_name)
+        try:
+            if node is None or is_offline(node_name):
+                raise Exception("node unavailable")
+            statuses.update(call_agent(node, "POST", "/agent/statuses", {"names": names}))
+        except Exception:
+            statuses.update({name: "unknown" for name in names})
+    return statuses
+
+
+async def get_status_async(app: AppModel) -> str:
+    return (await get_statuses_async([app]))[app.name]
+
+
+def node_hosts() -> dict:
+    return {node.name: urlparse(node.url).hostname for node in database.get_nodes()}
+
+
+def render_caddyfile(apps: List[AppModel], statuses: dict) -> str:
+    hosts = node_hosts() if any(app.node for app in apps) else {}
+    return system_ops.render_caddyfile(apps, statuses, hosts)
+
+
+def update_caddy_config():
+    apps = database.get_apps()
+    statuses = get_statuses([app for app in apps if app.domain])
+    system_ops.update_caddy_config(render_caddyfile(apps, statuses))
+
+
+async def update_caddy_config_async():
+    # The registry reads are sqlite calls, kept off the event loop
+    apps = await asyncio.to_thread(database.get_apps)
+    statuses = await get_statuses_async([app for app in apps if app.domain])
+    await system_ops.update_caddy_config_async(await asyncio.to_thread(render_caddyfile, apps, statuses))
+
+
+def deploy_remote(app: AppModel, wipe: bool = False) -> str:
+    """
+    Runs the whole deploy (user, clone, install, build, unit) on the app's agent and returns its logs.
+    `wipe` removes the checkout first, like a language change does locally.
+    """
+    node = get_app_node(app)
+    # Settings come from this controller's DB; the agent has none
+    payload = {"app": app.dict(), "wipe": wipe, "settings": system_ops.get_deploy_settings().dict()}
+    result = call_agent(node, "POST", f"/agent/apps/{app.name}/deploy", payload, DEPLOY_TIMEOUT)
+    app.deployed_commit = result.get("commit")
+    return f"Deployed on node {node.name}.\n" + result["logs"]
+
+
+def redeploy(app: AppModel, batch: Optional[system_ops.SystemdBatch] = None) -> str:
+    """Redeploys the app where it lives and records the commit it built."""
+    if app.node is None:
+        try:
+            logs = system_ops.redeploy_app(app, batch)
+        finally:
+            disk.mark_dirty(app.name)
+    else:
+        logs = deploy_remote(app)
+    database.set_app_deployed_commit(app.name, app.deployed_commit)
+    return logs
+
+
+def remove_remote(app: AppModel):
+    call_agent(get_app_node(app), "DELETE", f"/agent/apps/{app.name}")
+
+
+async def bulk_action_async(apps: List[AppModel], action: str) -> tuple:
+    """
+    Like system_ops.bulk_app_action_async, one call per node, all nodes concurrently.
+    Returns (returncode, output); the first non-zero code wins.
+    """
+    async def run(node_name: Optional[str], group: List[AppModel]) -> tuple:
+        if node_name is None:
+            return await system_ops.bulk_app_action_async(group, action)
+        try:
+            node = await asyncio.to_thread(require_node, node_name)
+            names = [app.name for app in group]
+            result = await call_agent_async(node, "POST", "/agent/bulk", {"apps": names, "action": action})
+            return result["code"], result["output"]
+        except Exception as e:
+            return 1, f"{e}\n"
+
+    groups = group_by_node(apps)
+    results = await asyncio.gather(*(run(node, group) for node, group in groups.items()))
+    code = next((rc for rc, _ in results if rc != 0), 0)
+    return code, "".join(out for _, out in results)
+
+
+async def service_action_async(app: AppModel, action: str):
+    if app.node is None:
+        if system_ops.is_static(app):
+            # No process: stop/start only takes the Caddy route down or up (the caller reloads Caddy)
+            code, out = await asyncio.to_thread(system_ops.set_static_enabled, [app], action != "stop")
+            if code != 0:
+                raise Exception(out.strip())
+            return
+        if action == "start":
+            return await system_ops.start_service_async(app.name)
+        return await system_ops.stop_service_async(app.name)
+    code, out = await bulk_action_async([app], action)
+    if code != 0:
+        raise Exception(f"Command failed: systemctl {action} {app.name}.service\nOutput: {out}")
+
+
+async def get_logs_async(app: AppModel, lines: int = 100) -> str:
+    namespace = system_ops.log_namespace(app)
+    if app.node is None:
+        return await system_ops.get_app_logs_async(app.name, lines, namespace)
+    path = f"/agent/apps/{app.name}/logs?lines={lines}" + ("&namespaced=true" if namespace else "")
+    result = await call_agent_async(await asyncio.to_thread(get_app_node, app), "GET", path)
+    return result["logs"]
+
+
+def get_effective_resource_limits(app: AppModel) -> dict:
+    if system_ops.is_static(app):
+        return {}
+    if app.node is None:
+        return system_ops.get_effective_resource_limits(app.name)
+    return call_agent(get_app_node(app), "GET", f"/agent/apps/{app.name}/resources")
+
+
+def apply_resource_limits(app: AppModel) -> str:
+    if app.node is None:
+        return system_ops.apply_resource_limits(app)
+    return call_agent(get_app_node(app), "PUT", f"/agent/apps/{app.name}/resources", app.dict())["logs"]
+
+
+# -- Health --
+
+async def heartbeat(node: NodeModel):
+    state = STATES.setdefault(node.name, NodeState())
+    try:
+        state.info = await call_agent_async(node, "GET", "/agent/info")
+        state.status = "online"
+        state.last_seen = time.time()
+        state.consecutive_failures = 0
+        state.last_error = None
+    except Exception as e:
+        state.consecutive_failures += 1
+        state.last_error = str(e)
+        if state.consecutive_failures >= OFFLINE_AFTER:
+            state.status = "offline"
+    metrics.NODE_UP.labels(node.name).set(1 if state.status == "online" else 0)
+
+
+async def check_nodes():
+    nodes = await asyncio.to_thread(database.get_nodes)
+    for name in set(STATES) - {node.name for node in nodes}:
+        await forget_node(name)
+    await asyncio.gather(*(heartbeat(node) for node in nodes))
+
+
+def get_report() -> List[dict]:
+    """The controller and every agent with health, capacity and what is placed there."""
+    apps = database.get_apps()
+    rows = []
+    entries = [(None, LOCAL, None, {"status": "online", "info": host_info()})]
+    for node in database.get_nodes():
+        state = STATES.get(node.name) or NodeState()
+        entries.append((node.name, node.name, node.url, state.to_dict()))
+
+    for node_name, label, url, state in entries:
+        placed = [app for app in apps if app.node == node_name]
+        info = state.get("info")
+        free = free_capacity(info, placed) if info else (None, None)
+        rows.append({
+            "name": label,
+            "url": url,
+            **state,
+            "apps": len(placed),
+            "free_cpus": round(free[0], 2) if free[0] is not None else None,
+            "free_memory": free[1],
+        })
+    return rows
+
+
+async def run_monitor():
+    """
+    Background task: heartbeats every agent each interval. A node is offline after
+    OFFLINE_AFTER missed heartbeats and stops receiving new apps until it answers again.
+    """
+    while True:
+        start = time.monotonic()
+        interval = DEFAULT_INTERVAL
+        try:
+            interval = max(float(await asyncio.to_thread(database.get_setting, "node_interval", str(DEFAULT_INTERVAL))), 1.0)
+            await check_nodes()
+        except Exception as e:
+            print(f"Warning: Node heartbeat failed: {e}")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - start)))
@@ -0,0 +1,214 @@
+import glob
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+import database
+import system_ops
+from database import AppModel
+
+PLACEMENT_CLASSES = ("dedicated", "shared", "best-effort")
+
+# Headroom applied to observed usage when sizing dedicated apps (1.0 core used -> 2 cores)
+DEDICATED_HEADROOM = 1.25
+
+# Fraction of each node's shared cores that best-effort apps are confined to
+BEST_EFFORT_FRACTION = 0.25
+
+# CPUs kept out of the dedicated pool so the host, BMP and Caddy always have somewhere to run
+MIN_SHARED_CPUS = 1
+
+
+def parse_cpulist(text: str) -> List[int]:
+    """
+    Parses the kernel's list format ("0-3,8,10-11") into a sorted list of ids.
+    """
+    ids = set()
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            ids.update(range(int(start), int(end) + 1))
+        else:
+            ids.add(int(part))
+    return sorted(ids)
+
+
+def format_cpulist(ids: List[int]) -> str:
+    """
+    Formats ids in the kernel's list format, collapsing consecutive runs into ranges.
+    """
+    ranges = []
+    for i in sorted(set(ids)):
+        if ranges and i == ranges[-1][1] + 1:
+            ranges[-1][1] = i
+        else:
+            ranges.append([i, i])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def get_topology() -> Dict[int, List[int]]:
+    """
+    Returns {NUMA node: [cpu ids]} restricted to the CPUs this process may use.
+    Machines without NUMA information are reported as a single node 0.
+    """
+    usable = set(os.sched_getaffinity(0))
+    topology = {}
+    for path in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+        node = int(os.path.basename(os.path.dirname(path))[4:])
+        with open(path) as f:
+            cpus = [c for c in parse_cpulist(f.read()) if c in usable]
+        if cpus:
+            topology[node] = cpus
+
+    if not topology:
+        topology[0] = sorted(usable)
+    return topology
+
+
+def dedicated_cpu_count(load: float) -> int:
+    return max(1, math.ceil(load * DEDICATED_HEADROOM))
+
+
+def compute_plan(
+    apps: List[AppModel],
+    loads: Dict[str, float],
+    topology: Dict[int, List[int]],
+    reserved: Optional[Dict[str, List[int]]] = None,
+) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Computes {app name: (AllowedCPUs, AllowedMemoryNodes)} for every app with a placement class.
+
+    - dedicated: exclusive cores sized from observed usage, kept on a single node when possible.
+    - shared: all non-dedicated cores of the node with the least load per core.
+    - best-effort: the tail slice of that node's shared cores, away from shared apps' hot cores.
+
+    `reserved` pins dedicated apps to cores they already own (used for incremental placement).
+    Apps without a class are left unpinned.
+    """
+    reserved = reserved or {}
+    free = {node: list(cpus) for node, cpus in topology.items()}
+    plan = {}
+
+    def take_cores(count: int) -> Optional[Tuple[List[int], List[int]]]:
+        """Returns (cores, nodes) or None if taking `count` cores would starve the shared pool."""
+        if count > sum(len(cpus) for cpus in free.values()) - MIN_SHARED_CPUS:
+            return None
+        # Prefer a single node that fits the request, else span the fullest nodes
+        fitting = [n for n in free if len(free[n]) >= count]
+        order = sorted(fitting, key=lambda n: len(free[n]))[:1] or sorted(free, key=lambda n: -len(free[n]))
+        cores, nodes = [], []
+        for node in order:
+            # Take from the top of the node so the low cores (IRQs, system) stay shared
+            n = min(count - len(cores), len(free[node]))
+            if n <= 0:
+                break
+            cores += free[node][-n:]
+            free[node] = free[node][:-n]
+            nodes.append(node)
+        return cores, nodes
+
+    # 1. Dedicated apps, biggest consumers first (existing reservations are honoured first)
+    dedicated = [a for a in apps if a.placement_class == "dedicated"]
+    dedicated.sort(key=lambda a: (a.name not in reserved, -loads.get(a.name, 0.0)))
+    for app in dedicated:
+        owned = [c for c in reserved.get(app.name, []) if any(c in cpus for cpus in free.values())]
+        if owned:
+            nodes = set()
+            for node in free:
+                if any(c in free[node] for c in owned):
+                    nodes.add(node)
+                    free[node] = [c for c in free[node] if c not in owned]
+            plan[app.name] = (format_cpulist(owned), format_cpulist(sorted(nodes)))
+            continue
+
+        taken = take_cores(dedicated_cpu_count(loads.get(app.name, 0.0)))
+        if taken is None:
+            # Not enough exclusive cores left: the app is spread with the shared pool below
+            print(f"Warning: No dedicated cores left for {app.name}, placing it in the shared pool.")
+            continue
+        cores, nodes = taken
+        plan[app.name] = (format_cpulist(cores), format_cpulist(nodes))
+
+    # 2. Shared and best-effort apps, spread greedily by load per shared core
+    shared_nodes = {node: cpus for node, cpus in free.items() if cpus}
+    node_load = {node: 0.0 for node in shared_nodes}
+    spread = [a for a in apps if a.placement_class in ("shared", "best-effort") or
+              (a.placement_class == "dedicated" and a.name not in plan)]
+    spread.sort(key=lambda a: -loads.get(a.name, 0.0))
+    for app in spread:
+        if not shared_nodes:
+            plan[app.name] = (None, None)
+            continue
+        node = min(shared_nodes, key=lambda n: (node_load[n] / len(shared_nodes[n]), -len(shared_nodes[n])))
+        node_load[node] += loads.get(app.name, 0.0)
+        cpus = shared_nodes[node]
+        if app.placement_class == "best-effort":
+            slice_size = max(1, int(len(cpus) * BEST_EFFORT_FRACTION))
+            cpus = cpus[-slice_size:]
+        plan[app.name] = (format_cpulist(cpus), str(node))
+
+    return plan
+
+
+def get_loads(apps: List[AppModel]) -> Dict[str, float]:
+    return {app.name: system_ops.get_app_cpu_usage(app.name) for app in apps if app.placement_class}
+
+
+def place_app(app: AppModel):
+    """
+    Assigns a placement to a single app without moving any other app.
+    Existing dedicated apps keep their cores; the new app is planned around them.
+    """
+    # Static sites have no process to pin
+    if app.placement_class is None or system_ops.is_static(app):
+        app.allowed_cpus = None
+        app.allowed_memory_nodes = None
+        return
+
+    # Stored dedicated assignments, including this app's own if it was already dedicated.
+    # Only apps on this host share its cores (apps on agent nodes are not pinned).
+    reserved = {
+        a.name: parse_cpulist(a.allowed_cpus)
+        for a in database.get_apps()
+        if a.node is None and a.placement_class == "dedicated" and a.allowed_cpus
+    }
+    if app.placement_class != "dedicated":
+        reserved.pop(app.name, None)
+    apps = [a for a in database.get_apps() if a.name in reserved and a.name != app.name] + [app]
+    loads = get_loads(apps)
+    plan = compute_plan(apps, loads, get_topology(), reserved)
+    app.allowed_cpus, app.allowed_memory_nodes = plan.get(app.name, (None, None))
+
+
+def rebalance() -> dict:
+    """
+    Recomputes placement for all apps on this host from observed CPU usage, persists it and applies it live.
+    """
+    apps = [app for app in database.get_apps() if app.node is None and not system_ops.is_static(app)]
+    loads = get_loads(apps)
+    plan = compute_plan(apps, loads, get_topology())
+
+    changed = []
+    for app in apps:
+        cpus, nodes = plan.get(app.name, (None, None))
+        if (cpus, nodes) != (app.allowed_cpus, app.allowed_memory_nodes):
+            app.allowed_cpus, app.allowed_memory_nodes = cpus, nodes
+            changed.append(app)
+
+    database.set_app_placements({app.name: (app.allowed_cpus, app.allowed_memory_nodes) for app in changed})
+    logs = system_ops.apply_placement(changed) if changed else "Placement unchanged.\n"
+
+    return {
+        "placements": {
+            app.name: {
+                "class": app.placement_class,
+                "allowed_cpus": app.allowed_cpus,
+                "allowed_memory_nodes": app.allowed_memory_nodes,
+                "cpu_load": round(loads.get(app.name, 0.0), 3),
+            }
+            for app in apps
+        },
+        "changed": [app.name for app in changed],
+        "logs": logs,
+    }
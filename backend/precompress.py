@@ -0,0 +1,194 @@
+import os
+import re
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import zstandard
+
+try:
+    import brotli
+except ImportError:  # .br siblings are skipped until `pip install brotli`
+    brotli = None
+
+# Build output worth compressing; images, fonts like woff2 and archives are already compressed
+COMPRESSIBLE_EXTENSIONS = {
+    ".html", ".htm", ".css", ".js", ".mjs", ".cjs", ".json", ".map", ".svg", ".txt", ".xml",
+    ".webmanifest", ".wasm", ".ico", ".ttf", ".otf", ".eot", ".md", ".csv",
+}
+MIN_SIZE = 256  # bytes; below this the headers cost more than compression saves
+MIN_SAVING = 0.05  # siblings that are not at least 5% smaller are not kept
+
+# Sibling suffix -> Caddy `precompressed` format, in order of preference
+ENCODINGS = {".zst": "zstd", ".br": "br", ".gz": "gzip"}
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+ZSTD_LEVEL = 19
+
+# Content hashes after a "-" or "." separator: hex ("index-4f3a9b2c.js", "main.8e1c0d7a.chunk.js")
+# or Rollup/Vite's 8 base64url characters ("index-riGp-58W.js")
+HEX_HASH = re.compile(r"[0-9a-f]{8,64}")
+SHORT_HASH = re.compile(r"[A-Za-z0-9_-]{8}")
+# Plain and camelCase words ("logo", "myPlugin"), which 8 base64url characters can spell too
+WORD = re.compile(r"(?:[A-Z]?[a-z]+)*")
+MAX_IMMUTABLE_FILES = 100  # individually listed fingerprinted files outside fingerprinted directories
+
+# Cache-Control for fingerprinted assets and for everything else
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "no-cache"  # revalidate with ETag/Last-Modified
+
+
+def available_encodings() -> List[str]:
+    return [suffix for suffix in ENCODINGS if suffix != ".br" or brotli is not None]
+
+
+def compress(data: bytes, suffix: str) -> bytes:
+    if suffix == ".gz":
+        # wbits 16+MAX_WBITS produces a gzip header/trailer
+        obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        return obj.compress(data) + obj.flush()
+    if suffix == ".br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def is_sibling(path: str) -> bool:
+    base, suffix = os.path.splitext(path)
+    return suffix in ENCODINGS and os.path.splitext(base)[1].lower() in COMPRESSIBLE_EXTENSIONS
+
+
+def compress_file(path: str, suffixes: List[str]) -> tuple:
+    """
+    Writes the missing or outdated siblings of one file. Returns (original bytes, {suffix: bytes written}).
+    zlib, brotli and zstandard release the GIL, so a thread pool spreads files across cores.
+    """
+    stat = os.stat(path)
+    written = {}
+    data = None
+    for suffix in suffixes:
+        target = path + suffix
+        try:
+            # Incremental: a sibling newer than its source is still valid
+            if os.stat(target).st_mtime >= stat.st_mtime:
+                written[suffix] = os.path.getsize(target)
+                continue
+        except FileNotFoundError:
+            pass
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        compressed = compress(data, suffix)
+        if len(compressed) > len(data) * (1 - MIN_SAVING):
+            if os.path.exists(target):
+                os.remove(target)
+            continue
+        tmp = f"{target}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(compressed)
+        os.replace(tmp, target)
+        written[suffix] = len(compressed)
+    return stat.st_size, written
+
+
+def precompress_tree(root: str, workers: Optional[int] = None) -> dict:
+    """
+    Generates .zst/.br/.gz siblings for every compressible file under root, in parallel,
+    and removes siblings whose source is gone. Returns counts and sizes for the deploy log.
+    """
+    start = time.perf_counter()
+    suffixes = available_encodings()
+    sources, orphans = [], []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if is_sibling(path):
+                if not os.path.exists(os.path.splitext(path)[0]):
+                    orphans.append(path)
+            elif (
+                os.path.splitext(filename)[1].lower() in COMPRESSIBLE_EXTENSIONS
+                and os.path.getsize(path) >= MIN_SIZE
+            ):
+                sources.append(path)
+
+    for path in orphans:
+        os.remove(path)
+
+    original = 0
+    compressed = {suffix: 0 for suffix in suffixes}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        for size, written in pool.map(lambda path: compress_file(path, suffixes), sources):
+            original += size
+            for suffix, length in written.items():
+                compressed[suffix] += length
+
+    return {
+        "files": len(sources),
+        "removed": len(orphans),
+        "encodings": [ENCODINGS[suffix] for suffix in suffixes],
+        "original_bytes": original,
+        "compressed_bytes": {ENCODINGS[suffix]: total for suffix, total in compressed.items()},
+        "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+    }
+
+
+def looks_like_hash(text: str) -> bool:
+    if HEX_HASH.fullmatch(text):
+        return True
+    return SHORT_HASH.fullmatch(text) is not None and not all(WORD.fullmatch(word) for word in re.split(r"[-_]", text))
+
+
+def is_fingerprinted(filename: str) -> bool:
+    """
+    True if the name (extension excluded) carries a content hash after a "-" or "." separator.
+    A false positive serves a stale file for a year, a miss only costs revalidation, so names
+    without a separator ("html5shiv.js", "favicon32x32.png") and words never count.
+    """
+    parts = filename.split(".")[:-1]
+    for i, part in enumerate(parts):
+        candidates = [part] if i else []  # ".<hash>." (the first part has no separator before it)
+        if "-" in part:
+            candidates.append(part.rsplit("-", 1)[1])  # "-<hex>"
+            if len(part) > 9 and part[-9] == "-":
+                candidates.append(part[-8:])  # "-<base64url>", which may contain "-" itself
+        if any(looks_like_hash(candidate) for candidate in candidates):
+            return True
+    return False
+
+
+def scan_fingerprinted(directory: str, url: str) -> tuple:
+    """
+    Returns (all fingerprinted, patterns, files) for one directory tree. Source maps and
+    compressed siblings do not count either way; empty directories do not spoil their parent.
+    """
+    all_hashed = True
+    patterns, files = [], []
+    for entry in sorted(os.scandir(directory), key=lambda entry: entry.name):
+        if entry.is_dir(follow_symlinks=False):
+            sub_hashed, sub_patterns, sub_files = scan_fingerprinted(entry.path, f"{url}{entry.name}/")
+            if sub_hashed and (sub_patterns or sub_files):
+                patterns.append(f"{url}{entry.name}/*")
+            else:
+                all_hashed = all_hashed and sub_hashed
+                patterns += sub_patterns
+                files += sub_files
+        elif entry.is_file(follow_symlinks=False):
+            if is_sibling(entry.name) or entry.name.endswith(".map"):
+                continue
+            if is_fingerprinted(entry.name):
+                files.append(f"{url}{entry.name}")
+            else:
+                all_hashed = False
+    return all_hashed, patterns, files
+
+
+def find_immutable_paths(root: str) -> List[str]:
+    """
+    Returns Caddy path patterns for fingerprinted assets: "/assets/*" for directories whose
+    files are all fingerprinted, plus individual fingerprinted files elsewhere.
+    The web root itself is never a wildcard (index.html must stay revalidated).
+    """
+    if not os.path.isdir(root):
+        return []
+    _, patterns, files = scan_fingerprinted(root, "/")
+    return patterns + files[:MAX_IMMUTABLE_FILES]
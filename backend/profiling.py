@@ -0,0 +1,224 @@
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+PROFILE_HEADER = b"x-bmp-profile"
+DEFAULT_SLOW_MS = 1000.0
+SAMPLE_INTERVAL = 0.005  # seconds between stack samples
+MAX_SPANS = 500  # spans kept per request
+MAX_STACKS = 30  # distinct stacks reported per profile
+
+# Admin toggle (profile every request) and slow threshold; loaded from settings by main
+settings = {"enabled": False, "slow_ms": DEFAULT_SLOW_MS}
+
+SLOW_LOG: deque = deque(maxlen=200)
+PROFILES: deque = deque(maxlen=50)
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("bmp_profile", default=None)
+
+
+class RequestProfile:
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route = None
+        self.status = None
+        self.sampled = sampled
+        self.started = time.time()
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []  # (kind, label, offset_ms, duration_ms)
+        self.dropped_spans = 0
+        self.stacks: Dict[str, int] = {}
+
+    def add_span(self, kind: str, label: str, start: float, duration: float):
+        # list.append is atomic, so spans from worker threads need no lock
+        if len(self.spans) >= MAX_SPANS:
+            self.dropped_spans += 1
+            return
+        self.spans.append((kind, label, round((start - self.start) * 1000, 3), round(duration * 1000, 3)))
+
+    def breakdown(self) -> List[dict]:
+        """Time per sub-operation (kind + label), largest first."""
+        totals = {}
+        for kind, label, _, duration in self.spans:
+            entry = totals.setdefault((kind, label), [0, 0.0])
+            entry[0] += 1
+            entry[1] += duration
+        rows = [
+            {"kind": kind, "label": label, "count": count, "total_ms": round(total, 3)}
+            for (kind, label), (count, total) in totals.items()
+        ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def server_timing(self) -> str:
+        # Per kind, e.g. "subprocess;dur=12.1, db;dur=0.8, total;dur=14.0"
+        kinds = {}
+        for kind, _, _, duration in self.spans:
+            kinds[kind] = kinds.get(kind, 0.0) + duration
+        parts = [f"{kind};dur={total:.1f}" for kind, total in kinds.items()]
+        parts.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started": self.started,
+            "duration_ms": self.duration_ms,
+            "breakdown": self.breakdown(),
+        }
+
+    def to_dict(self) -> dict:
+        stacks = sorted(self.stacks.items(), key=lambda item: item[1], reverse=True)[:MAX_STACKS]
+        return {
+            **self.summary(),
+            "spans": [
+                {"kind": kind, "label": label, "offset_ms": offset, "duration_ms": duration}
+                for kind, label, offset, duration in self.spans
+            ],
+            "dropped_spans": self.dropped_spans,
+            "sample_interval_ms": SAMPLE_INTERVAL * 1000 if self.sampled else None,
+            # Folded stacks (outermost first), ready for flamegraph tools
+            "stacks": [{"stack": stack, "samples": count} for stack, count in stacks],
+        }
+
+
+def record_span(kind: str, label: str, start: float, duration: float):
+    """Attributes a finished operation to the current request, if any. Near-free otherwise."""
+    profile = _current.get()
+    if profile is not None:
+        profile.add_span(kind, label, start, duration)
+
+
+@contextmanager
+def span(kind: str, label: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(kind, label, start, time.perf_counter() - start)
+
+
+def fold_stack(frame) -> Optional[str]:
+    """
+    Returns "file:function;..." for a thread's stack, or None if no BMP code is executing
+    (idle workers and the event loop waiting for I/O are not worth reporting).
+    """
+    frames = []
+    has_bmp_frame = False
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename.startswith(BACKEND_DIR) and code.co_name != "<module>":
+            if os.path.basename(code.co_filename) == "profiling.py":
+                return None
+            has_bmp_frame = True
+        frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    if not has_bmp_frame:
+        return None
+    return ";".join(reversed(frames))
+
+
+class StackSampler:
+    """
+    Samples the stacks of all threads running BMP code while a profiled request is in flight.
+    Concurrent requests on the event loop show up too; profile one request at a time for clean data.
+    """
+
+    def __init__(self, profile: RequestProfile):
+        self.profile = profile
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(SAMPLE_INTERVAL):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = fold_stack(frame)
+                if stack:
+                    self.profile.stacks[stack] = self.profile.stacks.get(stack, 0) + 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop_event.set()
+        self.thread.join()
+
+
+def get_slow_log(limit: int = 50) -> List[dict]:
+    return list(SLOW_LOG)[-limit:][::-1]
+
+
+def get_profile(profile_id: str) -> Optional[dict]:
+    for profile in PROFILES:
+        if profile.id == profile_id:
+            return profile.to_dict()
+    return None
+
+
+def list_profiles() -> List[dict]:
+    return [profile.summary() for profile in reversed(PROFILES)]
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware collecting span timings for every API request. Requests slower than the
+    threshold land in the slow log. With `X-BMP-Profile: 1` (or the admin toggle) the request's
+    stacks are also sampled, the profile is kept for retrieval and a Server-Timing header is added.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"].startswith("/api/profiling"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        sampled = settings["enabled"] or headers.get(PROFILE_HEADER, b"") in (b"1", b"true")
+        profile = RequestProfile(scope["method"], scope["path"], sampled)
+        token = _current.set(profile)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                profile.status = message["status"]
+                if sampled:
+                    extra = [
+                        (b"server-timing", profile.server_timing().encode()),
+                        (b"x-bmp-profile-id", profile.id.encode()),
+                    ]
+                    message = {**message, "headers": list(message.get("headers") or []) + extra}
+            await send(message)
+
+        try:
+            if sampled:
+                with StackSampler(profile):
+                    await self.app(scope, receive, send_wrapper)
+            else:
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            profile.duration_ms = round((time.perf_counter() - profile.start) * 1000, 3)
+            profile.route = getattr(scope.get("route"), "path", None)
+            if sampled:
+                PROFILES.append(profile)
+            if profile.duration_ms >= settings["slow_ms"]:
+                SLOW_LOG.append({**profile.summary(), "profiled": sampled})
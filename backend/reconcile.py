@@ -0,0 +1,217 @@
+import asyncio
+import os
+import time
+from typing import List, Optional
+import orjson
+import database
+import metrics
+import nodes
+import system_ops
+
+DEFAULT_INTERVAL = 60  # seconds between passes, overridable via the settings table
+RETRY_INTERVAL = 10  # seconds before the next pass when one had errors (e.g. Caddy still starting)
+MAX_DRIFT_REPORTED = 200
+
+# Last pass, served by GET /api/reconcile
+last_report: Optional[dict] = None
+_lock = asyncio.Lock()
+_wakeup: Optional[asyncio.Event] = None
+
+
+def read_unit(name: str) -> Optional[str]:
+    try:
+        with open(system_ops.unit_path(name)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def is_settled(app: database.AppModel, statuses: dict) -> bool:
+    """
+    True for a local app that no deploy is working on right now. The lock is checked again
+    (not just the pass's statuses): a deploy may have started since they were read.
+    """
+    return (
+        app.node is None and statuses.get(app.name) != "deploying"
+        and not system_ops.LockManager(app.name).is_locked()
+    )
+
+
+def check_units(apps: List[database.AppModel], statuses: dict) -> List[dict]:
+    """
+    Compares each deployed app's unit file with what render_systemd_service would write.
+    Apps whose first deploy has not finished (no deployed_commit, e.g. imported without redeploy
+    or still building) have no desired unit yet. Units of apps on agent nodes are the agents'
+    business. Static sites must not have one at all.
+    """
+    drift = []
+    for app in apps:
+        if not is_settled(app, statuses) or not os.path.isdir(system_ops.app_www(app.name)):
+            continue
+        on_disk = read_unit(app.name)
+        if system_ops.is_static(app):
+            # Placeholders predate deployed_commit, so they are removed either way
+            if on_disk is not None:
+                drift.append({"app": app.name, "kind": "placeholder_unit"})
+        elif not app.deployed_commit:
+            continue
+        elif on_disk is None:
+            drift.append({"app": app.name, "kind": "unit_missing"})
+        elif on_disk != system_ops.render_systemd_service(app):
+            drift.append({"app": app.name, "kind": "unit_changed"})
+    return drift
+
+
+async def get_enabled_states(names: List[str]) -> dict:
+    if not names:
+        return {}
+    # Like is-active, is-enabled prints one state per unit even when it exits non-zero
+    _, out = await system_ops.run_exec_async("systemctl", "is-enabled", *[f"{name}.service" for name in names])
+    states = out.splitlines()
+    return {name: states[i].strip() if i < len(states) else "unknown" for i, name in enumerate(names)}
+
+
+async def caddy_config_matches(caddyfile: str) -> tuple:
+    """
+    Returns (matches, kind). The Caddyfile is adapted by Caddy itself (/adapt, nothing is loaded)
+    and compared with the running JSON config, so restarts and hand edits are both caught.
+    """
+    client = system_ops.get_caddy_client()
+    live = await client.get("/config/")
+    live.raise_for_status()
+    live_config = live.json()
+    if not live_config:
+        return False, "caddy_empty"
+
+    adapted = await client.post("/adapt", headers={"Content-Type": "text/caddyfile"}, content=caddyfile)
+    adapted.raise_for_status()
+    desired = adapted.json().get("result")
+    # Key order is not significant
+    same = orjson.dumps(desired, option=orjson.OPT_SORT_KEYS) == orjson.dumps(live_config, option=orjson.OPT_SORT_KEYS)
+    return same, "caddy_changed"
+
+
+async def reconcile_once() -> dict:
+    """
+    One pass: diff the DB against unit files, enablement and the live Caddy config,
+    then apply the smallest fix for each difference.
+    """
+    async with _lock:
+        start = time.perf_counter()
+        drift = []
+        errors = []
+
+        apps = await asyncio.to_thread(database.get_apps)
+        statuses = await nodes.get_statuses_async(apps)
+
+        # 1. Unit files: rewrite missing/edited ones, one daemon-reload for all
+        unit_drift = await asyncio.to_thread(check_units, apps, statuses)
+        by_name = {app.name: app for app in apps}
+        placeholders = [item for item in unit_drift if item["kind"] == "placeholder_unit"]
+        unit_drift = [item for item in unit_drift if item["kind"] != "placeholder_unit"]
+        if unit_drift:
+            try:
+                for item in unit_drift:
+                    await asyncio.to_thread(system_ops.write_systemd_service, by_name[item["app"]])
+                    item["action"] = "rewrote unit"
+                code, out = await system_ops.run_exec_async("systemctl", "daemon-reload")
+                if code != 0:
+                    raise Exception(f"daemon-reload failed: {out.strip()}")
+            except Exception as e:
+                errors.append(f"Unit repair failed: {e}")
+        drift += unit_drift
+
+        # 1.5 Static sites used to run a `sleep infinity` unit; their state now lives in the DB
+        if placeholders:
+            try:
+                await asyncio.to_thread(system_ops.migrate_placeholder_units, [by_name[item["app"]] for item in placeholders])
+                for item in placeholders:
+                    item["action"] = "removed unit"
+                # A stopped placeholder became a disabled site
+                apps = await asyncio.to_thread(database.get_apps)
+                statuses = await nodes.get_statuses_async(apps)
+            except Exception as e:
+                errors.append(f"Placeholder migration failed: {e}")
+            drift += placeholders
+
+        # 2. Enablement: deployed units must start on boot (a hand-disabled unit would vanish after reboot)
+        deployed = [
+            app.name for app in apps
+            if app.deployed_commit and not system_ops.is_static(app)
+            and is_settled(app, statuses) and os.path.exists(system_ops.unit_path(app.name))
+        ]
+        try:
+            enabled = await get_enabled_states(deployed)
+            disabled = [name for name, state in enabled.items() if state in ("disabled", "not-found")]
+            if disabled:
+                code, out = await system_ops.run_exec_async("systemctl", "enable", *[f"{n}.service" for n in disabled])
+                action = "enabled unit" if code == 0 else f"enable failed: {out.strip()}"
+                drift += [{"app": name, "kind": "unit_disabled", "action": action} for name in disabled]
+        except Exception as e:
+            errors.append(f"Enablement check failed: {e}")
+
+        # 3. Caddy: reload only when the running config differs from the rendered one
+        caddyfile = await asyncio.to_thread(nodes.render_caddyfile, apps, statuses)
+        try:
+            matches, kind = await caddy_config_matches(caddyfile)
+            if not matches:
+                await system_ops.update_caddy_config_async(caddyfile)
+                drift.append({"app": None, "kind": kind, "action": "reloaded Caddy"})
+        except Exception as e:
+            errors.append(f"Caddy check failed: {e}")
+
+        duration = time.perf_counter() - start
+        metrics.RECONCILE_DURATION.observe(duration)
+        metrics.RECONCILE_LAST_DRIFT.clear()
+        for item in drift:
+            metrics.RECONCILE_DRIFT.labels(item["kind"]).inc()
+        for kind in {item["kind"] for item in drift}:
+            metrics.RECONCILE_LAST_DRIFT.labels(kind).set(sum(1 for item in drift if item["kind"] == kind))
+        if errors:
+            metrics.RECONCILE_ERRORS.inc(len(errors))
+
+        global last_report
+        last_report = {
+            "finished": time.time(),
+            "duration_ms": round(duration * 1000, 2),
+            "apps": len(apps),
+            "drift": drift[:MAX_DRIFT_REPORTED],
+            "drift_count": len(drift),
+            "errors": errors,
+        }
+        return last_report
+
+
+def trigger():
+    """Asks the loop to run a pass now (e.g. after an app was changed by hand)."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_reconciler():
+    """
+    Background task: the first pass runs right after startup (this is what brings Caddy in
+    line after a restart), then every `reconcile_interval` seconds.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        failed = True
+        try:
+            report = await reconcile_once()
+            failed = bool(report["errors"])
+            if report["drift_count"] or report["errors"]:
+                print(f"Reconcile: fixed {report['drift_count']} drift(s), {len(report['errors'])} error(s)")
+                for error in report["errors"]:
+                    print(f"Warning: {error}")
+        except Exception as e:
+            print(f"Warning: Reconciliation failed: {e}")
+
+        interval = float(await asyncio.to_thread(database.get_setting, "reconcile_interval", str(DEFAULT_INTERVAL)))
+        if failed:
+            interval = min(interval, RETRY_INTERVAL)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=max(interval, 5.0))
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
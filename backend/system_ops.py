@@ -1,20 +1,127 @@
+import asyncio
 import os
 import pwd
 import grp
+import re
 import subprocess
 import socket
+import threading
 import requests
+import httpx
 import shlex
 import shutil
+import struct
 import time
-from database import AppModel, get_apps
+from typing import Dict, List, Optional
+from pydantic import BaseModel
+from database import AppModel, get_apps, get_int_setting, set_app_immutable_paths, set_app_published_root, set_apps_static_enabled
+import artifacts
+import dashboard
+import metrics
+import precompress
+import profiling
+import traffic
 
 MISE_PATH = shutil.which("mise") or "/usr/local/bin/mise"
 
+# Filesystem roots (overridable so benchmarks and tests can run against a scratch directory)
+HOME_ROOT = os.getenv("BMP_HOME_ROOT", "/home")
+UNIT_DIR = os.getenv("BMP_UNIT_DIR", "/etc/systemd/system")
+LOCK_DIR = os.getenv("BMP_LOCK_DIR", "/tmp")
+JOURNALD_CONF_DIR = os.getenv("BMP_JOURNALD_CONF_DIR", "/etc/systemd")
+
+
+def app_home(name: str) -> str:
+    return os.path.join(HOME_ROOT, name)
+
+
+def app_www(name: str) -> str:
+    return os.path.join(HOME_ROOT, name, "www")
+
+
+def unit_path(name: str) -> str:
+    return os.path.join(UNIT_DIR, f"{name}.service")
+
+
+def is_static(app: AppModel) -> bool:
+    return ":static" in (app.language_version or "")
+
+
+def static_root(app: AppModel) -> str:
+    # For static apps, start_command is the build output folder relative to the checkout
+    return f"{app_www(app.name)}/{app.start_command}"
+
+
+def published_root(app: AppModel) -> str:
+    # What Caddy serves: the output recorded by the last deploy (apps deployed before it was recorded: the configured one)
+    return app.published_root or static_root(app)
+
+
+class CommandBackend:
+    """
+    Executes system commands and user lookups for system_ops.
+    The default runs them for real; fakes.FakeBackend stands in for systemctl, journalctl,
+    useradd, git and mise so BMP can be exercised without root (see set_backend()).
+    """
+
+    def run(self, command: str, cwd=None, env=None) -> tuple:
+        """Runs a shell command. Returns (returncode, combined output)."""
+        result = subprocess.run(
+            command,
+            cwd=cwd,
+            env=env,
+            shell=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        return result.returncode, result.stdout
+
+    def run_exec(self, args: List[str]) -> tuple:
+        """Runs a command without a shell. Returns (returncode, stdout, stderr)."""
+        result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        return result.returncode, result.stdout, result.stderr
+
+    async def run_exec_async(self, args: List[str]) -> tuple:
+        """Runs a command without a shell on the event loop. Returns (returncode, combined output)."""
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        stdout, _ = await proc.communicate()
+        return proc.returncode, stdout.decode(errors="replace")
+
+    def user_exists(self, name: str) -> bool:
+        try:
+            pwd.getpwnam(name)
+            return True
+        except KeyError:
+            return False
+
+    def group_exists(self, name: str) -> bool:
+        try:
+            grp.getgrnam(name)
+            return True
+        except KeyError:
+            return False
+
+
+_backend = CommandBackend()
+
+
+def get_backend() -> CommandBackend:
+    return _backend
+
+
+def set_backend(backend: CommandBackend):
+    global _backend
+    _backend = backend
+
 
 class LockManager:
     def __init__(self, app_name: str):
-        self.lock_file = f"/tmp/bmp_deploy_{app_name}.lock"
+        self.lock_file = os.path.join(LOCK_DIR, f"bmp_deploy_{app_name}.lock")
 
     def acquire(self):
         if os.path.exists(self.lock_file):
@@ -36,30 +143,26 @@ class LockManager:
 
 
 def run_command(command: str, cwd=None, env=None) -> str:
-    try:
-        result = subprocess.run(
-            command,
-            cwd=cwd,
-            env=env,
-            shell=True,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
-        return result.stdout
-    except subprocess.CalledProcessError as e:
-        raise Exception(f"Command failed: {e.cmd}\nOutput: {e.output}")
+    with metrics.track_subprocess(command):
+        returncode, output = _backend.run(command, cwd=cwd, env=env)
+        if returncode != 0:
+            raise Exception(f"Command failed: {command}\nOutput: {output}")
+    return output
+
+
+def run_exec(args: List[str]) -> str:
+    """Like run_command, without a shell: each argument reaches the program as is."""
+    with metrics.track_subprocess(args):
+        returncode, stdout, stderr = _backend.run_exec(args)
+        if returncode != 0:
+            raise Exception(f"Command failed: {' '.join(args)}\nOutput: {stdout}{stderr}")
+    return stdout
 
 
 def run_as_user(username: str, command: str, cwd: str) -> str:
-    try:
-        pw_record = pwd.getpwnam(username)
-    except KeyError:
+    if not _backend.user_exists(username):
         raise Exception(f"User {username} not found")
 
-    home = pw_record.pw_dir
-
     # Using 'runuser' is robust.
     # We rely on shlex.quote to safely wrap the inner command.
     quoted_cmd = shlex.quote(command)
@@ -69,19 +172,17 @@ def run_as_user(username: str, command: str, cwd: str) -> str:
 
 
 def create_app_user(name: str, is_static: bool = False):
-    try:
-        pwd.getpwnam(name)
-        # User exists, ensure perms
-    except KeyError:
-        try:
-            grp.getgrnam(name)
+    home_dir = app_home(name)
+
+    # If the user exists, only the perms below are ensured
+    if not _backend.user_exists(name):
+        if _backend.group_exists(name):
             # Group exists, use it
-            run_command(f"useradd -m -d /home/{name} -s /bin/bash -g {name} {name}")
-        except KeyError:
+            run_command(f"useradd -m -d {home_dir} -s /bin/bash -g {name} {name}")
+        else:
             # Group doesn't exist, create it (default behavior)
-            run_command(f"useradd -m -d /home/{name} -s /bin/bash {name}")
+            run_command(f"useradd -m -d {home_dir} -s /bin/bash {name}")
 
-    home_dir = f"/home/{name}"
     
     if is_static:
         run_command(f"chmod 750 {home_dir}")
@@ -99,32 +200,90 @@ def create_app_user(name: str, is_static: bool = False):
         run_command(f"chmod 700 {home_dir}")
 
 
-def remove_app_user(name: str):
+TRASH_DIR = ".bmp-trash"  # per-app, inside the home so renames never cross filesystems
+
+
+def trash_path(name: str) -> str:
+    return os.path.join(app_home(name), TRASH_DIR)
+
+
+def purge_trash(name: str):
+    """Deletes everything in the app's trash (wiped checkouts)."""
     try:
-        pwd.getpwnam(name)
+        entries = os.listdir(trash_path(name))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            run_command(f"rm -rf {shlex.quote(os.path.join(trash_path(name), entry))}")
+        except Exception as e:
+            print(f"Warning: Failed to purge {entry} from the trash of {name}: {e}")
+
+
+def wipe_directory(name: str, path: str):
+    """
+    Replaces `rm -rf` on the deploy path: the directory is renamed into the app's trash,
+    which is instant, and deleted by a background thread. Leftovers (e.g. after a restart)
+    are purged by the disk garbage collector.
+    """
+    if not os.path.lexists(path):
+        return
+    os.makedirs(trash_path(name), exist_ok=True)
+    target = os.path.join(trash_path(name), f"{os.path.basename(path)}-{time.time_ns()}")
+    try:
+        os.rename(path, target)
+    except OSError as e:
+        print(f"Warning: Could not move {path} to the trash ({e}), deleting in place...")
+        run_command(f"rm -rf {path}")
+        return
+    threading.Thread(target=purge_trash, args=(name,), daemon=True).start()
+
+
+def remove_app_user(name: str):
+    if _backend.user_exists(name):
         run_command(f"userdel -f -r {name}")
-    except KeyError:
-        pass  # User doesn't exist
+
+
+PORT_RANGE = range(8000, 9000)
+
+
+def is_port_free(port: int) -> bool:
+    # Check if port is actually free on system
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        return s.connect_ex(("localhost", port)) != 0
 
 
 def find_available_port() -> int:
     # Get ports currently used by apps in DB
     used_ports = {app.port for app in get_apps() if app.port}
 
-    for port in range(8000, 9000):
+    for port in PORT_RANGE:
         if port in used_ports:
             continue
 
-        # Check if port is actually free on system
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            if s.connect_ex(("localhost", port)) != 0:
-                return port
+        if is_port_free(port):
+            return port
     raise Exception("No available ports found")
 
 
+def find_available_ports(count: int, used_ports: set) -> List[int]:
+    """
+    Allocates `count` ports in one pass over the range, skipping `used_ports`.
+    """
+    ports = []
+    for port in PORT_RANGE:
+        if len(ports) == count:
+            break
+        if port not in used_ports and is_port_free(port):
+            ports.append(port)
+    if len(ports) < count:
+        raise Exception(f"Not enough available ports: needed {count}, found {len(ports)}")
+    return ports
+
+
 def clone_or_pull(app: AppModel) -> str:
-    home_dir = f"/home/{app.name}"
-    www_path = os.path.join(home_dir, "www")
+    home_dir = app_home(app.name)
+    www_path = app_www(app.name)
 
     if not os.path.exists(www_path):
         return run_as_user(app.name, f"git clone {app.repo_url} www", home_dir)
@@ -134,23 +293,27 @@ def clone_or_pull(app: AppModel) -> str:
             current_remote = run_as_user(app.name, "git remote get-url origin", www_path).strip()
             if current_remote != app.repo_url:
                 # Remove existing repo and re-clone
-                run_command(f"rm -rf {www_path}")
+                wipe_directory(app.name, www_path)
                 return run_as_user(app.name, f"git clone {app.repo_url} www", home_dir)
         except Exception as e:
             # If checking remote fails (e.g. not a git repo), wipe and clone
             print(f"Warning: Could not check remote url ({e}), re-cloning...")
-            run_command(f"rm -rf {www_path}")
+            wipe_directory(app.name, www_path)
             return run_as_user(app.name, f"git clone {app.repo_url} www", home_dir)
 
-        # Ensure ACLs are correct after pull/clone if static
-        if ":static" in (app.language_version or ""):
-             run_command(f"setfacl -R -m u:caddy:rx {www_path}")
-
         return run_as_user(app.name, "git pull", www_path)
 
 
+def head_commit(name: str) -> Optional[str]:
+    """The commit checked out in the app's www (what the deploy builds), or None without a checkout."""
+    try:
+        return run_as_user(name, "git rev-parse HEAD", app_www(name)).strip() or None
+    except Exception:
+        return None
+
+
 def configure_mise(app: AppModel) -> str:
-    www_path = f"/home/{app.name}/www"
+    www_path = app_www(app.name)
     # mise expects "node 18" not "node@18" in .tool-versions
     # Strip :static suffix if present
     clean_version = app.language_version.split(":")[0]
@@ -160,7 +323,7 @@ def configure_mise(app: AppModel) -> str:
 
 
 def install_dependencies(app: AppModel) -> str:
-    www_path = f"/home/{app.name}/www"
+    www_path = app_www(app.name)
     # mise install uses .tool-versions we just wrote.
     # We must activate mise so that shims/paths are set up, otherwise 'npm' (which calls 'node') fails.
     cmd = f'eval "$({MISE_PATH} activate bash)" && {MISE_PATH} install'
@@ -171,8 +334,160 @@ def install_dependencies(app: AppModel) -> str:
     return out + "\nInstalled: " + ls_out
 
 
+
+
+def parse_cache_rules(text: Optional[str]) -> List[tuple]:
+    """
+    Parses per-app Cache-Control overrides, one rule per line (first match wins):
+
+        /sw.js no-store
+        /images/* public, max-age=86400
+
+    Raises ValueError for anything that would break out of the Caddyfile.
+    """
+    rules = []
+    for line in (text or "").splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(None, 1)
+        if len(parts) != 2:
+            raise ValueError(f"Cache rule needs a path and a value: {line!r}")
+        path, value = parts
+        if not path.startswith("/") or any(c in path for c in '{}"'):
+            raise ValueError(f"Cache rule path must start with '/': {path!r}")
+        if any(c in value for c in '{}"\\'):
+            raise ValueError(f"Invalid Cache-Control value: {value!r}")
+        rules.append((path, value.strip()))
+    return rules
+
+
+def prepare_static_assets(app: AppModel) -> str:
+    """
+    Post-build step for static apps: writes .zst/.br/.gz siblings for Caddy's `precompressed`
+    and records the fingerprinted paths that are served as immutable.
+    """
+    web_root = static_root(app)
+    if not os.path.isdir(web_root):
+        return f"Warning: Static root {web_root} not found, skipping precompression.\n"
+
+    stats = precompress.precompress_tree(web_root)
+    logs = (
+        f"Precompressed {stats['files']} files ({', '.join(stats['encodings'])}) in {stats['duration_ms']} ms, "
+        + ", ".join(f"{enc} {size} B" for enc, size in stats["compressed_bytes"].items())
+        + f" from {stats['original_bytes']} B.\n"
+    )
+    if "br" not in stats["encodings"]:
+        logs += "Note: brotli is not installed, .br files were skipped.\n"
+
+    paths = precompress.find_immutable_paths(web_root)
+    app.immutable_paths = " ".join(paths) or None
+    set_app_immutable_paths(app.name, app.immutable_paths)
+    logs += f"Immutable caching for: {app.immutable_paths}\n" if paths else "No fingerprinted assets found.\n"
+
+    # The siblings were written by root; the app user rebuilds (and cleans) this folder
+    run_command(f"chown -R {app.name}:{app.name} {web_root}")
+    return logs
+
+
+CADDY_USER = "caddy"
+# Linux POSIX ACL xattr layout: a 4-byte version header, then (tag u16, perm u16, id u32) entries
+ACL_ACCESS_XATTR = "system.posix_acl_access"
+ACL_DEFAULT_XATTR = "system.posix_acl_default"
+ACL_USER_TAG = 0x02
+ACL_READ, ACL_EXECUTE = 4, 1
+ACL_SAMPLE = 64  # entries of the publish root spot-checked before trusting its default ACL
+
+# Duration of the last full ACL apply per app, to report what a verified deploy skipped
+_acl_apply_seconds: Dict[str, float] = {}
+
+
+def acl_grants(path: str, xattr: str, uid: int, perms: int) -> bool:
+    """Whether the ACL stored in `xattr` has a user entry for uid with at least `perms`. No fork."""
+    try:
+        data = os.getxattr(path, xattr, follow_symlinks=False)
+    except OSError:
+        return False
+    for offset in range(4, len(data) - 7, 8):
+        tag, perm, ident = struct.unpack_from("<HHI", data, offset)
+        if tag == ACL_USER_TAG and ident == uid:
+            return perm & perms == perms
+    return False
+
+
+def static_acls_in_place(root: str, traverse: List[str]) -> bool:
+    """
+    Cheap drift check: caddy can enter every parent directory, and the publish root carries
+    both the access and the default ACL (so everything created in it since inherited them).
+    A sample of its entries is checked too, to catch files that predate the default ACL.
+    """
+    try:
+        uid = pwd.getpwnam(CADDY_USER).pw_uid
+    except KeyError:
+        return False
+    rx = ACL_READ | ACL_EXECUTE
+    if not all(acl_grants(path, ACL_ACCESS_XATTR, uid, ACL_EXECUTE) for path in traverse):
+        return False
+    if not (acl_grants(root, ACL_ACCESS_XATTR, uid, rx) and acl_grants(root, ACL_DEFAULT_XATTR, uid, rx)):
+        return False
+    with os.scandir(root) as entries:
+        for i, entry in enumerate(entries):
+            if i >= ACL_SAMPLE:
+                break
+            if entry.is_symlink():
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if not acl_grants(entry.path, ACL_DEFAULT_XATTR, uid, rx):
+                    return False
+                perms = rx
+            else:
+                perms = ACL_READ
+            if not acl_grants(entry.path, ACL_ACCESS_XATTR, uid, perms):
+                return False
+    return True
+
+
+def ensure_static_acls(app: AppModel) -> str:
+    """
+    Gives caddy read access to the build output only (not the checkout or node_modules):
+    execute on the directories leading to it, and read plus a default ACL on the output
+    itself, so files the next build writes there inherit access without another walk.
+    Deploys that find the ACLs in place skip setfacl entirely ("permissions_verify" step).
+    """
+    www_path = app_www(app.name)
+    root = os.path.normpath(static_root(app))
+    if os.path.commonpath([os.path.realpath(root), os.path.realpath(www_path)]) != os.path.realpath(www_path):
+        return f"Warning: Build output {root} is outside the checkout, skipping ACLs.\n"
+    if not os.path.isdir(root):
+        return f"Warning: Build output {root} not found, skipping ACLs.\n"
+    traverse = [www_path]
+    for part in os.path.relpath(os.path.dirname(root), www_path).split(os.sep) if root != www_path else []:
+        if part != ".":
+            traverse.append(os.path.join(traverse[-1], part))
+
+    start = time.perf_counter()
+    with metrics.deploy_step("permissions_verify"):
+        in_place = static_acls_in_place(root, traverse)
+    if in_place:
+        verify_ms = (time.perf_counter() - start) * 1000
+        saved = _acl_apply_seconds.get(app.name)
+        if saved:
+            metrics.ACL_SECONDS_SAVED.inc(max(0.0, saved - verify_ms / 1000))
+            return f"Caddy ACLs verified on {root} in {verify_ms:.1f} ms (skipped setfacl, last full apply took {saved * 1000:.0f} ms).\n"
+        return f"Caddy ACLs verified on {root} in {verify_ms:.1f} ms (skipped setfacl).\n"
+
+    start = time.perf_counter()
+    with metrics.deploy_step("permissions"):
+        run_command(f"setfacl -m u:{CADDY_USER}:x {' '.join(shlex.quote(path) for path in traverse)}")
+        # X: execute only on directories; d: the default ACL new files and folders inherit
+        run_command(f"setfacl -R -m u:{CADDY_USER}:rX,d:u:{CADDY_USER}:rX {shlex.quote(root)}")
+    elapsed = time.perf_counter() - start
+    _acl_apply_seconds[app.name] = elapsed
+    return f"Granted caddy read access to {root} with a default ACL in {elapsed * 1000:.0f} ms.\n"
+
+
 def build_app(app: AppModel) -> str:
-    www_path = f"/home/{app.name}/www"
+    www_path = app_www(app.name)
     # We wrap the build command in bash -c so chained commands (&&) run inside the mise environment
     # shlex.quote() is used on the inner command to prevent it from being split incorrectly
     quoted_build = shlex.quote(app.build_command)
@@ -181,6 +496,111 @@ def build_app(app: AppModel) -> str:
     return run_as_user(app.name, cmd, www_path)
 
 
+# Runtimes whose installed dependencies point at absolute paths (a virtualenv's bin/python links to
+# the mise install, its shebangs name the checkout), so their builds are never stored
+PATH_BOUND_RUNTIMES = ("python",)
+
+
+def artifact_source(app: AppModel) -> str:
+    # Static apps only need their build output; server apps the checkout with everything the build installed
+    return os.path.normpath(static_root(app)) if is_static(app) else app_www(app.name)
+
+
+def artifact_key(app: AppModel, budget: int) -> Optional[str]:
+    """
+    Content address of the app's build: commit, runtime and build command (plus the output folder
+    for static apps). The repo URL and app name are not part of it, so apps deploying the same
+    repo share artifacts. None when the commit is unknown or the store is disabled (budget 0).
+    """
+    if not app.deployed_commit or budget <= 0:
+        return None
+    if not is_static(app) and app.language_version.split(":")[0].split("@")[0] in PATH_BOUND_RUNTIMES:
+        return None
+    www_path = os.path.realpath(app_www(app.name))
+    if os.path.commonpath([os.path.realpath(artifact_source(app)), www_path]) != www_path:
+        return None  # output outside the checkout
+    parts = [app.deployed_commit, app.language_version, app.build_command]
+    if is_static(app):
+        parts.append(app.start_command)
+    return artifacts.build_key(parts)
+
+
+def restore_build(app: AppModel, budget: int) -> Optional[str]:
+    """
+    Unpacks the stored artifact of this exact build, if any, in place of install + build.
+    Returns the deploy log line, or None when the app has to be built.
+    """
+    key = artifact_key(app, budget)
+    if key is None:
+        return None
+    source = artifact_source(app)
+    if not os.path.exists(artifacts.artifact_path(key)):
+        metrics.ARTIFACT_OPERATIONS.labels("miss").inc()
+        return None
+
+    start = time.perf_counter()
+    # Extracted next to the checkout first, so a failed restore never leaves a partial tree behind
+    staging = os.path.join(app_home(app.name), f".bmp-restore-{time.time_ns()}")
+    try:
+        os.makedirs(staging)
+        if not artifacts.unpack(key, staging):
+            wipe_directory(app.name, staging)
+            return None  # evicted in the meantime
+        run_command(f"chown -R {app.name}:{app.name} {shlex.quote(staging)}")
+    except Exception as e:
+        wipe_directory(app.name, staging)
+        print(f"Warning: Failed to restore build artifact {key[:12]} for {app.name}, rebuilding: {e}")
+        return None
+
+    if source == app_www(app.name):
+        # Server apps: the artifact's entries replace the checkout's (.git and .tool-versions stay)
+        replace_entries(app.name, staging, source)
+    else:
+        # Static apps: the whole output folder is swapped, so no stale file survives
+        os.makedirs(os.path.dirname(source), exist_ok=True)
+        wipe_directory(app.name, source)
+        os.rename(staging, source)
+    elapsed = (time.perf_counter() - start) * 1000
+    return f"Restored build artifact {key[:12]} of {app.deployed_commit[:12]} into {source} in {elapsed:.0f} ms (skipped the build).\n"
+
+
+def replace_entries(name: str, staging: str, target: str):
+    """Moves every entry of staging into target, sending the entries they replace to the trash."""
+    os.makedirs(trash_path(name), exist_ok=True)
+    stamp = time.time_ns()
+    for entry in os.listdir(staging):
+        dest = os.path.join(target, entry)
+        if os.path.lexists(dest):
+            os.rename(dest, os.path.join(trash_path(name), f"{entry}-{stamp}"))
+        os.rename(os.path.join(staging, entry), dest)
+    os.rmdir(staging)
+    threading.Thread(target=purge_trash, args=(name,), daemon=True).start()
+
+
+def store_build(app: AppModel, budget: int) -> str:
+    """
+    Packs the finished build into the artifact store, so later deploys of the same key skip it.
+    The store is kept within `budget` bytes.
+    """
+    key = artifact_key(app, budget)
+    source = artifact_source(app)
+    if key is None or not os.path.isdir(source):
+        return ""
+    meta = {
+        "commit": app.deployed_commit,
+        "runtime": app.language_version,
+        "build_command": app.build_command,
+        "repo_url": app.repo_url,
+        "app": app.name,
+    }
+    # The checkout and .tool-versions come from the clone and mise config steps of every deploy
+    exclude = (".git", ".tool-versions") if source == app_www(app.name) else ()
+    start = time.perf_counter()
+    size = artifacts.pack(key, source, meta, exclude, budget)
+    elapsed = (time.perf_counter() - start) * 1000
+    return f"Stored build artifact {key[:12]} ({size // 1024} KiB) in {elapsed:.0f} ms.\n"
+
+
 SERVICE_TEMPLATE = """[Unit]
 Description={name}
 
@@ -197,59 +617,501 @@ WantedBy=multi-user.target
 """
 
 
-def create_systemd_service(app: AppModel) -> str:
-    service_path = f"/etc/systemd/system/{app.name}.service"
-    
-    clean_version = app.language_version.split(":")[0]
-    
-    if ":static" in app.language_version:
-        # Static App: Just keep the service alive for status checks
-        exec_start = "/usr/bin/sleep infinity"
+# AppModel field -> systemd resource-control property
+RESOURCE_PROPERTIES = {
+    "memory_max": "MemoryMax",
+    "memory_high": "MemoryHigh",
+    "cpu_quota": "CPUQuota",
+    "cpu_weight": "CPUWeight",
+    "io_weight": "IOWeight",
+    "tasks_max": "TasksMax",
+}
+
+
+# Values that reset each property to systemd's default (no limit)
+RESOURCE_DEFAULTS = {
+    "MemoryMax": "infinity",
+    "MemoryHigh": "infinity",
+    "CPUQuota": "",
+    "CPUWeight": "",
+    "IOWeight": "",
+    "TasksMax": "infinity",
+}
+
+
+# systemd's grammar for each limit: sizes ("512M", "1.5G", "80%", "infinity"), a CPU percentage, weights
+SIZE_PATTERN = re.compile(r"(\d+(\.\d+)?[KMGT]?|\d+(\.\d+)?%|infinity)")
+PERCENT_PATTERN = re.compile(r"\d+(\.\d+)?%")
+TASKS_PATTERN = re.compile(r"(\d+|\d+(\.\d+)?%|infinity)")
+WEIGHT_RANGE = (1, 10000)
+
+
+def validate_resource_value(field: str, value) -> None:
+    """
+    Raises ValueError unless the value is valid for the limit's systemd property, so nothing
+    else can reach the unit file or the set-property command line.
+    """
+    if value is None:
+        return
+    text = str(value)
+    if field in ("memory_max", "memory_high"):
+        valid = SIZE_PATTERN.fullmatch(text) is not None
+    elif field == "cpu_quota":
+        valid = PERCENT_PATTERN.fullmatch(text) is not None
+    elif field in ("cpu_weight", "io_weight"):
+        valid = text.isdigit() and WEIGHT_RANGE[0] <= int(text) <= WEIGHT_RANGE[1]
+    elif field == "tasks_max":
+        valid = TASKS_PATTERN.fullmatch(text) is not None
     else:
-        # Standard App: Run the server via Mise
-        exec_start = f"{MISE_PATH} exec {clean_version} -- {app.start_command}"
+        raise ValueError(f"Unknown resource limit {field}")
+    if not valid:
+        raise ValueError(f"Invalid value for {field}: {text!r}")
+
+
+def get_resource_properties(app: AppModel) -> dict:
+    """
+    Returns the systemd properties for the resource limits set on the app.
+    """
+    props = {}
+    for field, prop in RESOURCE_PROPERTIES.items():
+        value = getattr(app, field)
+        if value is not None:
+            validate_resource_value(field, value)
+            props[prop] = str(value)
+    return props
+
+
+def get_placement_properties(app: AppModel) -> dict:
+    """
+    Returns the cpuset properties assigned to the app by the placement scheduler.
+    """
+    props = {}
+    if app.allowed_cpus:
+        props["AllowedCPUs"] = app.allowed_cpus
+    if app.allowed_memory_nodes:
+        props["AllowedMemoryNodes"] = app.allowed_memory_nodes
+    return props
+
 
-    content = f"""[Unit]
-Description={app.name} {'(Static)' if ':static' in app.language_version else ''}
+# journald budgets: every unit gets a rate limit, apps with log_namespace their own journal
+LOG_RATE_LIMIT_INTERVAL = "30s"
+DEFAULT_LOG_RATE_LIMIT_BURST = 10000  # messages per interval and unit (journald's own default)
+DEFAULT_LOG_NAMESPACE_MAX_MB = 128  # disk cap of each namespace's journal, overridable via the settings table
+
+
+def log_namespace(app: AppModel) -> Optional[str]:
+    return f"bmp-{app.name}" if app.log_namespace and not is_static(app) else None
+
+
+def journald_conf_path(namespace: str) -> str:
+    return os.path.join(JOURNALD_CONF_DIR, f"journald@{namespace}.conf")
+
+
+def get_log_properties(app: AppModel) -> dict:
+    burst = DEFAULT_LOG_RATE_LIMIT_BURST if app.log_rate_limit_burst is None else app.log_rate_limit_burst
+    props = {"LogRateLimitIntervalSec": LOG_RATE_LIMIT_INTERVAL, "LogRateLimitBurst": burst}
+    namespace = log_namespace(app)
+    if namespace:
+        props["LogNamespace"] = namespace
+    return props
+
+
+class DeploySettings(BaseModel):
+    """
+    Host-wide settings a deploy depends on. They live in the controller's settings table;
+    agents have no database and get them with each deploy request.
+    """
+    log_namespace_max_mb: int = DEFAULT_LOG_NAMESPACE_MAX_MB
+    artifact_store_mb: int = artifacts.DEFAULT_STORE_MB
+
+
+def get_deploy_settings() -> DeploySettings:
+    """Reads the deploy settings from the settings table (controller only)."""
+    return DeploySettings(
+        log_namespace_max_mb=get_int_setting("log_namespace_max_mb", DEFAULT_LOG_NAMESPACE_MAX_MB),
+        artifact_store_mb=get_int_setting("artifact_store_mb", artifacts.DEFAULT_STORE_MB),
+    )
+
+
+def render_journald_conf(app: AppModel, max_mb: int = DEFAULT_LOG_NAMESPACE_MAX_MB) -> str:
+    burst = DEFAULT_LOG_RATE_LIMIT_BURST if app.log_rate_limit_burst is None else app.log_rate_limit_burst
+    return f"""[Journal]
+SystemMaxUse={max_mb}M
+RuntimeMaxUse={max_mb}M
+RateLimitIntervalSec={LOG_RATE_LIMIT_INTERVAL}
+RateLimitBurst={burst}
+"""
+
+
+def write_journald_conf(app: AppModel, max_mb: int = DEFAULT_LOG_NAMESPACE_MAX_MB) -> str:
+    """
+    Writes (or removes) the config of the app's journald namespace instance, capped at max_mb.
+    An instance that is already running is restarted to pick up a changed config; otherwise it
+    starts with the unit.
+    """
+    path = journald_conf_path(f"bmp-{app.name}")
+    if not log_namespace(app):
+        if os.path.exists(path):
+            os.remove(path)
+            return f"Removed journal namespace config {path}.\n"
+        return ""
+
+    content = render_journald_conf(app, max_mb)
+    try:
+        with open(path) as f:
+            if f.read() == content:
+                return ""
+    except FileNotFoundError:
+        pass
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+    try:
+        run_command(f"systemctl try-restart systemd-journald@bmp-{app.name}.service")
+    except Exception as e:
+        print(f"Warning: Failed to restart the journal namespace of {app.name}: {e}")
+    return f"Journal namespace bmp-{app.name} configured.\n"
+
+
+def render_systemd_service(app: AppModel) -> str:
+    # Only apps with a server process get a unit; static sites are served by Caddy alone
+    clean_version = app.language_version.split(":")[0]
+    exec_start = f"{MISE_PATH} exec {clean_version} -- {app.start_command}"
+
+    props = get_resource_properties(app)
+    props.update(get_placement_properties(app))
+    props.update(get_log_properties(app))
+    resource_lines = "".join(f"{prop}={value}\n" for prop, value in props.items())
+    # On an agent node the app is reached by the controller's Caddy over the network, not via localhost
+    host_line = "Environment=HOST=0.0.0.0\n" if app.node else ""
+
+    return f"""[Unit]
+Description={app.name}
 
 [Service]
 User={app.name}
 Group={app.name}
-WorkingDirectory=/home/{app.name}/www
+WorkingDirectory={app_www(app.name)}
 Environment=PORT={app.port}
-ExecStart={exec_start}
+{host_line}ExecStart={exec_start}
 Restart=always
-
+{resource_lines}
 [Install]
 WantedBy=multi-user.target
 """
 
-    with open(service_path, "w") as f:
+
+def write_systemd_service(app: AppModel) -> bool:
+    """
+    Writes the app's unit file only if the rendered content differs from what is on disk.
+    Returns True if the file was created or changed (i.e. a daemon-reload is needed).
+    """
+    service_path = unit_path(app.name)
+    content = render_systemd_service(app)
+
+    try:
+        with open(service_path) as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    # Write-then-rename so systemd never reads a half-written unit
+    tmp_path = f"{service_path}.tmp"
+    with open(tmp_path, "w") as f:
         f.write(content)
+    os.replace(tmp_path, service_path)
+    return True
 
-    cmds = ["systemctl daemon-reload", f"systemctl enable {app.name}.service", f"systemctl restart {app.name}.service"]
 
-    logs = ""
-    for cmd in cmds:
-        out = run_command(cmd)
-        logs += f"Running {cmd}: {out}\n"
+class SystemdBatch:
+    """
+    Collects unit changes so bulk operations pay for a single daemon-reload and
+    a single systemctl call per action instead of three forks per app.
+
+        with SystemdBatch() as batch:
+            for app in apps:
+                create_systemd_service(app, batch)
+    """
+
+    def __init__(self):
+        self.reload_needed = False
+        self.enable = []
+        self.restart = []
+        self.disable = []
+        self.remove = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+
+    def flush(self) -> str:
+        logs = ""
+        if self.disable:
+            # Units being removed are stopped while systemd still has their files
+            cmd = "systemctl disable --now " + " ".join(self.disable)
+            try:
+                logs += f"Running {cmd}: {run_command(cmd)}\n"
+            except Exception:
+                pass  # Ignore errors if not running
+        for path in self.remove:
+            if os.path.exists(path):
+                os.remove(path)
+                self.reload_needed = True
+
+        cmds = []
+        if self.reload_needed:
+            cmds.append("systemctl daemon-reload")
+        if self.enable:
+            # New units: enabled and started in one call
+            cmds.append("systemctl enable --now " + " ".join(self.enable))
+        if self.restart:
+            cmds.append("systemctl restart " + " ".join(self.restart))
+
+        self.reload_needed = False
+        self.enable, self.restart, self.disable, self.remove = [], [], [], []
+        for cmd in cmds:
+            logs += f"Running {cmd}: {run_command(cmd)}\n"
+        return logs
+
 
+def create_systemd_service(app: AppModel, batch: Optional[SystemdBatch] = None,
+                           settings: Optional[DeploySettings] = None) -> str:
+    """
+    Installs/updates the app's unit and (re)starts it.
+    With a batch, the reload and restart are deferred until the batch is flushed.
+    Without settings they are read from the settings table, so agents must pass them.
+    """
+    service_name = f"{app.name}.service"
+    service_path = unit_path(app.name)
+    is_new = not os.path.exists(service_path)
+    # The namespace's journald config must exist before the unit (re)starts into it
+    settings = settings or get_deploy_settings()
+    logs = write_journald_conf(app, settings.log_namespace_max_mb)
+    changed = write_systemd_service(app)
+
+    own_batch = batch is None
+    batch = batch or SystemdBatch()
+    batch.reload_needed = batch.reload_needed or changed
+    if is_new:
+        # Nothing runs yet, so `enable --now` both enables and starts it
+        batch.enable.append(service_name)
+    else:
+        batch.restart.append(service_name)
+
+    if not own_batch:
+        return logs + f"Unit {service_name} {'updated' if changed else 'unchanged'}, restart queued.\n"
+    return logs + batch.flush()
+
+
+def apply_resource_limits(app: AppModel) -> str:
+    """
+    Applies the app's resource limits to the running unit without a restart.
+    The unit file is rewritten as well so the limits survive the next boot.
+    Limits that were cleared (None) are reset to systemd's defaults.
+    """
+    if is_static(app):
+        return "Static sites have no process, resource limits are not applied.\n"
+
+    service_name = f"{app.name}.service"
+    if write_systemd_service(app):
+        run_command("systemctl daemon-reload")
+
+    props = dict(RESOURCE_DEFAULTS)
+    props.update(get_resource_properties(app))
+    # argv, no shell: the values never pass through a command line parser
+    return run_exec(["systemctl", "set-property", "--runtime", service_name] + [f"{prop}={value}" for prop, value in props.items()])
+
+
+def apply_placement(apps: List[AppModel]) -> str:
+    """
+    Moves the apps' running units onto their assigned CPUs and memory nodes without a restart.
+    Unit files are rewritten with a single daemon-reload so the placement survives reboots.
+    """
+    changed = [write_systemd_service(app) for app in apps]
+    if any(changed):
+        run_command("systemctl daemon-reload")
+
+    logs = ""
+    for app in apps:
+        # Empty assignments reset the cpuset to "all CPUs / all nodes"
+        cpus = app.allowed_cpus or ""
+        nodes = app.allowed_memory_nodes or ""
+        try:
+            run_exec(["systemctl", "set-property", "--runtime", f"{app.name}.service", f"AllowedCPUs={cpus}", f"AllowedMemoryNodes={nodes}"])
+            logs += f"{app.name}: AllowedCPUs={cpus or 'all'} AllowedMemoryNodes={nodes or 'all'}\n"
+        except Exception as e:
+            logs += f"{app.name}: Warning: Failed to apply placement: {e}\n"
     return logs
 
 
-def remove_systemd_service(name: str):
+def get_app_cpu_usage(name: str) -> float:
+    """
+    Returns the average number of cores the app's unit has used since it was last started.
+    """
+    with metrics.track_subprocess("systemctl"):
+        _, stdout, _ = _backend.run_exec(
+            ["systemctl", "show", f"{name}.service", "-p", "CPUUsageNSec", "-p", "ActiveEnterTimestampMonotonic"]
+        )
+    values = dict(line.partition("=")[::2] for line in stdout.splitlines())
+    try:
+        usage_ns = int(values.get("CPUUsageNSec", ""))
+        started_us = int(values.get("ActiveEnterTimestampMonotonic", ""))
+    except ValueError:
+        # Not running, or CPU accounting disabled ([not set])
+        return 0.0
+
+    # systemd's monotonic timestamps use the same clock as time.monotonic() on Linux
+    uptime_ns = time.monotonic_ns() - started_us * 1000
+    if started_us == 0 or uptime_ns <= 0:
+        return 0.0
+    return usage_ns / uptime_ns
+
+
+CPU_QUOTA_SHOW_PROPERTY = "CPUQuotaPerSecUSec"
+TIMESPAN_UNITS = {"us": 1e-6, "ms": 1e-3, "s": 1.0, "min": 60.0}
+TIMESPAN_PART = re.compile(r"(\d+(?:\.\d+)?)(us|ms|s|min)")
+
+
+def cpu_quota_percent(value: str) -> str:
+    """Converts CPUQuotaPerSecUSec ("1.500000s", "500ms", "infinity") back to the CPUQuota form ("150%", "")."""
+    parts = TIMESPAN_PART.findall(value)
+    if not parts or "".join(number + unit for number, unit in parts) != value.replace(" ", ""):
+        return ""  # infinity: no quota
+    seconds = sum(float(number) * TIMESPAN_UNITS[unit] for number, unit in parts)
+    return f"{seconds * 100:g}%"
+
+
+def get_effective_resource_limits(name: str) -> dict:
+    """
+    Reads the resource limits systemd is currently enforcing for the app's unit.
+    """
+    # systemd reports CPUQuota only as the CPU time allowed per second
+    props = ",".join(CPU_QUOTA_SHOW_PROPERTY if prop == "CPUQuota" else prop for prop in RESOURCE_PROPERTIES.values())
+    with metrics.track_subprocess("systemctl"):
+        returncode, stdout, stderr = _backend.run_exec(["systemctl", "show", f"{name}.service", "-p", props])
+    if returncode != 0:
+        raise Exception(f"Failed to read unit properties: {stderr.strip()}")
+
+    effective = {}
+    for line in stdout.splitlines():
+        key, _, value = line.partition("=")
+        if key == CPU_QUOTA_SHOW_PROPERTY:
+            effective["CPUQuota"] = cpu_quota_percent(value)
+        elif key:
+            effective[key] = value
+    return effective
+
+
+def remove_systemd_service(name: str, batch: Optional[SystemdBatch] = None):
     service_name = f"{name}.service"
+
+    own_batch = batch is None
+    batch = batch or SystemdBatch()
+    # Stopped and disabled before the file is removed; errors are ignored if it is not running
+    batch.disable.append(service_name)
+    batch.remove.append(unit_path(name))
+    # The namespace's journal files stay in /var/log/journal until journald vacuums them
+    batch.remove.append(journald_conf_path(f"bmp-{name}"))
+
+    if own_batch:
+        batch.flush()
+
+
+def publish_static_site(app: AppModel, batch: Optional[SystemdBatch] = None) -> str:
+    """
+    Final deploy step for static apps, in place of the unit: records the build output as the
+    published root and enables the site (like a restart would start a stopped unit).
+    Caddy serves it once the caller reloads the config. The `sleep infinity` placeholder
+    unit older versions created is removed.
+    """
+    root = static_root(app)
+    logs = ""
+    if not os.path.isdir(root):
+        logs += f"Warning: Build output {root} not found, the site stays stopped until it exists.\n"
+    app.published_root, app.static_enabled = root, True
+    set_app_published_root(app.name, root)
+    if os.path.exists(unit_path(app.name)):
+        remove_systemd_service(app.name, batch)
+        logs += f"Removed placeholder unit {app.name}.service.\n"
+    return logs + f"Published {root}.\n"
+
+
+def migrate_placeholder_units(apps: List[AppModel]) -> str:
+    """
+    Removes the `sleep infinity` units older versions created for static sites, with one
+    daemon-reload for all. A stopped placeholder carries over as a disabled site.
+    """
+    names = [app.name for app in apps]
+    states = get_service_statuses(names)
+    stopped = [name for name in names if states[name] == "stopped"]
+    if stopped:
+        set_apps_static_enabled(stopped, False)
+    batch = SystemdBatch()
+    for name in names:
+        remove_systemd_service(name, batch)
+    return batch.flush()
+
+
+def parse_service_statuses(names: List[str], output: str) -> dict:
+    """
+    Maps `systemctl is-active a.service b.service ...` output (one state per line, in order) to
+    'running'/'stopped'. Apps with a deploy lock are reported as 'deploying'.
+    """
+    states = output.splitlines()
+    statuses = {}
+    for i, name in enumerate(names):
+        if LockManager(name).is_locked():
+            statuses[name] = "deploying"
+        elif i < len(states) and states[i].strip() == "active":
+            statuses[name] = "running"
+        else:
+            statuses[name] = "stopped"
+    return statuses
+
+
+def get_service_statuses(names: List[str]) -> dict:
+    """
+    Returns {name: status} for many apps using a single systemctl fork.
+    """
+    if not names:
+        return {}
     try:
-        run_command(f"systemctl stop {service_name}")
-        run_command(f"systemctl disable {service_name}")
-    except:
-        pass  # Ignore errors if not running
+        # is-active exits non-zero if any unit is inactive, but still prints every state
+        with metrics.track_subprocess("systemctl"):
+            _, stdout, _ = _backend.run_exec(["systemctl", "is-active", *[f"{name}.service" for name in names]])
+        return parse_service_statuses(names, stdout)
+    except Exception:
+        return parse_service_statuses(names, "")
 
-    service_path = f"/etc/systemd/system/{service_name}"
-    if os.path.exists(service_path):
-        os.remove(service_path)
 
-    run_command("systemctl daemon-reload")
+def get_static_statuses(apps: List[AppModel]) -> dict:
+    """
+    Static sites have no unit: one is 'running' while it is enabled and its published
+    build output exists, 'deploying' while locked like any other app. No fork involved.
+    """
+    statuses = {}
+    for app in apps:
+        if LockManager(app.name).is_locked():
+            statuses[app.name] = "deploying"
+        elif app.static_enabled and os.path.isdir(published_root(app)):
+            statuses[app.name] = "running"
+        else:
+            statuses[app.name] = "stopped"
+    return statuses
+
+
+def get_app_statuses(apps: List[AppModel]) -> dict:
+    """
+    Returns {name: status} for app models: static sites from the DB and the filesystem,
+    everything else from a single systemctl fork.
+    """
+    statuses = get_static_statuses([app for app in apps if is_static(app)])
+    statuses.update(get_service_statuses([app.name for app in apps if not is_static(app)]))
+    return statuses
 
 
 def get_service_status(name: str) -> str:
@@ -257,29 +1119,216 @@ def get_service_status(name: str) -> str:
     Returns 'running' if the systemd service is active, 'stopped' otherwise.
     Returns 'deploying' if the lock file exists.
     """
-    if LockManager(name).is_locked():
-        return "deploying"
+    return get_service_statuses([name])[name]
 
-    service_name = f"{name}.service"
+
+async def run_exec_async(*args: str) -> tuple:
+    """
+    Runs a command without a shell on the event loop. Returns (returncode, combined output).
+    """
+    with metrics.track_subprocess(args):
+        return await _backend.run_exec_async(list(args))
+
+
+async def get_service_statuses_async(names: List[str]) -> dict:
+    if not names:
+        return {}
     try:
-        # systemctl is-active returns 0 if active, non-zero otherwise.
-        # We use a list and shell=False (default) to prevent shell injection.
-        result = subprocess.run(
-            ["systemctl", "is-active", service_name],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
+        _, out = await run_exec_async(
+            "systemctl", "is-active", *[f"{name}.service" for name in names]
         )
-        if result.returncode == 0:
-            return "running"
-        return "stopped"
+        return parse_service_statuses(names, out)
     except Exception:
-        return "stopped"
+        return parse_service_statuses(names, "")
 
 
-def update_caddy_config():
-    apps = get_apps()
-    
+async def get_service_status_async(name: str) -> str:
+    return (await get_service_statuses_async([name]))[name]
+
+
+async def get_app_statuses_async(apps: List[AppModel]) -> dict:
+    statuses = get_static_statuses([app for app in apps if is_static(app)])
+    statuses.update(await get_service_statuses_async([app.name for app in apps if not is_static(app)]))
+    return statuses
+
+
+async def get_app_logs_async(name: str, lines: int = 100, namespace: Optional[str] = None) -> str:
+    """
+    Fetches the last lines of the app's journal without blocking the event loop.
+    Apps with their own journal namespace are read from it.
+    """
+    args = ["journalctl", "-u", f"{name}.service", "-n", str(lines), "--no-pager"]
+    if namespace:
+        args.append(f"--namespace={namespace}")
+    _, out = await run_exec_async(*args)
+    return out
+
+
+async def start_service_async(name: str):
+    code, out = await run_exec_async("systemctl", "start", f"{name}.service")
+    if code != 0:
+        raise Exception(f"Command failed: systemctl start {name}.service\nOutput: {out}")
+
+
+async def stop_service_async(name: str):
+    code, out = await run_exec_async("systemctl", "stop", f"{name}.service")
+    if code != 0:
+        raise Exception(f"Command failed: systemctl stop {name}.service\nOutput: {out}")
+
+
+async def bulk_service_action_async(names: List[str], action: str) -> tuple:
+    """
+    Runs one `systemctl start|stop|restart a.service b.service ...` for many apps.
+    Returns (returncode, output); per-unit outcomes are read back with is-active.
+    """
+    if action not in ("start", "stop", "restart"):
+        raise ValueError(f"Unsupported action '{action}'")
+    return await run_exec_async("systemctl", action, *[f"{name}.service" for name in names])
+
+
+def set_static_enabled(apps: List[AppModel], enabled: bool) -> tuple:
+    """
+    Start/stop for static sites: only the DB flag changes, the caller reloads Caddy.
+    Returns (returncode, output) like bulk_service_action_async; a site without its
+    published build output cannot be started.
+    """
+    set_apps_static_enabled([app.name for app in apps], enabled)
+    for app in apps:
+        app.static_enabled = enabled
+    missing = [app for app in apps if enabled and not os.path.isdir(published_root(app))]
+    output = "".join(f"{app.name}: {published_root(app)} not found, redeploy first\n" for app in missing)
+    return (1 if missing else 0), output
+
+
+async def bulk_app_action_async(apps: List[AppModel], action: str) -> tuple:
+    """
+    bulk_service_action_async for app models: one systemctl call for the apps with a unit,
+    one DB update for the static sites among them.
+    """
+    if action not in ("start", "stop", "restart"):
+        raise ValueError(f"Unsupported action '{action}'")
+    code, output = 0, ""
+    static = [app for app in apps if is_static(app)]
+    if static:
+        code, output = set_static_enabled(static, action != "stop")
+    names = [app.name for app in apps if not is_static(app)]
+    if names:
+        rc, out = await bulk_service_action_async(names, action)
+        code, output = code or rc, output + out
+    return code, output
+
+
+# Reverse-proxy tuning per workload, selected with AppModel.proxy_profile.
+# "proxy" options go in the reverse_proxy block, "transport" ones in its `transport http` block.
+PROXY_PROFILES = {
+    "api": {
+        "description": "JSON APIs: pooled keep-alive upstream connections, small request bodies buffered "
+                       "so slow clients do not hold app workers, compressed responses.",
+        "encode": True,
+        "proxy": [("request_buffers", "64KiB")],
+        "transport": [
+            ("keepalive", "2m"),
+            ("keepalive_idle_conns_per_host", "64"),
+            ("dial_timeout", "3s"),
+            ("response_header_timeout", "60s"),
+        ],
+    },
+    "h2c": {
+        "description": "Like api, for apps that speak HTTP/2 without TLS (e.g. gRPC): "
+                       "one multiplexed upstream connection instead of a pool.",
+        "encode": True,
+        "proxy": [],
+        "transport": [
+            ("versions", "h2c 2"),
+            ("keepalive", "2m"),
+            ("dial_timeout", "3s"),
+        ],
+    },
+    "streaming": {
+        "description": "SSE, WebSockets and long polling: every write is flushed at once, no compression "
+                       "or response timeout, and open streams survive Caddy reloads for 5 minutes.",
+        "encode": False,
+        "proxy": [("flush_interval", "-1"), ("stream_close_delay", "5m")],
+        "transport": [
+            ("keepalive", "2m"),
+            ("dial_timeout", "3s"),
+        ],
+    },
+    "upload": {
+        "description": "Large uploads: request bodies are streamed to the app unbuffered through a larger "
+                       "write buffer, and the app gets 10 minutes to answer once a body is sent.",
+        "encode": True,
+        "proxy": [],
+        "transport": [
+            ("keepalive", "2m"),
+            ("dial_timeout", "3s"),
+            ("write_buffer", "256KiB"),
+            ("response_header_timeout", "10m"),
+        ],
+    },
+}
+
+
+def render_reverse_proxy(app: AppModel, upstream: str) -> List[str]:
+    """
+    The app's reverse_proxy directive, tuned by its proxy profile (Caddy's defaults without one).
+    """
+    profile = PROXY_PROFILES.get(app.proxy_profile) if app.proxy_profile else None
+    if app.proxy_profile and profile is None:
+        print(f"Warning: Unknown proxy profile '{app.proxy_profile}' for {app.name}, using the default")
+    if profile is None:
+        return [f"    reverse_proxy {upstream}:{app.port}"]
+
+    lines = ["    encode zstd gzip"] if profile["encode"] else []
+    lines.append(f"    reverse_proxy {upstream}:{app.port} {{")
+    lines += [f"        {option} {value}" for option, value in profile["proxy"]]
+    lines.append("        transport http {")
+    lines += [f"            {option} {value}" for option, value in profile["transport"]]
+    lines.append("        }")
+    lines.append("    }")
+    return lines
+
+
+def render_cache_headers(app: AppModel) -> List[str]:
+    """
+    Cache-Control for a static app: the app's own rules first (first match wins), then
+    immutable for fingerprinted files that exist, else revalidate. Matchers are made disjoint
+    so Caddy's directive sorting cannot change which rule applies.
+    """
+    try:
+        rules = parse_cache_rules(app.cache_rules)
+    except ValueError as e:
+        print(f"Warning: Ignoring cache rules of {app.name}: {e}")
+        rules = []
+
+    lines = [f'    header ?Cache-Control "{precompress.DEFAULT_CACHE_CONTROL}"']
+    taken = []
+    for i, (path, value) in enumerate(rules):
+        lines.append(f"    @cache_{i} {{")
+        lines.append(f"        path {path}")
+        if taken:
+            lines.append(f"        not path {' '.join(taken)}")
+        lines.append("    }")
+        lines.append(f'    header @cache_{i} Cache-Control "{value}"')
+        taken.append(path)
+
+    if app.immutable_paths:
+        lines.append("    @immutable {")
+        lines.append(f"        path {app.immutable_paths}")
+        if taken:
+            lines.append(f"        not path {' '.join(taken)}")
+        # Missing assets fall through to index.html, which must not be cached forever
+        lines.append("        file")
+        lines.append("    }")
+        lines.append(f'    header @immutable Cache-Control "{precompress.IMMUTABLE_CACHE_CONTROL}"')
+    return lines
+
+
+def render_caddyfile(apps: List[AppModel], statuses: dict, node_hosts: Optional[dict] = None) -> str:
+    """
+    node_hosts maps agent node names to the host Caddy proxies to; apps without a node run here.
+    """
+    node_hosts = node_hosts or {}
     # Start with global options
     caddyfile_lines = [
         "{",
@@ -293,19 +1342,8 @@ def update_caddy_config():
     admin_pass_hash = os.getenv("ADMIN_PASSWORD_HASH")
 
     if dashboard_domain:
-        caddyfile_lines.append(f"{dashboard_domain} {{")
-        
-        # Add Basic Auth if configured
-        if admin_user and admin_pass_hash:
-            caddyfile_lines.append("    @secure {")
-            caddyfile_lines.append("        not path /api/hooks/*")
-            caddyfile_lines.append("    }")
-            caddyfile_lines.append("    basic_auth @secure {")
-            caddyfile_lines.append(f"        {admin_user} {admin_pass_hash}")
-            caddyfile_lines.append("    }")
-
-        caddyfile_lines.append("    reverse_proxy localhost:1323")
-        caddyfile_lines.append("}")
+        # The built bundle is served by Caddy itself, only the API goes to uvicorn
+        caddyfile_lines += dashboard.render_site(dashboard_domain, admin_user, admin_pass_hash)
 
     # 2. Add App Routes
     for app in apps:
@@ -313,88 +1351,220 @@ def update_caddy_config():
             continue
             
         # Check status: Only serve if running or deploying (to keep old config during deploy)
-        status = get_service_status(app.name)
+        status = statuses.get(app.name, "stopped")
         if status == "stopped":
             continue
 
         caddyfile_lines.append(f"{app.domain} {{")
+        # JSON access log per app, tailed by traffic.py for the analytics
+        caddyfile_lines.append("    log {")
+        caddyfile_lines.append(f"        output file {traffic.access_log_path(app.name)} {{")
+        caddyfile_lines.append("            roll_size 50MiB")
+        caddyfile_lines.append("            roll_keep 2")
+        caddyfile_lines.append("        }")
+        caddyfile_lines.append("        format json")
+        caddyfile_lines.append("    }")
         
-        if app.language_version and ":static" in app.language_version:
+        if is_static(app):
             # Static Site Config
-            # app.start_command acts as the relative path to dist/build folder
-            web_root = f"/home/{app.name}/www/{app.start_command}"
-            caddyfile_lines.append(f"    root * {web_root}")
-            caddyfile_lines.append("    file_server")
+            # Served from the build output the last deploy published (app.start_command relative to the checkout)
+            caddyfile_lines.append(f"    root * {published_root(app)}")
+            caddyfile_lines += render_cache_headers(app)
             # SPA Fallback: try file, try directory, fall back to index.html
             caddyfile_lines.append("    try_files {path} {path}/ /index.html")
+            # Serve the .zst/.br/.gz siblings written after the build when the client accepts them
+            caddyfile_lines.append("    file_server {")
+            caddyfile_lines.append("        precompressed zstd br gzip")
+            caddyfile_lines.append("    }")
         elif app.port:
             # Standard Reverse Proxy
-            caddyfile_lines.append(f"    reverse_proxy localhost:{app.port}")
+            upstream = node_hosts.get(app.node, "localhost") if app.node else "localhost"
+            caddyfile_lines += render_reverse_proxy(app, upstream)
+            # Time spent waiting on the app itself, separate from the total request duration
+            caddyfile_lines.append("    log_append upstream_latency_ms {http.reverse_proxy.upstream.latency_ms}")
             
         caddyfile_lines.append("}")
 
-    caddyfile_content = "\n".join(caddyfile_lines)
+    return "\n".join(caddyfile_lines)
 
-    max_retries = 5
-    for attempt in range(max_retries):
-        try:
-            resp = requests.post(
-                "http://localhost:2019/load", 
-                headers={"Content-Type": "text/caddyfile"},
-                data=caddyfile_content
-            )
-            resp.raise_for_status()
-            return # Success!
-        except Exception as e:
-            if attempt < max_retries - 1:
-                print(f"Failed to update Caddy (attempt {attempt+1}/{max_retries}): {e}. Retrying in 1s...")
-                time.sleep(1)
-            else:
-                raise Exception(f"Failed to update Caddy after {max_retries} attempts: {e}")
+
+CADDY_ADMIN_URL = os.getenv("CADDY_ADMIN_URL", "http://localhost:2019")
+CADDY_MAX_RETRIES = 5
+
+# Keep-alive connections to the Caddy admin API (sync callers / event loop callers)
+_caddy_session = requests.Session()
+_caddy_client: Optional[httpx.AsyncClient] = None
+
+
+def get_caddy_client() -> httpx.AsyncClient:
+    global _caddy_client
+    if _caddy_client is None:
+        _caddy_client = httpx.AsyncClient(
+            base_url=CADDY_ADMIN_URL,
+            timeout=10.0,
+            limits=httpx.Limits(max_connections=4, max_keepalive_connections=4),
+        )
+    return _caddy_client
+
+
+async def close_caddy_client():
+    global _caddy_client
+    if _caddy_client is not None:
+        await _caddy_client.aclose()
+        _caddy_client = None
 
 
-def redeploy_app(app: AppModel) -> str:
+def update_caddy_config(caddyfile_content: Optional[str] = None):
+    if caddyfile_content is None:
+        apps = get_apps()
+        statuses = get_app_statuses([app for app in apps if app.domain])
+        caddyfile_content = render_caddyfile(apps, statuses)
+
+    max_retries = CADDY_MAX_RETRIES
+    with metrics.CADDY_APPLY_DURATION.time():
+        for attempt in range(max_retries):
+            try:
+                with profiling.span("caddy", "load"):
+                    resp = _caddy_session.post(
+                        f"{CADDY_ADMIN_URL}/load",
+                        headers={"Content-Type": "text/caddyfile"},
+                        data=caddyfile_content
+                    )
+                resp.raise_for_status()
+                return # Success!
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    metrics.CADDY_APPLY_RETRIES.inc()
+                    print(f"Failed to update Caddy (attempt {attempt+1}/{max_retries}): {e}. Retrying in 1s...")
+                    with profiling.span("caddy", "retry-wait"):
+                        time.sleep(1)
+                else:
+                    metrics.CADDY_APPLY_FAILURES.inc()
+                    raise Exception(f"Failed to update Caddy after {max_retries} attempts: {e}")
+
+
+async def update_caddy_config_async(caddyfile_content: Optional[str] = None):
     """
-    Orchestrates a full redeploy: Pull -> Config -> Install -> Build -> Restart Service
+    Same as update_caddy_config, but the status fork, the POST and the retry back-off
+    all yield to the event loop instead of holding a threadpool worker.
+    Callers that already rendered the Caddyfile can pass it in.
+    """
+    if caddyfile_content is None:
+        apps = get_apps()
+        statuses = await get_app_statuses_async([app for app in apps if app.domain])
+        caddyfile_content = render_caddyfile(apps, statuses)
+
+    client = get_caddy_client()
+    max_retries = CADDY_MAX_RETRIES
+    with metrics.CADDY_APPLY_DURATION.time():
+        for attempt in range(max_retries):
+            try:
+                with profiling.span("caddy", "load"):
+                    resp = await client.post(
+                        "/load",
+                        headers={"Content-Type": "text/caddyfile"},
+                        content=caddyfile_content
+                    )
+                resp.raise_for_status()
+                return
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    metrics.CADDY_APPLY_RETRIES.inc()
+                    print(f"Failed to update Caddy (attempt {attempt+1}/{max_retries}): {e}. Retrying in 1s...")
+                    with profiling.span("caddy", "retry-wait"):
+                        await asyncio.sleep(1)
+                else:
+                    metrics.CADDY_APPLY_FAILURES.inc()
+                    raise Exception(f"Failed to update Caddy after {max_retries} attempts: {e}")
+
+
+def redeploy_app(app: AppModel, batch: Optional[SystemdBatch] = None,
+                 settings: Optional[DeploySettings] = None) -> str:
+    """
+    Orchestrates a full redeploy under the app's deploy lock: Pull -> Config -> Install -> Build -> Restart Service
+    With a batch, the daemon-reload/restart is deferred until the batch is flushed.
     """
     lock = LockManager(app.name)
     lock.acquire()
-    
     try:
-        logs = f"Starting redeploy for {app.name}...\n"
-        
-        # 0. Ensure User & Permissions (Self-healing)
-        is_static = ":static" in (app.language_version or "")
-        create_app_user(app.name, is_static)
-        logs += f"User {app.name} ensured.\n"
+        return f"Starting redeploy for {app.name}...\n" + deploy_pipeline(app, batch, settings)
+    finally:
+        lock.release()
+
 
-        # 1. Clone/Pull
+def deploy_pipeline(app: AppModel, batch: Optional[SystemdBatch] = None,
+                    settings: Optional[DeploySettings] = None) -> str:
+    """
+    The steps every deploy of a local app runs, first deploys (/api/deploy) included.
+    The caller holds the app's deploy lock. Agents pass the settings sent by the controller;
+    without them they are read from the settings table.
+    """
+    settings = settings or get_deploy_settings()
+    budget = settings.artifact_store_mb * 1024 * 1024
+    logs = ""
+    # 0. Ensure User & Permissions (Self-healing)
+    static = is_static(app)
+    with metrics.deploy_step("user"):
+        create_app_user(app.name, static)
+    logs += f"User {app.name} ensured.\n"
+
+    # 1. Clone/Pull
+    with metrics.deploy_step("clone"):
         logs += clone_or_pull(app)
-        
-        # 2. Mise Config
+        app.deployed_commit = head_commit(app.name)
+    
+    # 2. Mise Config
+    with metrics.deploy_step("configure"):
         logs += configure_mise(app)
-        
-        # 3. Install Dependencies
-        logs += install_dependencies(app)
-        
-        # 4. Build
-        logs += build_app(app)
-        
-        # 5. Ensure permissions for static files (so Caddy can read them)
-        if is_static:
-            logs += "Setting permissions for static files...\n"
-            try:
-                # Grant caddy user rx permissions recursively on the www directory
-                run_command(f"setfacl -R -m u:caddy:rx /home/{app.name}/www")
-            except Exception as e:
-                logs += f"Warning: Failed to set ACLs for caddy: {e}\n"
+    
+    # 2.5 Build artifact of this exact commit, runtime and build command (replaces 3 and 4)
+    with metrics.deploy_step("restore"):
+        restored = restore_build(app, budget)
+
+    # 3. Install Dependencies (server apps still need the runtime on this host)
+    if restored is None or not static:
+        with metrics.deploy_step("install"):
+            logs += install_dependencies(app)
+    
+    # 4. Build
+    if restored is None:
+        with metrics.deploy_step("build"):
+            logs += build_app(app)
+    else:
+        logs += restored
+    
+    # 4.5 Precompress and fingerprint static output (before the ACLs, which then cover the siblings)
+    if static:
+        try:
+            with metrics.deploy_step("compress"):
+                logs += prepare_static_assets(app)
+        except Exception as e:
+            logs += f"Warning: Failed to precompress static files: {e}\n"
 
-        # 6. Service (Systemd) - this restarts the service
-        logs += create_systemd_service(app)
-        
-        return logs
-    finally:
-        lock.release()
+    # 4.6 Store the fresh build (static output with its siblings) for later deploys of the same key
+    if restored is None:
+        try:
+            with metrics.deploy_step("pack"):
+                logs += store_build(app, budget)
+        except Exception as e:
+            logs += f"Warning: Failed to store build artifact: {e}\n"
+
+    # 5. Ensure permissions for static files (so Caddy can read them)
+    if static:
+        try:
+            logs += ensure_static_acls(app)
+        except Exception as e:
+            logs += f"Warning: Failed to set ACLs for caddy: {e}\n"
+
+    # 6. Service (Systemd) - this restarts the service; static sites are published instead
+    if static:
+        with metrics.deploy_step("publish"):
+            logs += publish_static_site(app, batch)
+    else:
+        with metrics.deploy_step("service"):
+            logs += create_systemd_service(app, batch, settings)
+    
+    return logs
 
 
 def start_service(name: str):
@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The backend modules import each other by their flat names, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Module-level paths are read at import; every test points them at its own scratch directory
+os.environ.setdefault("BMP_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="bmp-tests-"), "paas.db"))
+
+import artifacts
+import database
+import fakes
+import system_ops
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A fresh registry for the test."""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "paas.db"))
+    database.init_db()
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch):
+    """A FakeBackend without delays; system_ops' paths and backend are restored afterwards."""
+    for name in ("HOME_ROOT", "UNIT_DIR", "LOCK_DIR", "JOURNALD_CONF_DIR"):
+        monkeypatch.setattr(system_ops, name, getattr(system_ops, name))
+    monkeypatch.setattr(artifacts, "ARTIFACT_DIR", artifacts.ARTIFACT_DIR)
+    previous = system_ops.get_backend()
+    backend = fakes.FakeBackend(str(tmp_path / "host"), delays={name: 0.0 for name in fakes.DEFAULT_DELAYS})
+    backend.install()
+    yield backend
+    system_ops.set_backend(previous)
+
+
+@pytest.fixture(scope="session")
+def caddy_server():
+    fake = fakes.FakeCaddy()
+    url = fake.start()
+    yield fake, url
+    fake.stop()
+
+
+@pytest.fixture
+def caddy(caddy_server, monkeypatch):
+    fake, url = caddy_server
+    fake.loads, fake.last_config = 0, ""
+    monkeypatch.setattr(system_ops, "CADDY_ADMIN_URL", url)
+    return fake
+
+
+def make_app(**fields) -> database.AppModel:
+    values = dict(
+        name="api",
+        repo_url="https://git.example.com/api.git",
+        domain="api.example.com",
+        port=8001,
+        build_command="npm ci",
+        start_command="node server.js",
+        language_version="node@24",
+    )
+    values.update(fields)
+    return database.AppModel(**values)
+
+
+@pytest.fixture
+def builds(host, monkeypatch):
+    """Names of the apps built, in order. Builds leave output behind, as npm would."""
+    built = []
+    build_app = system_ops.build_app
+
+    def build(app):
+        built.append(app.name)
+        www = system_ops.app_www(app.name)
+        output = system_ops.static_root(app) if system_ops.is_static(app) else os.path.join(www, "node_modules", "a")
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, "index.html" if system_ops.is_static(app) else "index.js"), "w") as f:
+            f.write(f"built from {app.deployed_commit}\n")
+        return build_app(app)
+
+    monkeypatch.setattr(system_ops, "build_app", build)
+    return built
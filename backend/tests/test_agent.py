@@ -0,0 +1,100 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import agent
+import artifacts
+import database
+import nodes
+import system_ops
+from conftest import make_app
+
+TOKEN = "agent-token"
+
+
+@pytest.fixture
+def no_db(tmp_path, monkeypatch):
+    """Like an agent's host: there is no initialised settings table."""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "agent.db"))
+
+
+@pytest.fixture
+def agent_client(no_db, host, monkeypatch):
+    """The agent API on the fake host."""
+    monkeypatch.setattr(agent, "TOKEN", TOKEN)
+    return TestClient(agent.app, headers={"Authorization": f"Bearer {TOKEN}"})
+
+
+def journald_conf(name: str) -> str:
+    with open(system_ops.journald_conf_path(f"bmp-{name}")) as f:
+        return f.read()
+
+
+def agent_deploy(client, app, **payload):
+    response = client.post(f"/agent/apps/{app.name}/deploy", json={"app": app.dict(), **payload})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_unit_uses_the_settings_it_is_given(no_db, host):
+    app = make_app(node="node-1", log_namespace=True)
+    system_ops.create_systemd_service(app, settings=system_ops.DeploySettings(log_namespace_max_mb=64))
+    assert "SystemMaxUse=64M\n" in journald_conf("api")
+
+
+def test_malformed_settings_fall_back_to_the_defaults(db):
+    database.set_setting("log_namespace_max_mb", "64M")
+    assert system_ops.get_deploy_settings().log_namespace_max_mb == system_ops.DEFAULT_LOG_NAMESPACE_MAX_MB
+    database.set_setting("log_namespace_max_mb", "32")
+    assert system_ops.get_deploy_settings().log_namespace_max_mb == 32
+
+
+def test_agent_deploy_uses_the_settings_it_is_sent(agent_client, builds):
+    app = make_app(node="node-1", log_namespace=True)
+    settings = {"log_namespace_max_mb": 64, "artifact_store_mb": 16}
+    result = agent_deploy(agent_client, app, settings=settings)
+    assert result["commit"] and "Stored build artifact" in result["logs"]
+    assert "SystemMaxUse=64M\n" in journald_conf("api")
+
+    # A wiped checkout is restored from the agent's own store
+    result = agent_deploy(agent_client, app, settings=settings, wipe=True)
+    assert "Restored build artifact" in result["logs"]
+    assert builds == ["api"]
+    assert os.path.exists(os.path.join(system_ops.app_www("api"), "node_modules", "a", "index.js"))
+
+
+def test_agent_deploy_without_settings(agent_client, builds):
+    # Controllers that don't send settings get the defaults
+    app = make_app(node="node-1", log_namespace=True)
+    result = agent_deploy(agent_client, app)
+    assert "Stored build artifact" in result["logs"]
+    assert f"SystemMaxUse={system_ops.DEFAULT_LOG_NAMESPACE_MAX_MB}M\n" in journald_conf("api")
+
+    # A disabled store is neither read nor written
+    agent_deploy(agent_client, app, settings={"artifact_store_mb": 0}, wipe=True)
+    assert builds == ["api", "api"]
+
+
+def test_controller_sends_its_settings(db, host, builds, tmp_path, monkeypatch):
+    database.set_setting("log_namespace_max_mb", "256")
+    database.set_setting("artifact_store_mb", "0")
+    database.upsert_node(database.NodeModel(name="node-1", url="http://10.0.0.2:7100", token=TOKEN))
+    controller_db = database.DB_PATH
+    monkeypatch.setattr(agent, "TOKEN", TOKEN)
+    client = TestClient(agent.app, headers={"Authorization": f"Bearer {TOKEN}"})
+
+    def call_agent(node, method, path, json=None, timeout=nodes.AGENT_TIMEOUT):
+        # The request is served without the controller's DB, as on a separate host
+        database.DB_PATH = str(tmp_path / "agent.db")
+        try:
+            return nodes.parse_response(node, client.request(method, path, json=json))
+        finally:
+            database.DB_PATH = controller_db
+
+    monkeypatch.setattr(nodes, "call_agent", call_agent)
+    app = make_app(node="node-1", log_namespace=True)
+    nodes.deploy_remote(app)
+    assert app.deployed_commit
+    assert "SystemMaxUse=256M\n" in journald_conf("api")
+    assert artifacts.list_artifacts() == []
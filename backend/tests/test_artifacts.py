@@ -0,0 +1,76 @@
+import os
+import shutil
+
+import pytest
+from fastapi.testclient import TestClient
+
+import artifacts
+import database
+import main
+import system_ops
+from conftest import make_app
+
+
+@pytest.fixture
+def client(db, host, caddy):
+    return TestClient(main.app)
+
+
+def deploy(client, **fields):
+    response = client.post("/api/deploy", json=make_app(**fields).dict())
+    assert response.status_code == 200, response.text
+    return response.json()["logs"]
+
+
+def redeploy(client, name):
+    response = client.post(f"/api/apps/{name}/redeploy")
+    assert response.status_code == 200, response.text
+    return response.json()["logs"]
+
+
+def test_server_app_is_restored_after_a_wipe(client, builds):
+    assert "Stored build artifact" in deploy(client)
+    assert [artifact["app"] for artifact in artifacts.list_artifacts()] == ["api"]
+
+    # A new host, an import or a repo change: the checkout is gone
+    shutil.rmtree(system_ops.app_www("api"))
+    assert "Restored build artifact" in redeploy(client, "api")
+    assert builds == ["api"]
+    www = system_ops.app_www("api")
+    assert os.path.exists(os.path.join(www, "node_modules", "a", "index.js"))
+    assert os.path.exists(os.path.join(www, ".git"))
+
+
+def test_static_output_is_shared_by_apps_on_the_same_repo(client, builds):
+    site = dict(language_version="node@24:static", build_command="npm run build", start_command="dist")
+    deploy(client, **site)
+    logs = deploy(client, name="docs", domain="docs.example.com", port=8002, **site)
+    assert "Restored build artifact" in logs
+    assert builds == ["api"]
+    assert os.path.exists(os.path.join(system_ops.app_www("docs"), "dist", "index.html"))
+
+
+def test_disabled_store(client, builds):
+    database.set_setting("artifact_store_mb", "0")
+    logs = deploy(client)
+    assert "artifact" not in logs and artifacts.list_artifacts() == []
+    shutil.rmtree(system_ops.app_www("api"))
+    redeploy(client, "api")
+    assert builds == ["api", "api"]
+
+
+def test_malformed_budget_falls_back_to_the_default(db):
+    database.set_setting("artifact_store_mb", "2G")
+    assert artifacts.get_budget() == artifacts.DEFAULT_STORE_MB * 1024 * 1024
+
+
+def test_pack_evicts_down_to_the_budget(host, tmp_path):
+    source = tmp_path / "build"
+    source.mkdir()
+    (source / "index.js").write_text("x" * 4096)
+    artifacts.pack("old", str(source), {}, budget=1024 * 1024)
+    size = os.path.getsize(artifacts.artifact_path("old"))
+    os.utime(artifacts.artifact_path("old"), (1, 1))
+    # Room for one of them: the least recently used goes
+    artifacts.pack("new", str(source), {}, budget=size)
+    assert [artifact["key"] for artifact in artifacts.list_artifacts()] == ["new"]
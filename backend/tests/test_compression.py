@@ -0,0 +1,47 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from compression import CompressionMiddleware, choose_encoding
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", ""),
+    ("gzip, deflate, br, zstd", "zstd"),
+    ("gzip", "gzip"),
+    ("gzip;q=1, zstd;q=0.1", "gzip"),
+    ("zstd;q=0.5, gzip;q=0.5", "zstd"),
+    ("gzip;q=0.8, zstd", "zstd"),
+    ("ZSTD;Q=0.2, GZIP;Q=0.9", "gzip"),
+    ("zstd;q=0, gzip", "gzip"),
+    ("zstd;q=0, gzip;q=0", ""),
+    ("br", ""),
+    ("*", "zstd"),
+    ("gzip;q=0.9, *;q=0.1", "gzip"),
+    ("*;q=0.5, zstd;q=0", "gzip"),
+    ("*;q=0", ""),
+    ("gzip;q=0.5, identity", ""),
+    ("gzip;q=abc, zstd;q=0.1", "zstd"),
+    ("gzip;level=1;q=0.9, zstd;q=0.3", "gzip"),
+])
+def test_choose_encoding(header, expected):
+    assert choose_encoding(header) == expected
+
+
+def test_middleware_uses_the_chosen_encoding():
+    app = FastAPI()
+    app.add_middleware(CompressionMiddleware)
+
+    @app.get("/data")
+    def data():
+        return {"items": ["x" * 100] * 50}
+
+    client = TestClient(app)
+    response = client.get("/data", headers={"Accept-Encoding": "gzip;q=1, zstd;q=0.1"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.json()["items"][0] == "x" * 100
+
+    # The test client decodes both encodings
+    response = client.get("/data", headers={"Accept-Encoding": "zstd"})
+    assert response.headers["content-encoding"] == "zstd"
+    assert response.json()["items"][0] == "x" * 100
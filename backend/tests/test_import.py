@@ -0,0 +1,65 @@
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+from conftest import make_app
+
+
+@pytest.fixture
+def client(db, host, caddy):
+    return TestClient(main.app)
+
+
+def test_export_import_round_trip(client):
+    database.upsert_app(make_app(
+        name="api", port=8001, placement_class="dedicated", allowed_cpus="6-7", allowed_memory_nodes="1",
+        memory_max="512M", deploy_token="token-api",
+    ))
+    database.upsert_app(make_app(name="site", port=8002, domain="site.example.com", language_version="node@24:static"))
+    exported = client.get("/api/export").json()
+
+    # Edited elsewhere and imported back, plus one new app
+    for app in exported["apps"]:
+        app["memory_max"] = "1G"
+    exported["apps"].append({**exported["apps"][1], "name": "docs", "domain": "docs.example.com", "deploy_token": None})
+    response = client.post("/api/import", json=exported)
+    assert response.status_code == 200, response.text
+
+    api = database.get_app_by_name("api")
+    assert api.memory_max == "1G"
+    # Host-specific fields are not carried by the import; the existing app keeps them
+    assert (api.port, api.allowed_cpus, api.allowed_memory_nodes) == (8001, "6-7", "1")
+    assert api.deploy_token == "token-api"
+    docs = database.get_app_by_name("docs")
+    assert docs.port not in (None, 8001, 8002)
+    assert docs.deploy_token and docs.allowed_cpus is None
+
+
+def test_ndjson_round_trip(client):
+    database.upsert_app(make_app(name="api", port=8001, placement_class="shared", allowed_cpus="0-3", allowed_memory_nodes="0"))
+    body = client.get("/api/export?format=ndjson").content
+    lines = [orjson.loads(line) for line in body.splitlines()]
+    assert lines[0]["kind"] == "header" and [line["name"] for line in lines[1:]] == ["api"]
+
+    response = client.post("/api/import/ndjson", content=body)
+    assert response.status_code == 200, response.text
+    api = database.get_app_by_name("api")
+    assert (api.allowed_cpus, api.allowed_memory_nodes) == ("0-3", "0")
+
+
+def test_invalid_import_changes_nothing(client):
+    database.upsert_app(make_app(name="api", port=8001))
+    apps = [
+        {**make_app(name="api").dict(), "memory_max": "2G"},
+        {**make_app(name="bad", domain="bad.example.com").dict(), "memory_max": "1G;reboot"},
+        {**make_app(name="dup", domain="api.example.com").dict()},
+    ]
+    response = client.post("/api/import", json={"version": main.EXPORT_VERSION, "apps": apps})
+    assert response.status_code == 400
+    errors = response.json()["detail"]["errors"]
+    assert any("memory_max" in error for error in errors)
+    assert any("api.example.com" in error for error in errors)
+    assert [app.name for app in database.get_apps()] == ["api"]
+    assert database.get_app_by_name("api").memory_max is None
@@ -0,0 +1,67 @@
+import database
+import placement
+import system_ops
+from conftest import make_app
+
+TOPOLOGY = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+
+
+def test_cpulist_round_trip():
+    assert placement.parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert placement.format_cpulist([11, 0, 1, 2, 3, 8, 10]) == "0-3,8,10-11"
+    assert placement.format_cpulist([]) == ""
+
+
+def test_plan_by_class():
+    apps = [
+        make_app(name="db", placement_class="dedicated"),
+        make_app(name="web", placement_class="shared"),
+        make_app(name="batch", placement_class="best-effort"),
+        make_app(name="misc"),
+    ]
+    plan = placement.compute_plan(apps, {"db": 1.0, "web": 0.5, "batch": 0.1}, TOPOLOGY)
+    # 1.0 cores used -> 2 exclusive cores, from the top of a single node
+    assert plan["db"] == ("2-3", "0")
+    # The node with the least load per shared core
+    assert plan["web"] == ("4-7", "1")
+    # The tail of the other node's shared cores
+    assert plan["batch"] == ("1", "0")
+    assert "misc" not in plan
+
+
+def test_dedicated_apps_never_starve_the_shared_pool():
+    apps = [make_app(name="db", placement_class="dedicated")]
+    plan = placement.compute_plan(apps, {"db": 2.0}, {0: [0, 1]})
+    assert plan["db"] == ("0-1", "0")
+
+
+def test_reserved_cores_are_kept():
+    apps = [
+        make_app(name="db", placement_class="dedicated"),
+        make_app(name="new", placement_class="dedicated"),
+    ]
+    plan = placement.compute_plan(apps, {"new": 3.0}, TOPOLOGY, reserved={"db": [6, 7]})
+    assert plan["db"] == ("6-7", "1")
+    assert plan["new"] == ("0-3", "0")
+
+
+def test_rebalance_persists_and_applies_without_a_shell(db, host, monkeypatch):
+    monkeypatch.setattr(placement, "get_topology", lambda: TOPOLOGY)
+    database.upsert_app(make_app(name="db", port=8001, placement_class="dedicated"))
+    database.upsert_app(make_app(name="web", port=8002, placement_class="shared"))
+    database.upsert_app(make_app(name="remote", port=8003, placement_class="shared", node="node-1"))
+
+    report = placement.rebalance()
+    assert sorted(report["changed"]) == ["db", "web"]
+    stored = {app.name: (app.allowed_cpus, app.allowed_memory_nodes) for app in database.get_apps()}
+    assert stored == {"db": ("3", "0"), "web": ("4-7", "1"), "remote": (None, None)}
+
+    set_property = [args for args in host.history if args[:2] == ["systemctl", "set-property"]]
+    assert ["systemctl", "set-property", "--runtime", "db.service", "AllowedCPUs=3", "AllowedMemoryNodes=0"] in set_property
+    with open(system_ops.unit_path("web")) as f:
+        assert "AllowedCPUs=4-7\n" in f.read()
+
+    # Nothing moved: nothing is applied
+    host.history.clear()
+    assert placement.rebalance()["changed"] == []
+    assert not any(args[:2] == ["systemctl", "set-property"] for args in host.history)
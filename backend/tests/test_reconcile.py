@@ -0,0 +1,65 @@
+import os
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import database
+import main
+import reconcile
+import system_ops
+from conftest import make_app
+
+
+def checkout(name: str):
+    os.makedirs(system_ops.app_www(name), exist_ok=True)
+
+
+def test_unit_drift(db, host):
+    deployed = make_app(name="api", deployed_commit="abc123")
+    edited = make_app(name="web", port=8002, deployed_commit="abc123")
+    building = make_app(name="new", port=8003)
+    for app in (deployed, edited, building):
+        checkout(app.name)
+    system_ops.write_systemd_service(edited)
+    with open(system_ops.unit_path("web"), "a") as f:
+        f.write("# edited by hand\n")
+
+    drift = reconcile.check_units([deployed, edited, building], {})
+    assert drift == [{"app": "api", "kind": "unit_missing"}, {"app": "web", "kind": "unit_changed"}]
+
+
+def test_locked_apps_are_left_alone(db, host):
+    app = make_app(deployed_commit="abc123")
+    checkout(app.name)
+    lock = system_ops.LockManager(app.name)
+    lock.acquire()
+    try:
+        # Even when the pass read its statuses before the deploy started
+        assert reconcile.check_units([app], {"api": "running"}) == []
+    finally:
+        lock.release()
+    assert reconcile.check_units([app], {}) == [{"app": "api", "kind": "unit_missing"}]
+
+
+def test_first_deploy_is_not_repaired_midway(db, host, caddy, monkeypatch):
+    seen = []
+    build_app = system_ops.build_app
+
+    def build(app):
+        # The checkout exists and there is no unit yet: what the reconciler used to "repair"
+        seen.append(reconcile.check_units(database.get_apps(), {}))
+        try:
+            main.deploy(main.DeployRequest(**make_app().dict()))
+        except HTTPException as e:
+            seen.append(e.status_code)
+        return build_app(app)
+
+    monkeypatch.setattr(system_ops, "build_app", build)
+    response = TestClient(main.app).post("/api/deploy", json=make_app().dict())
+    assert response.status_code == 200, response.text
+    assert seen[0] == []
+    # A second deploy of the same app is refused while the first holds the lock
+    assert seen[1] == 409
+    assert ["systemctl", "enable", "--now", "api.service"] in host.history
+    assert not any(args[:2] == ["systemctl", "restart"] for args in host.history)
+    assert not system_ops.LockManager("api").is_locked()
@@ -0,0 +1,95 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import database
+import main
+import system_ops
+from conftest import make_app
+
+
+@pytest.mark.parametrize("field, value", [
+    ("memory_max", "512M"),
+    ("memory_max", "1.5G"),
+    ("memory_high", "80%"),
+    ("memory_max", "infinity"),
+    ("cpu_quota", "150%"),
+    ("cpu_weight", 100),
+    ("io_weight", "10000"),
+    ("tasks_max", "256"),
+    ("tasks_max", "infinity"),
+])
+def test_valid_resource_values(field, value):
+    system_ops.validate_resource_value(field, value)
+
+
+@pytest.mark.parametrize("field, value", [
+    ("memory_max", "1G;touch$(id)"),
+    ("memory_max", "1G AllowedCPUs=0"),
+    ("memory_high", "lots"),
+    ("cpu_quota", "1.5"),
+    ("cpu_quota", "50%\nUser=root"),
+    ("cpu_weight", 0),
+    ("io_weight", "10001"),
+    ("tasks_max", "-1"),
+])
+def test_invalid_resource_values(field, value):
+    with pytest.raises(ValueError):
+        system_ops.validate_resource_value(field, value)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1.500000s", "150%"),
+    ("500ms", "50%"),
+    ("2s", "200%"),
+    ("infinity", ""),
+])
+def test_cpu_quota_percent(value, expected):
+    assert system_ops.cpu_quota_percent(value) == expected
+
+
+def test_limits_are_applied_without_a_shell(host):
+    app = make_app(memory_max="512M", cpu_quota="50%")
+    system_ops.apply_resource_limits(app)
+    set_property = [args for args in host.history if args[:2] == ["systemctl", "set-property"]]
+    assert set_property == [[
+        "systemctl", "set-property", "--runtime", "api.service",
+        "MemoryMax=512M", "MemoryHigh=infinity", "CPUQuota=50%", "CPUWeight=", "IOWeight=", "TasksMax=infinity",
+    ]]
+    with open(system_ops.unit_path("api")) as f:
+        unit = f.read()
+    assert "MemoryMax=512M\n" in unit and "CPUQuota=50%\n" in unit
+
+
+def test_invalid_limits_are_rejected_before_anything_runs(db, host):
+    database.upsert_app(make_app())
+    client = TestClient(main.app)
+    response = client.put("/api/apps/api/resources", json={"memory_max": "1G;touch /tmp/pwned"})
+    assert response.status_code == 400
+    assert host.history == []
+    assert database.get_app_by_name("api").memory_max is None
+
+
+def test_limits_are_persisted_only_after_systemd_accepted_them(db, host, monkeypatch):
+    database.upsert_app(make_app(memory_max="256M"))
+    client = TestClient(main.app)
+
+    applied = []
+    systemctl = host.systemctl
+
+    def refuse_new_limit(args):
+        if args[0] == "set-property":
+            applied.append(next(arg for arg in args if arg.startswith("MemoryMax=")))
+            if "MemoryMax=1G" in args:
+                return 1, "Failed to set unit properties\n", 0.0
+        return systemctl(args)
+
+    monkeypatch.setattr(host, "systemctl", refuse_new_limit)
+    response = client.put("/api/apps/api/resources", json={"memory_max": "1G"})
+    assert response.status_code == 500
+    # The recorded limit stays, and is put back on the unit
+    assert database.get_app_by_name("api").memory_max == "256M"
+    assert applied == ["MemoryMax=1G", "MemoryMax=256M"]
+
+    response = client.put("/api/apps/api/resources", json={"memory_max": "512M"})
+    assert response.status_code == 200
+    assert database.get_app_by_name("api").memory_max == "512M"
@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+from collections import OrderedDict
+
+import orjson
+import pytest
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+
+import database
+import deploy_queue
+import main
+import webhooks
+from conftest import make_app
+
+SECRET = "s3cret"
+
+
+def github_push(ref="refs/heads/main", after="b" * 40, commits=None):
+    return orjson.dumps({
+        "ref": ref,
+        "after": after,
+        "repository": {"default_branch": "main"},
+        "commits": commits if commits is not None else [{"added": [], "modified": ["api/server.js"], "removed": []}],
+    })
+
+
+def github_headers(body: bytes, secret=SECRET, event="push"):
+    signature = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return Headers({"X-GitHub-Event": event, "X-Hub-Signature-256": signature, "Content-Type": "application/json"})
+
+
+def test_signature():
+    app = make_app(webhook_secret=SECRET)
+    body = github_push()
+    assert webhooks.verify_signature(app, github_headers(body), body)
+    assert not webhooks.verify_signature(app, github_headers(body, secret="wrong"), body)
+    assert not webhooks.verify_signature(app, github_headers(body), body + b" ")
+    assert webhooks.verify_signature(app, {"x-gitlab-token": SECRET}, body)
+    assert not webhooks.verify_signature(app, {"x-gitlab-token": "wrong"}, body)
+    assert not webhooks.verify_signature(app, {}, body)
+    # Without a secret the token in the URL is enough
+    assert webhooks.verify_signature(make_app(), {}, body)
+
+
+def test_parse_github_and_gitlab():
+    push = webhooks.parse_push({"x-github-event": "push"}, github_push())
+    assert (push.provider, push.ref, push.default_branch, push.paths) == ("github", "refs/heads/main", "main", ["api/server.js"])
+
+    body = orjson.dumps({
+        "ref": "refs/heads/trunk", "after": "c" * 40, "project": {"default_branch": "trunk"},
+        "total_commits_count": 30, "commits": [{"modified": ["a.js"]}],
+    })
+    push = webhooks.parse_push({"x-gitlab-event": "Push Hook"}, body)
+    assert (push.provider, push.default_branch) == ("gitlab", "trunk")
+    # Truncated commit list: the changed paths are unknown
+    assert push.paths is None
+
+    with pytest.raises(ValueError):
+        webhooks.parse_push({"x-github-event": "issues"}, b"{}")
+    assert webhooks.parse_push({}, b"") is None
+
+
+@pytest.mark.parametrize("ref, after, watch_paths, paths, ignored", [
+    ("refs/heads/main", "b" * 40, None, ["README.md"], None),
+    ("refs/heads/feature", "b" * 40, None, ["README.md"], "push to refs/heads/feature"),
+    ("refs/heads/main", "0" * 40, None, [], "deleted"),
+    ("refs/heads/main", "a" * 40, None, ["README.md"], "already deployed"),
+    ("refs/heads/main", "b" * 40, "api\nlib/", ["api/server.js"], None),
+    ("refs/heads/main", "b" * 40, "api\nlib/", ["lib"], None),
+    ("refs/heads/main", "b" * 40, "api", ["apis/x.js", "docs/api"], "no changes under api"),
+    # Unknown paths always deploy
+    ("refs/heads/main", "b" * 40, "api", None, None),
+])
+def test_ignore_reason(ref, after, watch_paths, paths, ignored):
+    app = make_app(deployed_commit="a" * 40, watch_paths=watch_paths)
+    after = None if set(after) == {"0"} else after
+    reason = webhooks.ignore_reason(app, webhooks.Push("github", ref, "main", after, paths))
+    if ignored is None:
+        assert reason is None
+    else:
+        assert ignored in reason
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    monkeypatch.setattr(deploy_queue, "PENDING", OrderedDict())
+    database.upsert_app(make_app(deploy_token="token-api", webhook_secret=SECRET, watch_paths="api"))
+    return TestClient(main.app)
+
+
+def test_hook_endpoint(client):
+    body = github_push()
+    assert client.post("/api/hooks/nope", content=body, headers=github_headers(body)).status_code == 404
+    assert client.post("/api/hooks/token-api", content=body, headers=github_headers(body, secret="x")).status_code == 401
+    assert not deploy_queue.PENDING
+
+    ignored = github_push(commits=[{"modified": ["docs/index.md"]}])
+    response = client.post("/api/hooks/token-api", content=ignored, headers=github_headers(ignored))
+    assert response.status_code == 200 and response.json()["message"] == "Ignored"
+    assert not deploy_queue.PENDING
+
+    response = client.post("/api/hooks/token-api", content=body, headers=github_headers(body))
+    assert response.status_code == 202 and response.json()["queued"] is True
+    response = client.post("/api/hooks/token-api", content=body, headers=github_headers(body))
+    assert response.json()["queued"] is False
+    assert list(deploy_queue.PENDING) == ["api"] and deploy_queue.PENDING["api"]["coalesced"] == 1
@@ -0,0 +1,269 @@
+import asyncio
+import math
+import os
+import time
+from typing import Dict, List, Optional
+import orjson
+import database
+
+ACCESS_LOG_DIR = os.getenv("BMP_ACCESS_LOG_DIR", "/var/log/caddy")
+
+POLL_INTERVAL = 1.0  # seconds between log reads
+READ_CHUNK = 1024 * 1024  # max bytes read per app per poll
+SECOND_WINDOW = 60  # per-second request counts kept
+MINUTE_WINDOW = 15  # per-minute aggregates kept
+
+# Latency sketch: log-spaced buckets with ~2.5% relative error from 0.1ms to ~10min
+SKETCH_GAMMA = 1.05
+SKETCH_MIN_MS = 0.1
+SKETCH_BUCKETS = int(math.log(600_000 / SKETCH_MIN_MS, SKETCH_GAMMA)) + 2
+
+
+def access_log_path(name: str) -> str:
+    return os.path.join(ACCESS_LOG_DIR, f"bmp-{name}.access.log")
+
+
+class LatencySketch:
+    """
+    Fixed-memory quantile sketch: counts per logarithmic bucket, so every quantile is
+    reported within ~2.5% of the true value no matter how many samples were added.
+    """
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.total = 0
+
+    def add(self, ms: float):
+        if ms <= SKETCH_MIN_MS:
+            index = 0
+        else:
+            index = min(int(math.log(ms / SKETCH_MIN_MS, SKETCH_GAMMA)) + 1, SKETCH_BUCKETS - 1)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.total += 1
+
+    def merge(self, other: "LatencySketch"):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.total:
+            return None
+        rank = q * (self.total - 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                if index == 0:
+                    return SKETCH_MIN_MS
+                # Midpoint of the bucket [gamma^(i-1), gamma^i) * min
+                low = SKETCH_MIN_MS * SKETCH_GAMMA ** (index - 1)
+                return round(low * (1 + SKETCH_GAMMA) / 2, 2)
+        return None
+
+
+class MinuteBucket:
+    __slots__ = ("minute", "count", "status", "latency")
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.count = 0
+        self.status = [0, 0, 0, 0, 0]  # 1xx..5xx
+        self.latency = LatencySketch()
+
+
+class AppTraffic:
+    """Rolling per-app aggregates held in fixed-size rings."""
+
+    def __init__(self):
+        self.seconds = [(0, 0)] * SECOND_WINDOW  # (epoch second, count)
+        self.minutes: List[Optional[MinuteBucket]] = [None] * MINUTE_WINDOW
+
+    def record(self, ts: float, status: int, latency_ms: float):
+        second = int(ts)
+        slot = second % SECOND_WINDOW
+        sec, count = self.seconds[slot]
+        self.seconds[slot] = (second, count + 1 if sec == second else 1)
+
+        minute = second // 60
+        slot = minute % MINUTE_WINDOW
+        bucket = self.minutes[slot]
+        if bucket is None or bucket.minute != minute:
+            if bucket is not None and bucket.minute > minute:
+                return  # Older than the window
+            bucket = self.minutes[slot] = MinuteBucket(minute)
+        bucket.count += 1
+        if 100 <= status < 600:
+            bucket.status[status // 100 - 1] += 1
+        bucket.latency.add(latency_ms)
+
+    def summary(self, now: Optional[float] = None) -> dict:
+        now = now or time.time()
+        current = int(now)
+        # Last full 60 seconds (the current second is still filling)
+        recent = sum(count for sec, count in self.seconds if current - SECOND_WINDOW <= sec < current)
+
+        def window(minutes: int) -> dict:
+            first = current // 60 - minutes + 1
+            count = 0
+            status = [0, 0, 0, 0, 0]
+            latency = LatencySketch()
+            for bucket in self.minutes:
+                if bucket is not None and bucket.minute >= first:
+                    count += bucket.count
+                    status = [a + b for a, b in zip(status, bucket.status)]
+                    latency.merge(bucket.latency)
+            return {
+                "requests": count,
+                "status": {f"{i + 1}xx": n for i, n in enumerate(status)},
+                "error_rate": round(status[4] / count, 4) if count else 0.0,
+                "latency_ms": {
+                    "p50": latency.quantile(0.50),
+                    "p95": latency.quantile(0.95),
+                    "p99": latency.quantile(0.99),
+                },
+            }
+
+        return {
+            "rps": round(recent / SECOND_WINDOW, 2),
+            "last_5m": window(5),
+            "last_15m": window(MINUTE_WINDOW),
+        }
+
+
+class LogTail:
+    """
+    Reads a log file incrementally by byte offset. On rotation (the path now points at a new
+    inode) the old handle is drained before switching; on truncation it restarts at 0.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.handle = None
+        self.inode = None
+        self.partial = b""
+        self._pending = False
+
+    def _open(self, from_end: bool):
+        try:
+            handle = open(self.path, "rb")
+        except FileNotFoundError:
+            return
+        self.handle = handle
+        self.inode = os.fstat(handle.fileno()).st_ino
+        if from_end:
+            # Only traffic from now on: history would skew the rate windows
+            handle.seek(0, os.SEEK_END)
+        self.partial = b""
+
+    def read_lines(self) -> List[bytes]:
+        if self.handle is None:
+            self._open(from_end=True)
+            if self.handle is None:
+                return []
+
+        lines = self._drain()
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return lines
+
+        if st.st_ino != self.inode:
+            # Rotated: read the rest of the old file (beyond one chunk, too) before switching
+            while self._pending:
+                lines += self._drain()
+            # Nothing is appended to the old file anymore, so its trailing fragment is a whole line
+            if self.partial:
+                lines.append(self.partial)
+                self.partial = b""
+            self.handle.close()
+            self.handle = None
+            self._open(from_end=False)
+            if self.handle is not None:
+                lines += self._drain()
+        elif st.st_size < self.handle.tell():
+            # Truncated in place
+            self.handle.seek(0)
+            self.partial = b""
+            lines += self._drain()
+        return lines
+
+    def _drain(self) -> List[bytes]:
+        data = self.handle.read(READ_CHUNK)
+        # A full chunk means there may be more to read
+        self._pending = len(data) == READ_CHUNK
+        if not data:
+            return []
+        data = self.partial + data
+        *lines, self.partial = data.split(b"\n")
+        return lines
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+
+TRAFFIC: Dict[str, AppTraffic] = {}
+TAILS: Dict[str, LogTail] = {}
+
+
+def parse_entry(line: bytes) -> Optional[tuple]:
+    """
+    Extracts (ts, status, latency_ms) from a Caddy JSON access log line.
+    Upstream latency is preferred (reverse-proxied apps), total duration otherwise.
+    """
+    try:
+        entry = orjson.loads(line)
+        ts = float(entry["ts"])
+        status = int(entry.get("status", 0))
+        upstream = entry.get("upstream_latency_ms")
+        if upstream not in (None, ""):
+            latency_ms = float(upstream)
+        else:
+            latency_ms = float(entry.get("duration", 0)) * 1000
+        return ts, status, latency_ms
+    except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def poll_once(apps: List[str]):
+    for name in apps:
+        tail = TAILS.get(name)
+        if tail is None:
+            tail = TAILS[name] = LogTail(access_log_path(name))
+            TRAFFIC.setdefault(name, AppTraffic())
+        stats = TRAFFIC[name]
+        for line in tail.read_lines():
+            parsed = parse_entry(line)
+            if parsed:
+                stats.record(*parsed)
+
+    # Forget deleted apps
+    for name in set(TAILS) - set(apps):
+        TAILS.pop(name).close()
+        TRAFFIC.pop(name, None)
+
+
+def get_summary(name: str) -> dict:
+    stats = TRAFFIC.get(name)
+    return (stats or AppTraffic()).summary()
+
+
+async def run_tailer():
+    """
+    Background task: follows every app's access log and keeps the rolling aggregates current.
+    """
+    try:
+        while True:
+            try:
+                apps = [app.name for app in await asyncio.to_thread(database.get_apps) if app.domain]
+                await asyncio.to_thread(poll_once, apps)
+            except Exception as e:
+                print(f"Warning: Access log processing failed: {e}")
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        for tail in TAILS.values():
+            tail.close()
@@ -0,0 +1,116 @@
+import hashlib
+import hmac
+from typing import List, Optional
+import orjson
+from database import AppModel
+
+# GitHub and GitLab cap the commit list of a push payload; beyond that the changed paths are unknown
+MAX_PAYLOAD_COMMITS = 20
+
+
+class Push:
+    __slots__ = ("provider", "ref", "default_branch", "after", "paths")
+
+    def __init__(self, provider: str, ref: Optional[str], default_branch: Optional[str], after: Optional[str],
+                 paths: Optional[List[str]]):
+        self.provider = provider
+        self.ref = ref
+        self.default_branch = default_branch
+        self.after = after
+        self.paths = paths  # None = unknown (truncated or missing commit list)
+
+
+def detect_provider(headers) -> Optional[str]:
+    if "x-github-event" in headers:
+        return "github"
+    if "x-gitlab-event" in headers:
+        return "gitlab"
+    return None
+
+
+def verify_signature(app: AppModel, headers, body: bytes) -> bool:
+    """
+    Without a webhook secret any request with the token is accepted (curl, CI jobs).
+    With one, GitHub deliveries must carry a valid X-Hub-Signature-256 HMAC of the body
+    and GitLab deliveries the secret in X-Gitlab-Token.
+    """
+    if not app.webhook_secret:
+        return True
+    secret = app.webhook_secret.encode()
+    signature = headers.get("x-hub-signature-256")
+    if signature:
+        expected = "sha256=" + hmac.new(secret, body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    token = headers.get("x-gitlab-token")
+    if token:
+        return hmac.compare_digest(token.encode(), secret)
+    return False
+
+
+def changed_paths(commits: list, total: Optional[int]) -> Optional[List[str]]:
+    if not isinstance(commits, list) or len(commits) >= MAX_PAYLOAD_COMMITS:
+        return None
+    if total is not None and total > len(commits):
+        return None
+    paths = set()
+    for commit in commits:
+        for key in ("added", "modified", "removed"):
+            paths.update(commit.get(key) or [])
+    return sorted(paths)
+
+
+def parse_push(headers, body: bytes) -> Optional[Push]:
+    """
+    Parses a GitHub or GitLab push payload. Returns None for bodies that aren't one
+    (e.g. an empty POST from a script), which are treated as a plain redeploy request.
+    Raises ValueError for events other than pushes.
+    """
+    provider = detect_provider(headers)
+    if provider is None or not body:
+        return None
+    event = headers.get("x-github-event") or headers.get("x-gitlab-event")
+    if provider == "github" and event != "push" or provider == "gitlab" and event != "Push Hook":
+        raise ValueError(f"Ignoring {provider} event {event}")
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise ValueError("Push payload is not JSON (set the webhook content type to application/json)")
+
+    if provider == "github":
+        default_branch = (payload.get("repository") or {}).get("default_branch")
+        total = None
+    else:
+        default_branch = (payload.get("project") or {}).get("default_branch")
+        total = payload.get("total_commits_count")
+    after = payload.get("after")
+    # A deleted branch has no commit to deploy
+    if after and set(after) == {"0"}:
+        after = None
+    return Push(provider, payload.get("ref"), default_branch, after, changed_paths(payload.get("commits"), total))
+
+
+def parse_watch_paths(text: Optional[str]) -> List[str]:
+    """Path prefixes (one per line or space-separated), normalized to repo-relative form."""
+    return [prefix.strip("/") for prefix in (text or "").split() if prefix.strip("/")]
+
+
+def touches_watch_paths(prefixes: List[str], paths: List[str]) -> bool:
+    return any(path == prefix or path.startswith(prefix + "/") for path in paths for prefix in prefixes)
+
+
+def ignore_reason(app: AppModel, push: Push) -> Optional[str]:
+    """
+    Why the push should not redeploy the app, or None if it should. Only the branch the
+    checkout follows (the repo's default branch) deploys, and with watch paths set,
+    only pushes touching at least one file under them.
+    """
+    if push.after is None:
+        return "push deleted the branch"
+    if push.default_branch and push.ref != f"refs/heads/{push.default_branch}":
+        return f"push to {push.ref}, deploys follow {push.default_branch}"
+    if push.after == app.deployed_commit:
+        return f"commit {push.after[:12]} is already deployed"
+    prefixes = parse_watch_paths(app.watch_paths)
+    if prefixes and push.paths is not None and not touches_watch_paths(prefixes, push.paths):
+        return f"no changes under {', '.join(prefixes)}"
+    return None
@@ -13,7 +13,7 @@ import {
   Webhook,
 } from "lucide-react";
 import { useEffect, useRef, useState } from "react";
-import type { App } from "../types";
+import type { App, AppTraffic } from "../types";
 import { Button } from "./ui/Button";
 import { Card, CardContent, CardHeader, CardTitle } from "./ui/Card";
 
@@ -58,6 +58,21 @@ export function AppDetails({ app: initialApp, onDelete, onEdit }: AppDetailsProp
 
   const logs = logsData.logs;
 
+  // 3. Traffic (from Caddy access logs)
+  const { data: traffic } = useQuery<AppTraffic>({
+    queryKey: ["app-traffic", initialApp.name],
+    queryFn: async () => {
+      const res = await fetch(`/api/apps/${initialApp.name}/traffic`);
+      if (!res.ok) throw new Error("Failed to fetch traffic");
+      return res.json();
+    },
+    refetchInterval: 5000,
+    enabled: !!initialApp.domain,
+  });
+
+  const formatMs = (value: number | null | undefined) =>
+    value === null || value === undefined ? "—" : `${value < 10 ? value.toFixed(1) : Math.round(value)}ms`;
+
   // Auto-scroll to bottom of logs
   useEffect(() => {
     if (logsContainerRef.current) {
@@ -123,6 +138,16 @@ export function AppDetails({ app: initialApp, onDelete, onEdit }: AppDetailsProp
               {app.status}
             </span>
           </div>
+          {isRunning && app.health && (
+            <div
+              className={`p-2.5 bg-iron-900 border border-iron-800 rounded-full text-[10px] font-mono font-bold uppercase tracking-widest ${
+                app.health === "healthy" ? "text-green" : app.health === "degraded" ? "text-forge-500" : "text-red"
+              }`}
+              title={`Health check: ${app.health_check_path}`}
+            >
+              {app.health}
+            </div>
+          )}
           <a
             href={`http://${app.domain}`}
             target="_blank"
@@ -250,6 +275,16 @@ export function AppDetails({ app: initialApp, onDelete, onEdit }: AppDetailsProp
                   {app.port}
                 </div>
               </div>
+              {app.node && (
+                <div>
+                  <div className="text-xs text-slate-500 uppercase font-bold tracking-wider mb-2">
+                    Node
+                  </div>
+                  <div className="text-sm text-slate-300 font-mono bg-iron-950 p-2.5 rounded border border-iron-800 inline-block">
+                    {app.node}
+                  </div>
+                </div>
+              )}
             </CardContent>
           </Card>
 
@@ -311,6 +346,66 @@ export function AppDetails({ app: initialApp, onDelete, onEdit }: AppDetailsProp
               </div>
             </CardContent>
           </Card>
+
+          {app.domain && traffic && (
+            <Card>
+              <CardHeader className="p-6 py-4">
+                <CardTitle className="text-sm flex items-center gap-2 uppercase tracking-widest text-slate-400">
+                  <div className="w-1.5 h-4 bg-forge-500 rounded-sm"></div>
+                  TRAFFIC
+                </CardTitle>
+              </CardHeader>
+              <CardContent className="p-6 pt-4 space-y-5">
+                <div className="grid grid-cols-2 gap-4">
+                  <div>
+                    <div className="text-xs text-slate-500 uppercase font-bold tracking-wider mb-2">
+                      Req/s (1m)
+                    </div>
+                    <div className="text-lg text-slate-300 font-mono">{traffic.rps}</div>
+                  </div>
+                  <div>
+                    <div className="text-xs text-slate-500 uppercase font-bold tracking-wider mb-2">
+                      5xx (5m)
+                    </div>
+                    <div className={`text-lg font-mono ${traffic.last_5m.error_rate > 0 ? "text-red" : "text-green"}`}>
+                      {(traffic.last_5m.error_rate * 100).toFixed(1)}%
+                    </div>
+                  </div>
+                </div>
+                <div>
+                  <div className="text-xs text-slate-500 uppercase font-bold tracking-wider mb-2">
+                    Latency (5m)
+                  </div>
+                  <div className="flex gap-2 text-xs font-mono">
+                    {(["p50", "p95", "p99"] as const).map((q) => (
+                      <span key={q} className="bg-iron-950 p-2.5 rounded border border-iron-800 text-slate-300">
+                        <span className="text-slate-500">{q}</span> {formatMs(traffic.last_5m.latency_ms[q])}
+                      </span>
+                    ))}
+                  </div>
+                </div>
+                <div>
+                  <div className="text-xs text-slate-500 uppercase font-bold tracking-wider mb-2">
+                    Status (15m · {traffic.last_15m.requests} req)
+                  </div>
+                  <div className="flex flex-wrap gap-2 text-xs font-mono">
+                    {Object.entries(traffic.last_15m.status)
+                      .filter(([, count]) => count > 0)
+                      .map(([cls, count]) => (
+                        <span
+                          key={cls}
+                          className={`bg-iron-950 p-2.5 rounded border border-iron-800 ${
+                            cls === "5xx" ? "text-red" : cls === "4xx" ? "text-forge-400" : "text-slate-300"
+                          }`}
+                        >
+                          {cls} {count}
+                        </span>
+                      ))}
+                  </div>
+                </div>
+              </CardContent>
+            </Card>
+          )}
         </div>
 
         {/* Logs Column */}
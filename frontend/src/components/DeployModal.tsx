@@ -1,9 +1,14 @@
-import { useMutation } from "@tanstack/react-query";
+import { useMutation, useQuery } from "@tanstack/react-query";
 import {
+  Activity,
   Box,
   ChevronDown,
   ChevronUp,
   Edit2,
+  FileText,
+  FolderTree,
+  Gauge,
+  KeyRound,
   Layers,
   Play,
   Plus,
@@ -13,7 +18,7 @@ import {
 import { useState } from "react";
 import languagesData from "../languages.json";
 import presetsData from "../presets.json";
-import type { App } from "../types";
+import type { App, ProxyProfile } from "../types";
 import { Button } from "./ui/Button";
 import { Input } from "./ui/Input";
 import { Modal } from "./ui/Modal";
@@ -42,7 +47,20 @@ interface DeployModalProps {
 
 type DeployData = Pick<
   App,
-  "name" | "repo_url" | "domain" | "language_version" | "build_command" | "start_command"
+  | "name"
+  | "repo_url"
+  | "domain"
+  | "language_version"
+  | "build_command"
+  | "start_command"
+  | "health_check_path"
+  | "health_auto_restart"
+  | "cache_rules"
+  | "proxy_profile"
+  | "webhook_secret"
+  | "watch_paths"
+  | "log_rate_limit_burst"
+  | "log_namespace"
 >;
 
 export function DeployModal({
@@ -72,16 +90,43 @@ export function DeployModal({
         language_version: initialData.language_version,
         build_command: initialData.build_command,
         start_command: initialData.start_command,
+        health_check_path: initialData.health_check_path ?? "",
+        health_auto_restart: initialData.health_auto_restart ?? false,
+        cache_rules: initialData.cache_rules ?? "",
+        proxy_profile: initialData.proxy_profile ?? "",
+        webhook_secret: initialData.webhook_secret ?? "",
+        watch_paths: initialData.watch_paths ?? "",
+        log_rate_limit_burst: initialData.log_rate_limit_burst ?? null,
+        log_namespace: initialData.log_namespace ?? false,
       };
     }
     return {
       name: "",
       repo_url: "",
       domain: "",
+      health_check_path: "",
+      health_auto_restart: false,
+      cache_rules: "",
+      proxy_profile: "",
+      webhook_secret: "",
+      watch_paths: "",
+      log_rate_limit_burst: null,
+      log_namespace: false,
       ...defaultPreset,
     };
   });
 
+  const { data: proxyProfiles } = useQuery<Record<string, ProxyProfile>>({
+    queryKey: ["proxyProfiles"],
+    queryFn: async () => {
+      const res = await fetch("/api/proxy-profiles");
+      if (!res.ok) throw new Error("Failed to fetch proxy profiles");
+      return (await res.json()).profiles;
+    },
+    enabled: isOpen,
+    staleTime: Infinity,
+  });
+
   const deployMutation = useMutation({
     mutationFn: async (data: DeployData) => {
       const res = await fetch("/api/deploy", {
@@ -368,6 +413,151 @@ export function DeployModal({
           onChange={(e) => setFormData({ ...formData, build_command: e.target.value })}
         />
 
+        {!formData.language_version.includes("static") && (
+          <div>
+            <Input
+              label="Health Check Path"
+              icon={<Activity size={20} />}
+              type="text"
+              placeholder="/healthz (optional)"
+              value={formData.health_check_path ?? ""}
+              onChange={(e) => setFormData({ ...formData, health_check_path: e.target.value })}
+            />
+            <div className="flex items-center gap-2 mt-2 ml-1">
+              <input
+                type="checkbox"
+                id="healthAutoRestart"
+                className="w-3.5 h-3.5 text-forge-600 rounded focus:ring-forge-500 bg-iron-950 border-iron-700 accent-forge-500"
+                checked={!!formData.health_auto_restart}
+                disabled={!formData.health_check_path}
+                onChange={(e) => setFormData({ ...formData, health_auto_restart: e.target.checked })}
+              />
+              <label
+                htmlFor="healthAutoRestart"
+                className="text-xs text-slate-400 cursor-pointer select-none hover:text-white"
+              >
+                Restart automatically when unhealthy
+              </label>
+            </div>
+          </div>
+        )}
+
+        {!formData.language_version.includes("static") && (
+          <div className="flex flex-col gap-2">
+            <label
+              htmlFor="proxy-profile-select"
+              className="text-xs font-bold text-slate-500 uppercase tracking-widest ml-1"
+            >
+              Proxy Profile
+            </label>
+            <div className="relative">
+              <Gauge className="absolute left-3 top-1/2 -translate-y-1/2 text-slate-600" size={20} />
+              <select
+                id="proxy-profile-select"
+                className="w-full p-3 pl-10 border border-iron-800 bg-iron-950 text-slate-200 rounded-md focus:ring-1 focus:ring-forge-500 focus:border-forge-500 outline-none appearance-none font-mono text-sm transition-all"
+                value={formData.proxy_profile ?? ""}
+                onChange={(e) => setFormData({ ...formData, proxy_profile: e.target.value })}
+              >
+                <option value="">default</option>
+                {Object.keys(proxyProfiles ?? {}).map((name) => (
+                  <option key={name} value={name}>
+                    {name}
+                  </option>
+                ))}
+              </select>
+              <ChevronDown
+                className="absolute right-3 top-1/2 -translate-y-1/2 text-slate-600 pointer-events-none"
+                size={16}
+              />
+            </div>
+            <p className="text-xs text-slate-500 ml-1">
+              {formData.proxy_profile && proxyProfiles?.[formData.proxy_profile]
+                ? proxyProfiles[formData.proxy_profile].description
+                : "Plain reverse proxy with Caddy's defaults."}
+            </p>
+          </div>
+        )}
+
+        {!formData.language_version.includes("static") && (
+          <div>
+            <Input
+              label="Log Rate Limit"
+              icon={<FileText size={20} />}
+              type="number"
+              min={0}
+              placeholder="10000 messages per 30s (0 = unlimited)"
+              value={formData.log_rate_limit_burst ?? ""}
+              onChange={(e) =>
+                setFormData({
+                  ...formData,
+                  log_rate_limit_burst: e.target.value === "" ? null : Number(e.target.value),
+                })
+              }
+            />
+            <div className="flex items-center gap-2 mt-2 ml-1">
+              <input
+                type="checkbox"
+                id="logNamespace"
+                className="w-3.5 h-3.5 text-forge-600 rounded focus:ring-forge-500 bg-iron-950 border-iron-700 accent-forge-500"
+                checked={!!formData.log_namespace}
+                onChange={(e) => setFormData({ ...formData, log_namespace: e.target.checked })}
+              />
+              <label
+                htmlFor="logNamespace"
+                className="text-xs text-slate-400 cursor-pointer select-none hover:text-white"
+              >
+                Separate journal (own size cap, keeps a chatty app away from the shared journal)
+              </label>
+            </div>
+          </div>
+        )}
+
+        {formData.language_version.includes("static") && (
+          <div className="flex flex-col gap-2 w-full">
+            <label
+              htmlFor="cacheRules"
+              className="text-xs font-bold text-slate-500 uppercase tracking-widest ml-1"
+            >
+              Cache Rules
+            </label>
+            <textarea
+              id="cacheRules"
+              rows={3}
+              className="flex w-full rounded-md border p-3 text-sm bg-iron-950 border-iron-800 text-slate-200 placeholder:text-slate-500 font-mono focus:border-forge-500 focus:ring-1 focus:ring-forge-500 focus:outline-none transition-all"
+              placeholder={"/sw.js no-store\n/images/* public, max-age=86400"}
+              value={formData.cache_rules ?? ""}
+              onChange={(e) => setFormData({ ...formData, cache_rules: e.target.value })}
+            />
+            <p className="text-xs text-slate-500 ml-1">
+              One "path Cache-Control" per line, first match wins. Fingerprinted assets are immutable
+              and everything else is revalidated by default.
+            </p>
+          </div>
+        )}
+
+        <div>
+          <Input
+            label="Watch Paths"
+            icon={<FolderTree size={20} />}
+            type="text"
+            placeholder="apps/web packages/ui (optional)"
+            value={formData.watch_paths ?? ""}
+            onChange={(e) => setFormData({ ...formData, watch_paths: e.target.value })}
+          />
+          <p className="text-xs text-slate-500 ml-1 mt-2">
+            Push webhooks only redeploy when a commit touches one of these directories.
+          </p>
+        </div>
+
+        <Input
+          label="Webhook Secret"
+          icon={<KeyRound size={20} />}
+          type="password"
+          placeholder="Secret set on the GitHub/GitLab webhook (optional)"
+          value={formData.webhook_secret ?? ""}
+          onChange={(e) => setFormData({ ...formData, webhook_secret: e.target.value })}
+        />
+
         <Button
           type="submit"
           disabled={deployMutation.isPending}
@@ -9,4 +9,47 @@ export interface App {
   start_command: string;
   deploy_token?: string;
   status: string;
+  memory_max?: string | null;
+  memory_high?: string | null;
+  cpu_quota?: string | null;
+  cpu_weight?: number | null;
+  io_weight?: number | null;
+  tasks_max?: string | null;
+  placement_class?: "dedicated" | "shared" | "best-effort" | null;
+  allowed_cpus?: string | null;
+  allowed_memory_nodes?: string | null;
+  health_check_path?: string | null;
+  health_auto_restart?: boolean;
+  health?: "healthy" | "degraded" | "unhealthy" | null;
+  node?: string | null;
+  cache_rules?: string | null;
+  immutable_paths?: string | null;
+  static_enabled?: boolean;
+  published_root?: string | null;
+  proxy_profile?: string | null;
+  deployed_commit?: string | null;
+  webhook_secret?: string | null;
+  watch_paths?: string | null;
+  log_rate_limit_burst?: number | null;
+  log_namespace?: boolean;
+}
+
+export interface ProxyProfile {
+  description: string;
+  encode: boolean;
+  proxy: Record<string, string>;
+  transport: Record<string, string>;
+}
+
+export interface TrafficWindow {
+  requests: number;
+  status: Record<"1xx" | "2xx" | "3xx" | "4xx" | "5xx", number>;
+  error_rate: number;
+  latency_ms: { p50: number | null; p95: number | null; p99: number | null };
+}
+
+export interface AppTraffic {
+  rps: number;
+  last_5m: TrafficWindow;
+  last_15m: TrafficWindow;
 }